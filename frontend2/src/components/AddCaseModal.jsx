@@ -1,10 +1,15 @@
 import { useState, useEffect, useRef } from "react";
-import { collection, addDoc, getDocs, doc, setDoc, serverTimestamp } from "firebase/firestore";
+import { collection, addDoc, getDocs, doc, setDoc, serverTimestamp, query, where, limit } from "firebase/firestore";
 import { db } from "../firebase.js";
+import { loadTopCustomers, searchCustomers } from "../utils/customerSearch.js";
+import { shardBucket } from "../utils/shardBucket.js";
 
 const AddCaseModal = ({ onClose }) => {
   const [loading, setLoading] = useState(false);
-  const [existingCompanies, setExistingCompanies] = useState([]);
+  const [existingCompanies, setExistingCompanies] = useState([]); // full list, only used until the search index exists
+  const [indexed, setIndexed] = useState(false);
+  const [topCompanies, setTopCompanies] = useState([]); // largest accounts, listed before anything is typed
+  const latestSearch = useRef(""); // ignore index lookups that finish after a newer keystroke
   
   // --- NEW: Search States ---
   const [showSuggestions, setShowSuggestions] = useState(false);
@@ -26,9 +31,22 @@ const AddCaseModal = ({ onClose }) => {
     else return 15;
   };
 
+  // Search index entries -> the { id, name, late_payment_ratio } shape used below
+  const toCompany = (c) => ({ id: c.id, name: c.company_name, late_payment_ratio: c.late_payment_ratio || 0 });
+
   useEffect(() => {
     const fetchCompanies = async () => {
       try {
+        const top = await loadTopCustomers();
+        if (top) {
+          const companies = top.filter(c => c.company_name).map(toCompany);
+          setIndexed(true);
+          setTopCompanies(companies);
+          setFilteredCompanies(companies);
+          return;
+        }
+
+        // No index yet (before the first ML run): load every company
         const snapshot = await getDocs(collection(db, "company_features"));
         const list = [];
         snapshot.forEach(doc => {
@@ -66,12 +84,43 @@ const AddCaseModal = ({ onClose }) => {
     const val = e.target.value;
     setFormData({ ...formData, customer_name: val });
     
+    setShowSuggestions(true);
+    if (indexed) {
+      latestSearch.current = val;
+      if (!val.trim()) {
+        setFilteredCompanies(topCompanies);
+        return;
+      }
+      searchCustomers(val)
+        .then(({ customers }) => {
+          if (latestSearch.current !== val) return;
+          setFilteredCompanies(customers.filter(c => c.company_name).map(toCompany));
+        })
+        .catch(err => console.error("Error searching companies:", err));
+      return;
+    }
+
     // Filter the list based on typing
     const matches = existingCompanies.filter(c => 
         c.name.toLowerCase().includes(val.toLowerCase())
     );
     setFilteredCompanies(matches);
-    setShowSuggestions(true);
+  };
+
+  // Existing company with this name (case-insensitive), or undefined
+  const findCompany = async (name) => {
+    if (!indexed) {
+      return existingCompanies.find(c => c.name.toLowerCase() === name.toLowerCase());
+    }
+    const { customers } = await searchCustomers(name);
+    const hit = customers.find(c => (c.company_name || "").toLowerCase() === name.toLowerCase());
+    if (hit) return toCompany(hit);
+
+    // Companies added since the last ML run aren't indexed yet
+    const snapshot = await getDocs(query(collection(db, "company_features"), where("company_name", "==", name), limit(1)));
+    if (snapshot.empty) return undefined;
+    const data = snapshot.docs[0].data();
+    return { id: snapshot.docs[0].id, name: data.company_name, late_payment_ratio: data.late_payment_ratio || 0 };
   };
 
   // --- NEW: Handle Selection from Dropdown ---
@@ -87,9 +136,7 @@ const AddCaseModal = ({ onClose }) => {
     try {
       const cleanName = formData.customer_name.trim();
       
-      const match = existingCompanies.find(
-          c => c.name.toLowerCase() === cleanName.toLowerCase()
-      );
+      const match = await findCompany(cleanName);
 
       let finalCustNumber = "";
       let currentLateRatio = 0.0;
@@ -116,6 +163,7 @@ const AddCaseModal = ({ onClose }) => {
         invoice_id: formData.invoice_id,
         name_customer: cleanName,
         cust_number: finalCustNumber,
+        shard_bucket: shardBucket(finalCustNumber),
         total_open_amount: amountVal,
         original_amount: amountVal,
         due_date: formData.due_date,
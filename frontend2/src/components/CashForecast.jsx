@@ -1,35 +1,59 @@
-import React from 'react';
+import React, { useEffect, useState } from 'react';
+import { doc, onSnapshot } from 'firebase/firestore';
+import { db } from '../firebase.js';
 
 const CashForecast = ({ cases }) => {
-  // 1. Setup Buckets
+  // 1. Precomputed forecast (written by the ML job's forecast stage)
+  const [summary, setSummary] = useState(null);
+
+  useEffect(() => {
+    const unsubscribe = onSnapshot(
+      doc(db, 'cash_forecast', 'summary'),
+      (snap) => setSummary(snap.exists() ? snap.data() : null),
+      (err) => console.error('Forecast load failed:', err)
+    );
+    return () => unsubscribe();
+  }, []);
+
+  // 2. Setup Buckets
   let thisWeekSum = 0;
   let nextWeekSum = 0;
   let totalPipeline = 0;
-  
-  const today = new Date();
-  const nextWeek = new Date(today);
-  nextWeek.setDate(today.getDate() + 7); // 7 days from now
+  let predictionCount = cases.length;
+  let range = null;
 
-  // 2. Process Data
-  cases.forEach(c => {
-    // Only look at OPEN cases that have a valid prediction
-    // We check for 'is_open_flag' or fallback logic (amount > 0)
-    const isOpen = c.isOpen !== '0' && c.outstanding_amount > 0;
-    
-    if (isOpen && c.predicted_payment_date && c.predicted_payment_date !== "—") {
-      const pDate = new Date(c.predicted_payment_date);
-      const amount = Number(c.outstanding_amount || 0);
+  if (summary) {
+    thisWeekSum = summary.next_7_days || 0;
+    nextWeekSum = summary.pipeline_later || 0;
+    totalPipeline = summary.total_pipeline || 0;
+    predictionCount = summary.invoice_count || 0;
+    range = [summary.next_7_days_low || 0, summary.next_7_days_high || 0];
+  } else {
+    // Fallback until the first forecast run: derive it from the loaded cases
+    const today = new Date();
+    const nextWeek = new Date(today);
+    nextWeek.setDate(today.getDate() + 7); // 7 days from now
+
+    cases.forEach(c => {
+      // Only look at OPEN cases that have a valid prediction
+      // We check for 'is_open_flag' or fallback logic (amount > 0)
+      const isOpen = c.isOpen !== '0' && c.outstanding_amount > 0;
+      
+      if (isOpen && c.predicted_payment_date && c.predicted_payment_date !== "—") {
+        const pDate = new Date(c.predicted_payment_date);
+        const amount = Number(c.outstanding_amount || 0);
 
-      totalPipeline += amount;
+        totalPipeline += amount;
 
-      // Bucket Logic
-      if (pDate <= nextWeek) {
-        thisWeekSum += amount;
-      } else {
-        nextWeekSum += amount;
+        // Bucket Logic
+        if (pDate <= nextWeek) {
+          thisWeekSum += amount;
+        } else {
+          nextWeekSum += amount;
+        }
       }
-    }
-  });
+    });
+  }
 
   // 3. Render Widget
   return (
@@ -45,8 +69,13 @@ const CashForecast = ({ cases }) => {
         <div style={styles.bigNumber}>
           ${thisWeekSum.toLocaleString(undefined, {minimumFractionDigits: 0, maximumFractionDigits: 0})}
         </div>
+        {range && (
+          <div style={styles.subText}>
+            Range: ${range[0].toLocaleString(undefined, {maximumFractionDigits: 0})} – ${range[1].toLocaleString(undefined, {maximumFractionDigits: 0})}
+          </div>
+        )}
         <div style={styles.subText}>
-          Based on {cases.length} active predictions
+          Based on {predictionCount} active predictions
         </div>
       </div>
 
@@ -54,7 +83,7 @@ const CashForecast = ({ cases }) => {
       <div style={styles.secondaryBlock}>
         <div style={styles.row}>
             <span style={styles.label}>Pipeline (Later)</span>
-            <span style={styles.value}>${nextWeekSum.toLocaleString()}</span>
+            <span style={styles.value}>${nextWeekSum.toLocaleString(undefined, {maximumFractionDigits: 0})}</span>
         </div>
         <div style={styles.progressBarBg}>
             {/* Visual bar showing how much is coming this week vs total */}
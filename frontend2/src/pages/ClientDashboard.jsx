@@ -1,6 +1,6 @@
 import React, { useEffect, useState, useMemo } from 'react';
 import { db } from '../firebase';
-import { collection, query, where, getDocs } from 'firebase/firestore'; 
+import { collection, query, where, getDocs, doc, getDoc } from 'firebase/firestore'; 
 import { Link, useNavigate } from 'react-router-dom';
 
 // --- HELPER: ZONE STYLES ---
@@ -35,8 +35,35 @@ const ClientDashboard = () => {
       return;
     }
 
+    const showCases = (fetchedCases) => {
+      setCases(fetchedCases);
+      if (fetchedCases.length > 0) {
+        const firstName = fetchedCases[0].name_customer || "";
+        setParentName(firstName.split(" ")[0] || "Company");
+      }
+    };
+
     const fetchClientCases = async () => {
       try {
+        // 1. Instant render from the customer summary (written by the ML job)
+        const summarySnap = await getDoc(doc(db, "customer_summaries", clientId));
+        if (summarySnap.exists()) {
+          showCases((summarySnap.data().open_invoices || []).map(inv => ({
+            id: inv.id,
+            invoice_id: inv.invoice_id,
+            name_customer: inv.name,
+            document_type: inv.document_type,
+            due_date: inv.due,
+            total_open_amount: inv.amount,
+            invoice_currency: inv.currency,
+            zone: inv.zone,
+            predicted_delay: inv.predicted_delay,
+          })));
+          setLoading(false);
+        }
+
+        // 2. Live open invoices (payments since the last ML run must not show as due).
+        //    Filtered here, not in the query: isOpen is stored as "1", 1 or true depending on the source.
         const casesRef = collection(db, "cases");
         const q = query(casesRef, where("cust_number", "==", clientId));
         const snapshot = await getDocs(q);
@@ -50,12 +77,7 @@ const ClientDashboard = () => {
              return dateB.localeCompare(dateA);
           });
 
-        setCases(fetchedCases);
-
-        if (fetchedCases.length > 0) {
-          const firstName = fetchedCases[0].name_customer || "";
-          setParentName(firstName.split(" ")[0] || "Company");
-        }
+        showCases(fetchedCases);
       } catch (error) {
         console.error("Error fetching client cases:", error);
       } finally {
@@ -15,11 +15,36 @@ import {
 } from "firebase/firestore";
 import { db } from "../firebase.js";
 
+// All of a customer's cases (newest first) and its branch names
+const fetchCustomerCases = async (customerId) => {
+  const q = query(
+    collection(db, "cases"),
+    where("cust_number", "==", customerId),
+    orderBy("document_create_date", "desc")
+  );
+  const querySnapshot = await getDocs(q);
+  const invList = [];
+  const namesSet = new Set();
+
+  querySnapshot.forEach((doc) => {
+    const data = doc.data();
+    invList.push({ id: doc.id, ...data });
+    if (data.name_customer) namesSet.add(data.name_customer.trim());
+  });
+  return { invList, names: Array.from(namesSet).sort() };
+};
+
 const CustomerProfile = () => {
   const { customerId } = useParams();
   const navigate = useNavigate();
   const [profile, setProfile] = useState(null);
   const [allInvoices, setAllInvoices] = useState([]); // Store ALL invoices
+  const [summary, setSummary] = useState(null); // customer_summaries doc (written by the ML job)
+  // With a summary, the list and totals are the summary's (as of its ML run) until the
+  // user asks for more (a branch or "Show all"); then every case is read live
+  const [casesRequested, setCasesRequested] = useState(false);
+  const [casesLoaded, setCasesLoaded] = useState(false); // allInvoices holds every case, not just the summary's
+  const [showAll, setShowAll] = useState(false);
   const [loading, setLoading] = useState(true);
   
   // New State for handling name collisions
@@ -71,31 +96,50 @@ const CustomerProfile = () => {
     }
   };
 
+  // Summary invoice entries -> the case fields this page reads
+  const fromSummary = (inv) => ({
+    id: inv.id,
+    invoice_id: inv.invoice_id,
+    name_customer: inv.name,
+    document_create_date: inv.created,
+    total_open_amount: inv.open ? inv.amount : 0,
+    original_amount: inv.original_amount,
+    invoice_currency: inv.currency,
+    is_open_flag: inv.open,
+    isOpen: inv.open ? "1" : "0",
+    zone: inv.zone,
+  });
+
   useEffect(() => {
     const fetchData = async () => {
       try {
+        // 1 read: profile, totals, branches and latest invoices, precomputed per customer
+        const summarySnap = await getDoc(doc(db, "customer_summaries", customerId));
+        if (summarySnap.exists()) {
+          const data = summarySnap.data();
+          setProfile(data);
+          setSummary(data);
+          setAllInvoices((data.recent_invoices || []).map(fromSummary));
+          setCasesRequested(false);
+          setCasesLoaded(false);
+
+          const uniqueNames = Array.from(new Set((data.entities || []).map(e => e.name.trim()))).sort();
+          if (uniqueNames.length > 1) {
+              setSubEntities(["All", ...uniqueNames]);
+          }
+          return;
+        }
+
+        // No summary yet (customer added since the last ML run): read profile and cases directly
         const docRef = doc(db, "company_features", customerId);
         const docSnap = await getDoc(docRef);
         if (docSnap.exists()) setProfile(docSnap.data());
 
-        const q = query(
-          collection(db, "cases"),
-          where("cust_number", "==", customerId),
-          orderBy("document_create_date", "desc")
-        );
-        const querySnapshot = await getDocs(q);
-        const invList = [];
-        const namesSet = new Set();
-
-        querySnapshot.forEach((doc) => {
-          const data = doc.data();
-          invList.push({ id: doc.id, ...data });
-          if (data.name_customer) namesSet.add(data.name_customer.trim());
-        });
-
+        const { invList, names: uniqueNames } = await fetchCustomerCases(customerId);
         setAllInvoices(invList);
+        setCasesRequested(true);
+        setCasesLoaded(true);
         
-        const uniqueNames = Array.from(namesSet).sort();
         if (uniqueNames.length > 1) {
             setSubEntities(["All", ...uniqueNames]);
         }
@@ -109,14 +153,43 @@ const CustomerProfile = () => {
     fetchData();
   }, [customerId]);
 
+  // The summary only lists the latest invoices across all branches (a branch may have
+  // none of them): read the customer's cases once a branch or "Show all" is picked
+  useEffect(() => {
+    if (!summary || casesRequested || (selectedEntity === "All" && !showAll)) return;
+    setCasesRequested(true);
+    fetchCustomerCases(customerId)
+      .then(({ invList }) => {
+        setAllInvoices(invList);
+        setCasesLoaded(true);
+      })
+      .catch((error) => {
+        console.error("Error fetching customer invoices:", error);
+        setShowAll(false);
+      });
+  }, [summary, casesRequested, selectedEntity, showAll, customerId]);
+
+  // Summary figures until the live cases are in (payments since the ML run included)
+  const fromSummaryOnly = summary !== null && !casesLoaded;
+
   // Filter invoices based on selection
   const filteredInvoices = useMemo(() => {
       if (selectedEntity === "All") return allInvoices;
-      return allInvoices.filter(inv => inv.name_customer?.trim() === selectedEntity);
+      // the summary lists cases without a name under "Unknown"
+      return allInvoices.filter(inv => (inv.name_customer?.trim() || "Unknown") === selectedEntity);
   }, [selectedEntity, allInvoices]);
 
   // --- NEW: CALCULATE TOTAL DEBT DYNAMICALLY ---
-  const { totalDebt, openCount } = useMemo(() => {
+  const { totalDebt, openCount, invoiceCount } = useMemo(() => {
+    if (fromSummaryOnly) {
+        const entities = (summary.entities || []).filter(e => selectedEntity === "All" || e.name.trim() === selectedEntity);
+        return {
+            totalDebt: entities.reduce((sum, e) => sum + e.open_amount, 0),
+            openCount: entities.reduce((sum, e) => sum + e.open_count, 0),
+            invoiceCount: entities.reduce((sum, e) => sum + e.invoices, 0),
+        };
+    }
+
     let debt = 0;
     let count = 0;
 
@@ -135,8 +208,8 @@ const CustomerProfile = () => {
         }
     });
 
-    return { totalDebt: debt, openCount: count };
-  }, [filteredInvoices]);
+    return { totalDebt: debt, openCount: count, invoiceCount: filteredInvoices.length };
+  }, [filteredInvoices, summary, selectedEntity, fromSummaryOnly]);
 
   if (loading) return <div style={{ padding: 40 }}>Loading...</div>;
   if (!profile) return <div style={{ padding: 40 }}>Profile Not Found</div>;
@@ -203,7 +276,7 @@ const CustomerProfile = () => {
                     ${totalDebt.toLocaleString(undefined, { minimumFractionDigits: 2, maximumFractionDigits: 2 })}
                 </div>
                 <div style={styles.debtSub}>
-                    Across {openCount} open invoices
+                    Across {openCount} open invoices{fromSummaryOnly && ` · as of ${summary.as_of}`}
                 </div>
             </div>
             {/* ---------------------------------- */}
@@ -288,9 +361,18 @@ const CustomerProfile = () => {
         {/* RIGHT COLUMN: INVOICE LIST */}
         <div style={styles.card}>
           <div style={{display:'flex', justifyContent:'space-between', alignItems:'center'}}>
-            <h3>🗂 Invoices ({filteredInvoices.length})</h3>
+            <h3>🗂 Invoices ({invoiceCount})</h3>
             {selectedEntity !== 'All' && <span style={{fontSize:'12px', color:'#64748b'}}>Filtered by: {selectedEntity}</span>}
           </div>
+          <div style={styles.listNote}>
+            {showAll && casesLoaded
+              ? `All ${filteredInvoices.length} invoices`
+              : `Latest ${Math.min(filteredInvoices.length, 10)}${fromSummaryOnly ? ` as of ${summary.as_of}` : ""}`}
+            {!showAll && invoiceCount > Math.min(filteredInvoices.length, 10) && (
+              <button onClick={() => setShowAll(true)} style={styles.linkBtn}>Show all</button>
+            )}
+            {showAll && !casesLoaded && <span> · loading...</span>}
+          </div>
           
           <div style={styles.tableWrapper}>
             <table style={styles.table}>
@@ -302,7 +384,7 @@ const CustomerProfile = () => {
                 </tr>
               </thead>
               <tbody>
-                  {filteredInvoices.slice(0, 10).map((inv) => {
+                  {(showAll && casesLoaded ? filteredInvoices : filteredInvoices.slice(0, 10)).map((inv) => {
                     // 🟢 ROBUST AMOUNT DISPLAY LOGIC
                     const currentAmount = Number(inv.total_open_amount || 0);
                     const originalAmount = Number(inv.original_amount || inv.invoice_amount || currentAmount);
@@ -358,6 +440,9 @@ const styles = {
   warnBadge: { background: "#ffedd5", color: "#9a3412", padding: "6px 12px", borderRadius: "20px", fontSize: "12px", fontWeight: "bold" },
   goodBadge: { background: "#dcfce7", color: "#166534", padding: "6px 12px", borderRadius: "20px", fontSize: "12px", fontWeight: "bold" },
   
+  listNote: { fontSize: '12px', color: '#94a3b8', marginBottom: '8px' },
+  linkBtn: { background: 'none', border: 'none', color: '#3b82f6', cursor: 'pointer', fontSize: '12px', fontWeight: '600', marginLeft: '8px', padding: 0 },
+
   filterBtn: { border: 'none', padding: '6px 16px', borderRadius: '20px', fontSize: '13px', cursor: 'pointer', marginRight: '8px', fontWeight: '500', transition: 'all 0.2s' },
 
   grid: { display: "grid", gridTemplateColumns: "1fr 1fr", gap: "24px" },
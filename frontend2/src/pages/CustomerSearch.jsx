@@ -2,12 +2,19 @@ import { useEffect, useState } from "react";
 import { collection, getDocs } from "firebase/firestore";
 import { db } from "../firebase.js";
 import { useNavigate } from "react-router-dom";
+import { loadTopCustomers, searchCustomers, searchTokens, MIN_PREFIX } from "../utils/customerSearch.js";
 
 const CustomerSearch = () => {
-  const [customers, setCustomers] = useState([]);
+  const [customers, setCustomers] = useState([]); // full directory, only used until the search index exists
   const [searchTerm, setSearchTerm] = useState("");
   const [loading, setLoading] = useState(true);
 
+  // --- SEARCH INDEX STATE (customer_search, built by the ML job) ---
+  const [indexed, setIndexed] = useState(false);
+  const [topCustomers, setTopCustomers] = useState([]);
+  const [results, setResults] = useState([]);
+  const [partial, setPartial] = useState(false);
+
   // --- PAGINATION STATE ---
   const [currentPage, setCurrentPage] = useState(1);
   const itemsPerPage = 20; // Show 9 cards per page (3x3 grid)
@@ -17,6 +24,14 @@ const CustomerSearch = () => {
   useEffect(() => {
     const fetchCustomers = async () => {
       try {
+        const top = await loadTopCustomers();
+        if (top) {
+          setTopCustomers(top);
+          setIndexed(true);
+          return;
+        }
+
+        // No index yet (before the first ML run): scan the directory
         const querySnapshot = await getDocs(collection(db, "company_features"));
         const list = [];
         querySnapshot.forEach((doc) => {
@@ -33,8 +48,30 @@ const CustomerSearch = () => {
     fetchCustomers();
   }, []);
 
-  // 1. FILTER Logic
-  const filtered = customers.filter(c => 
+  // 1. SEARCH (index lookups: a few small docs per query)
+  const isBrowsing = !searchTokens(searchTerm).some(t => t.length >= MIN_PREFIX);
+
+  useEffect(() => {
+    if (!indexed) return;
+    if (isBrowsing) {
+      setResults(topCustomers);
+      setPartial(false);
+      return;
+    }
+
+    let cancelled = false;
+    searchCustomers(searchTerm)
+      .then(({ customers: matches, partial: capped }) => {
+        if (cancelled) return;
+        setResults(matches);
+        setPartial(capped);
+      })
+      .catch(error => console.error("Error searching customers:", error));
+    return () => { cancelled = true; };
+  }, [searchTerm, indexed, isBrowsing, topCustomers]);
+
+  // 1b. FILTER Logic (no index yet)
+  const filtered = indexed ? results : customers.filter(c => 
     (c.company_name || "").toLowerCase().includes(searchTerm.toLowerCase()) ||
     (c.cust_number || "").includes(searchTerm)
   );
@@ -80,6 +117,8 @@ const CustomerSearch = () => {
            <>
              <div style={styles.countText}>
                 Showing {filtered.length > 0 ? indexOfFirstItem + 1 : 0}-{Math.min(indexOfLastItem, filtered.length)} of {filtered.length} customers
+                {indexed && isBrowsing && " · largest accounts, type a name or ID to search everyone"}
+                {indexed && !isBrowsing && partial && " · top matches, keep typing to narrow down"}
              </div>
              
              <div style={styles.grid}>
@@ -0,0 +1,68 @@
+import { doc, getDoc } from "firebase/firestore";
+import { db } from "../firebase.js";
+
+// Prefix index written by the ML job (see build_search_index in ml/ml_job.py)
+const INDEX_COLLECTION = "customer_search";
+export const MIN_PREFIX = 2;
+
+// Same split as search_tokens() in ml_job.py: lower-cased runs of letters / digits
+export const searchTokens = (text) =>
+  String(text || "").toLowerCase().split(/[^\p{L}\p{N}]+/u).filter(Boolean);
+
+// Index entries in the shape the pages already use for company_features docs
+const toCustomer = (entry) => ({
+  id: entry.id,
+  cust_number: entry.id,
+  company_name: entry.name,
+  late_payment_ratio: entry.late,
+  avg_payment_delay: entry.delay,
+  open_amount: entry.open,
+});
+
+// Prefix docs are cached for the session, so typing more characters re-reads nothing
+const shardCache = new Map();
+const readShard = (prefix) => {
+  if (!shardCache.has(prefix)) {
+    const request = getDoc(doc(db, INDEX_COLLECTION, prefix))
+      .then((snap) => (snap.exists() ? snap.data() : null))
+      .catch((err) => {
+        shardCache.delete(prefix);
+        throw err;
+      });
+    shardCache.set(prefix, request);
+  }
+  return shardCache.get(prefix);
+};
+
+/**
+ * Largest accounts, shown before anything is typed.
+ * Resolves to null when the index hasn't been built yet (callers fall back to a full scan).
+ */
+export const loadTopCustomers = async () => {
+  const top = await readShard("_top");
+  return top ? top.entries.map(toCustomer) : null;
+};
+
+/**
+ * Looks `term` up in the index: one doc for the first characters of its longest word,
+ * one more per character while that doc is split. Returns { customers, partial };
+ * `partial` means the doc was capped, so typing more may surface other matches.
+ */
+export const searchCustomers = async (term) => {
+  const tokens = searchTokens(term);
+  if (tokens.length === 0) return { customers: [], partial: false };
+
+  const key = tokens.reduce((a, b) => (b.length > a.length ? b : a));
+  let prefix = key.slice(0, MIN_PREFIX);
+  let shard = await readShard(prefix);
+  while (shard && shard.split && key.length > prefix.length) {
+    prefix = key.slice(0, prefix.length + 1);
+    shard = await readShard(prefix);
+  }
+  if (!shard) return { customers: [], partial: false };
+
+  const matches = shard.entries.filter((entry) =>
+    tokens.every((q) => entry.t.some((t) => t.startsWith(q)))
+  );
+  return { customers: matches.map(toCustomer), partial: shard.count > shard.entries.length };
+};
@@ -0,0 +1,20 @@
+// Same hash as shard_bucket_for() in ml/ml_job.py: sharded ML runs fetch cases by
+// `shard_bucket`, so new cases must carry it from the start
+const SHARD_BUCKETS = 4096;
+
+const CRC_TABLE = Array.from({ length: 256 }, (_, n) => {
+  let c = n;
+  for (let k = 0; k < 8; k++) c = c & 1 ? 0xedb88320 ^ (c >>> 1) : c >>> 1;
+  return c >>> 0;
+});
+
+// zlib.crc32 over the UTF-8 bytes
+const crc32 = (text) => {
+  let crc = 0xffffffff;
+  for (const byte of new TextEncoder().encode(text)) {
+    crc = CRC_TABLE[(crc ^ byte) & 0xff] ^ (crc >>> 8);
+  }
+  return (crc ^ 0xffffffff) >>> 0;
+};
+
+export const shardBucket = (custNumber) => crc32(String(custNumber ?? "")) % SHARD_BUCKETS;
@@ -8,6 +8,7 @@ const {getFirestore} = require("firebase-admin/firestore");
 const axios = require("axios");
 const csv = require("csv-parser");
 const crypto = require("crypto");
+const zlib = require("zlib");
 
 admin.initializeApp();
 const db = getFirestore();
@@ -15,6 +16,8 @@ const db = getFirestore();
 // Ensure this URL points to your UPDATED CSV (raw format)
 const CSV_URL = "https://raw.githubusercontent.com/coutdarknight/dataset/main/dataset.csv";
 const BATCH_SIZE = 500;
+// Same hash as shard_bucket_for() in ml/ml_job.py: sharded ML runs fetch cases by this field
+const SHARD_BUCKETS = 4096;
 
 exports.dailyFedexIngestion = functions
   .runWith({
@@ -70,6 +73,7 @@ exports.dailyFedexIngestion = functions
             {
               business_code: row.business_code || "",
               cust_number: row.cust_number || "",
+              shard_bucket: zlib.crc32(row.cust_number || "") % SHARD_BUCKETS,
               name_customer: row.name_customer || "",
               clear_date: row.clear_date || "",
               buisness_year: row.buisness_year || "",
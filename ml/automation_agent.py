@@ -1,4 +1,6 @@
 import os
+import re
+import argparse
 import time
 import smtplib
 from datetime import datetime
@@ -11,6 +13,10 @@ from google.cloud.firestore import FieldFilter
 from dotenv import load_dotenv
 
 from google import genai
+from google.genai import types
+
+from llm_batcher import AdaptiveBatcher, DEFAULT_BATCH_SIZE
+from outreach_queue import OutreachQueue, default_worker_id
 
 # ==========================================
 # ⚙️ CONFIGURATION
@@ -26,10 +32,17 @@ SENDER_PASSWORD = os.getenv("SENDER_PASSWORD")
 
 # Using the high-limit Gemma model
 MODEL_NAME = "gemma-3-12b-it"
+# Optional override, e.g. a local fake model server for testing
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+# Starting number of cases per LLM request (adapts at runtime; 1 = one request per case)
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", DEFAULT_BATCH_SIZE))
 
 SMTP_SERVER = "smtp.gmail.com"
 SMTP_PORT = 587
 
+MAIL_CHANNEL = "MAIL"
+LEASE_CHUNK = 20  # jobs leased per round trip to the outreach queue
+
 # Point to your frontend (Update this for production)
 PAYMENT_BASE_URL = "http://localhost:5173/pay"
 
@@ -52,32 +65,55 @@ if not firebase_admin._apps:
         firebase_admin.initialize_app(options={'projectId': os.environ.get("GCLOUD_PROJECT")})
 
 db = firestore.client()
-client = genai.Client(api_key=GEMINI_API_KEY)
+http_options = types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None
+client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
 
 # ==========================================
 # 🧠 AI LOGIC
 # ==========================================
 
-def generate_smart_email_content(case_data, doc_id):
+EMAIL_BATCH_TASK = """
+You are an accounts receivable agent for FedEx.
+For each case, write a short email body to the customer named in "company".
+Use "amount_owed" (in $) and "days_late" from the case, and write in the case's "tone".
+
+Guidelines:
+- Do NOT include a subject line.
+- Do NOT use placeholders.
+- Keep each email under 100 words.
+"""
+
+def email_case_fields(case_data):
+    """Prompt inputs shared by the single-case and batched paths."""
     company = case_data.get('name_customer') or case_data.get('company_name') or 'Valued Customer'
     amount = case_data.get('total_open_amount', 0)
     days_late = case_data.get('predicted_delay', 0)
-    
-    # Generate the link
-    payment_link = f"{PAYMENT_BASE_URL}/{doc_id}"
 
     tone = "friendly and helpful"
     if days_late > 7:
         tone = "firm but professional urgency"
-    
+
+    return {"company": company, "amount_owed": amount, "days_late": int(days_late), "tone": tone}
+
+def clean_email_text(text):
+    """Post-processes a generated body; returns None if it doesn't look usable."""
+    text = text.replace("Subject:", "").strip()
+    if not text or len(text.split()) > 150 or re.search(r"\[[^\]]*\]", text):
+        return None
+    return text
+
+def generate_email_text(case_data):
+    fields = email_case_fields(case_data)
+    company, amount = fields["company"], fields["amount_owed"]
+
     prompt = f"""
     You are an accounts receivable agent for FedEx. 
     Write a short email body to a customer named "{company}".
     
     Context:
     - They owe ${amount}.
-    - Our system flags they are {int(days_late)} days late.
-    - Tone needed: {tone}.
+    - Our system flags they are {fields["days_late"]} days late.
+    - Tone needed: {fields["tone"]}.
     
     Guidelines:
     - Do NOT include a subject line.
@@ -85,29 +121,42 @@ def generate_smart_email_content(case_data, doc_id):
     - Keep it under 100 words.
     """
 
-    ai_text = ""
     # Retries for network blips
     max_retries = 2
-    success = False
     for attempt in range(max_retries):
         try:
             response = client.models.generate_content(
                 model=MODEL_NAME, 
                 contents=prompt
             )
-            ai_text = response.text.replace("Subject:", "").strip()
-            success = True
-            break
+            return response.text.replace("Subject:", "").strip()
         except Exception as e:
             print(f"   ⚠️ AI Error (Attempt {attempt+1}): {e}")
             time.sleep(1)
-    
-    if not success:
-        ai_text = f"Dear {company}, friendly reminder regarding the outstanding balance of ${amount}. Please remit payment."
 
+    return f"Dear {company}, friendly reminder regarding the outstanding balance of ${amount}. Please remit payment."
+
+def with_payment_link(ai_text, doc_id):
     # Append the link to the email body
+    payment_link = f"{PAYMENT_BASE_URL}/{doc_id}"
     return f"{ai_text}\n\n👉 Pay Securely Here: {payment_link}\n\nFedEx Automation Team"
 
+def generate_smart_email_content(case_data, doc_id):
+    return with_payment_link(generate_email_text(case_data), doc_id)
+
+def generate_model_text(prompt):
+    return client.models.generate_content(model=MODEL_NAME, contents=prompt).text
+
+def email_batcher(cases_by_key):
+    """Batches email generation for {job key: case_data}; per-case fallback via generate_email_text."""
+    return AdaptiveBatcher(
+        generate_model_text,
+        EMAIL_BATCH_TASK,
+        single_fn=lambda key: generate_email_text(cases_by_key[key]),
+        validate_fn=clean_email_text,
+        batch_size=AI_BATCH_SIZE
+    )
+
 def send_email(to_email, subject, body):
     if not SENDER_EMAIL or "your-email" in SENDER_EMAIL:
         print("   ⚠️ SENDER_EMAIL not set. Skipping actual send.")
@@ -135,9 +184,19 @@ def send_email(to_email, subject, body):
 # 🚀 MAIN LOOP
 # ==========================================
 
-def run_automation():
-    print(f"🤖 Gemini Agent Starting (Model: {MODEL_NAME})...")
-    
+def is_mail_case(data):
+    """Whether a case (None if deleted) still gets an email: open and YELLOW, as enqueue_yellow_cases selects."""
+    return data is not None and data.get("isOpen") == "1" and data.get("zone") == "YELLOW"
+
+def current_cases(case_ids):
+    """The leased cases as they are now: {case_id: data}, None for deleted cases."""
+    refs = [db.collection('cases').document(case_id) for case_id in dict.fromkeys(case_ids)]
+    if not refs:
+        return {}
+    return {snap.id: snap.to_dict() if snap.exists else None for snap in db.get_all(refs)}
+
+def enqueue_yellow_cases(queue):
+    """Adds today's YELLOW cases to the outreach queue (already-queued cases are ignored)."""
     cases_ref = db.collection('cases')
     
     # ----------------------------------------------------
@@ -145,22 +204,15 @@ def run_automation():
     # ----------------------------------------------------
     print("\n--- Fetching Yellow Zone Cases (Emails) ---")
     
-    # We load all IDs into memory instantly, then close the stream.
     yellow_docs = cases_ref.where(filter=FieldFilter("zone", "==", "YELLOW"))\
                            .where(filter=FieldFilter("isOpen", "==", "1"))\
                            .stream()
     
-    yellow_work_queue = []
+    found = 0
+    added = 0
     for doc in yellow_docs:
-        yellow_work_queue.append({"id": doc.id, "data": doc.to_dict()})
-        
-    print(f"📋 Found {len(yellow_work_queue)} cases. Processing...")
-    
-    email_count = 0
-    
-    for task in yellow_work_queue:
-        doc_id = task["id"]
-        data = task["data"]
+        found += 1
+        data = doc.to_dict()
         company = data.get('name_customer') or data.get('company_name') or 'Client'
         
         # 🛡️ Spam Check / Date Check (Restored)
@@ -176,43 +228,138 @@ def run_automation():
                 print(f"   ⏭️  Skipping {company} (Already contacted today)")
                 continue
 
-        sanitized_company = company.strip().replace(" ", "").replace(",", "").lower()
-        target_email = f"{sanitized_company}@doesnotexistxyz.com"
-        
-        print(f"   ✨ Generating for {company}...")
-        
-        # Generate content with Payment Link
-        email_body = generate_smart_email_content(data, doc_id)
-        
-        # Debug print for the link (optional, but helpful)
-        print(f"   🔗 [GENERATED LINK] {PAYMENT_BASE_URL}/{doc_id}")
+        if queue.enqueue(doc.id, MAIL_CHANNEL, data):
+            added += 1
+
+    print(f"📋 Found {found} cases, queued {added} new emails.")
+    return added
+
+def record_sent_email(job):
+    """Firestore bookkeeping for a sent email. Idempotent, so it is safe to redo after a crash."""
+    doc_id = job["case_id"]
+    data = job["payload"]
+    company = data.get('name_customer') or data.get('company_name') or 'Client'
+
+    # Log to Firestore (keyed by the job so a retry overwrites instead of duplicating)
+    db.collection('ai_logs').document(job["idempotency_key"]).set({
+        "type": "MAIL",
+        "company_name": company,
+        "target": job["result"]["target"],
+        "content": job["content"],
+        "status": "Sent",
+        "timestamp": firestore.SERVER_TIMESTAMP,
+        "case_id": doc_id
+    })
+    
+    db.collection('cases').document(doc_id).update({
+        "history_logs": firestore.ArrayUnion([{
+            "date": job["sent_at"],
+            "action": "🤖 AI Email",
+            "note": "Payment Link Included",
+            "status": "Sent"
+        }]),
+        "last_contacted_at": firestore.SERVER_TIMESTAMP
+    })
+
+def drain_mail_queue(queue, worker_id=None):
+    """
+    Leases MAIL jobs until none are ready. Safe to run in several processes at once.
+    Retries due within RETRY_WAIT_SECONDS are waited for; later backoffs are left to the next run.
+    """
+    worker_id = worker_id or default_worker_id()
+    email_count = 0
+    cases_by_key = {}
+    batcher = email_batcher(cases_by_key)
+
+    while True:
+        jobs = queue.lease(MAIL_CHANNEL, worker_id, limit=LEASE_CHUNK)
+        if not jobs:
+            if queue.wait_for_retries(MAIL_CHANNEL):
+                continue
+            break
+        # keyed by job, not case: one lease can hold several days' jobs for the same case
+        jobs_by_key = {job["idempotency_key"]: job for job in jobs}
+
+        # ♻️ Sent before a crash: only finish the bookkeeping
+        for job in jobs:
+            if job["sent_at"]:
+                try:
+                    record_sent_email(job)
+                    queue.complete(job["idempotency_key"], worker_id)
+                except Exception as e:
+                    queue.fail(job["idempotency_key"], worker_id, e)
+
+        # 🔄 Send from the case as it is now: a retry from an earlier run may be paid or out of YELLOW by now
+        unsent = [job for job in jobs if not job["sent_at"]]
+        unsent = queue.supersede_stale(unsent, worker_id, current_cases(job["case_id"] for job in unsent), is_mail_case)
 
-        # Send Real Email
-        if send_email(target_email, f"Payment Action Required: Invoice #{data.get('invoice_id')}", email_body):
-            email_count += 1
+        cases_by_key.clear()
+        cases_by_key.update({job["idempotency_key"]: job["payload"] for job in unsent})
+        print(f"   ✨ Generating {len(cases_by_key)} emails (batch size {batcher.batch_size}, adaptive)...")
+
+        # Bodies arrive batch by batch; send each as soon as it is ready
+        for key, ai_text in batcher.stream((key, email_case_fields(data)) for key, data in cases_by_key.items()):
+            job = jobs_by_key[key]
+            doc_id = job["case_id"]
+            data = job["payload"]
+            company = data.get('name_customer') or data.get('company_name') or 'Client'
+
+            sanitized_company = company.strip().replace(" ", "").replace(",", "").lower()
+            target_email = f"{sanitized_company}@doesnotexistxyz.com"
             
-            # Log to Firestore
-            db.collection('ai_logs').add({
-                "type": "MAIL",
-                "company_name": company,
-                "target": target_email,
-                "content": email_body,
-                "status": "Sent",
-                "timestamp": firestore.SERVER_TIMESTAMP,
-                "case_id": doc_id
-            })
+            # Content with Payment Link
+            email_body = with_payment_link(ai_text, doc_id)
             
-            db.collection('cases').document(doc_id).update({
-                "history_logs": firestore.ArrayUnion([{
-                    "date": datetime.now().isoformat(),
-                    "action": "🤖 AI Email",
-                    "note": "Payment Link Included",
-                    "status": "Sent"
-                }]),
-                "last_contacted_at": firestore.SERVER_TIMESTAMP
-            })
+            # Debug print for the link (optional, but helpful)
+            print(f"   🔗 [GENERATED LINK] {PAYMENT_BASE_URL}/{doc_id}")
+
+            try:
+                # 🔒 Only send while we still hold the lease (a slow batch may have outlived it)
+                if not queue.renew(key, worker_id):
+                    print(f"   ⏭️  Lease on {key} lost, leaving it to its new owner")
+                    continue
+                # Send Real Email
+                if not send_email(target_email, f"Payment Action Required: Invoice #{data.get('invoice_id')}", email_body):
+                    queue.fail(key, worker_id, "Email send failed")
+                    continue
+                email_count += 1
+                job["sent_at"] = queue.mark_sent(key, worker_id, email_body, {"target": target_email})
+                if job["sent_at"] is None:
+                    print(f"   ⚠️ Lease on {key} lost right after sending; not recording it twice")
+                    continue
+                job["content"] = email_body
+                job["result"] = {"target": target_email}
+                record_sent_email(job)
+                queue.complete(key, worker_id)
+            except Exception as e:
+                print(f"   ❌ Job {key} failed: {e}")
+                queue.fail(key, worker_id, e)
+
+    print(f"   🧠 AI requests: {batcher.stats['requests']} batched, {batcher.stats['single']} single-case "
+          f"({batcher.stats['batched']} emails from batches, {batcher.stats['errors']} errors)")
+    return email_count
+
+def run_automation(enqueue=True, drain=True):
+    print(f"🤖 Gemini Agent Starting (Model: {MODEL_NAME})...")
+
+    queue = OutreachQueue()
+    try:
+        if enqueue:
+            enqueue_yellow_cases(queue)
+        email_count = drain_mail_queue(queue) if drain else 0
+        print(f"📬 Queue: {queue.counts(MAIL_CHANNEL)}")
+    finally:
+        queue.close()
 
     print(f"\n✅ Automation Complete. Sent {email_count} emails.")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Send AI reminder emails for YELLOW zone cases.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--enqueue-only", action="store_true", help="Only queue today's cases")
+    mode.add_argument("--drain-only", action="store_true", help="Only work the queue (extra worker process)")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    run_automation()
\ No newline at end of file
+    args = parse_args()
+    run_automation(enqueue=not args.drain_only, drain=not args.enqueue_only)
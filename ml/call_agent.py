@@ -1,13 +1,18 @@
 import os
 import time
+import argparse
 from datetime import datetime
 import firebase_admin
 from firebase_admin import firestore, credentials
 from google.cloud.firestore import FieldFilter
 from dotenv import load_dotenv
 from google import genai
+from google.genai import types
 from gtts import gTTS  # The Text-to-Speech library
 
+from llm_batcher import AdaptiveBatcher, DEFAULT_BATCH_SIZE
+from outreach_queue import OutreachQueue, default_worker_id
+
 # ==========================================
 # ⚙️ CONFIGURATION
 # ==========================================
@@ -18,6 +23,13 @@ load_dotenv(env_path)
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL_NAME = "gemma-3-12b-it"
+# Optional override, e.g. a local fake model server for testing
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+# Starting number of cases per LLM request (adapts at runtime; 1 = one request per case)
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+
+CALL_CHANNEL = "CALL"
+LEASE_CHUNK = 20  # jobs leased per round trip to the outreach queue
 
 # ⚠️ HACKATHON CONFIG: Path to your React App's 'public' folder
 # This ensures the audio files are accessible by the frontend immediately.
@@ -47,7 +59,8 @@ if not firebase_admin._apps:
         firebase_admin.initialize_app(options={'projectId': os.environ.get("GCLOUD_PROJECT")})
 
 db = firestore.client()
-client = genai.Client(api_key=GEMINI_API_KEY)
+http_options = types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None
+client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
 
 # ==========================================
 # 🧠 AI & AUDIO LOGIC
@@ -75,6 +88,40 @@ def generate_call_script(case_data):
         print(f"   ⚠️ AI Error: {e}")
         return f"Hello, this is a message for {company}. You have an outstanding balance of {amount} dollars. Please contact us immediately."
 
+CALL_BATCH_TASK = """
+You are an automated voice agent for a debt collection agency.
+For each case, write a VERY short phone script (maximum 2 sentences) to leave a voicemail for the customer named in "company".
+
+Details:
+- Amount owed: "amount_owed" from the case, in $
+- Tone: Urgent but polite.
+- Start directly with "Hello, this is a message for..."
+- Do NOT include scene descriptions like [pause] or (excited). Just the spoken words.
+"""
+
+def call_case_fields(case_data):
+    return {
+        "company": case_data.get('name_customer') or 'the client',
+        "amount_owed": case_data.get('total_open_amount', 0)
+    }
+
+def clean_call_script(text):
+    """Post-processes a batched script; returns None if it doesn't look speakable."""
+    text = text.replace('"', '').strip()
+    if not text.lower().startswith("hello") or "[" in text or len(text.split()) > 80:
+        return None
+    return text
+
+def call_batcher(cases_by_key):
+    """Batches script generation for {job key: case_data}; per-case fallback via generate_call_script."""
+    return AdaptiveBatcher(
+        lambda prompt: client.models.generate_content(model=MODEL_NAME, contents=prompt).text,
+        CALL_BATCH_TASK,
+        single_fn=lambda key: generate_call_script(cases_by_key[key]),
+        validate_fn=clean_call_script,
+        batch_size=AI_BATCH_SIZE
+    )
+
 def create_audio_file(text, doc_id):
     """Generates MP3 and returns the relative path for the frontend"""
     try:
@@ -96,9 +143,19 @@ def create_audio_file(text, doc_id):
 # 🚀 MAIN LOOP
 # ==========================================
 
-def run_call_automation():
-    print(f"📞 Call Agent Starting (Model: {MODEL_NAME})...")
-    
+def is_call_case(data):
+    """Whether a case (None if deleted) still gets a call: open and ORANGE, as enqueue_orange_cases selects."""
+    return data is not None and data.get("isOpen") == "1" and data.get("zone") == "ORANGE"
+
+def current_cases(case_ids):
+    """The leased cases as they are now: {case_id: data}, None for deleted cases."""
+    refs = [db.collection('cases').document(case_id) for case_id in dict.fromkeys(case_ids)]
+    if not refs:
+        return {}
+    return {snap.id: snap.to_dict() if snap.exists else None for snap in db.get_all(refs)}
+
+def enqueue_orange_cases(queue):
+    """Adds today's ORANGE cases to the outreach queue (already-queued cases are ignored)."""
     cases_ref = db.collection('cases')
     
     print("\n--- Fetching Orange Zone Cases (Calls) ---")
@@ -108,14 +165,11 @@ def run_call_automation():
                            .where(filter=FieldFilter("isOpen", "==", "1"))\
                            .stream()
     
-    work_queue = [{"id": d.id, "data": d.to_dict()} for d in orange_docs]
-    print(f"📋 Found {len(work_queue)} calls to process...")
-    
-    processed_count = 0
-    
-    for task in work_queue:
-        doc_id = task["id"]
-        data = task["data"]
+    found = 0
+    added = 0
+    for doc in orange_docs:
+        found += 1
+        data = doc.to_dict()
         company = data.get('name_customer') or 'Client'
 
         # 🛡️ Date Check
@@ -127,44 +181,137 @@ def run_call_automation():
                 print(f"   ⏭️  Skipping {company} (Already called today)")
                 continue
 
-        print(f"   🎙️  Processing Call for {company}...")
-        
-        # 1. Generate Script
-        call_script = generate_call_script(data)
-        
-        # 2. Generate Audio
-        print(f"      ...Synthesizing Audio")
-        audio_url = create_audio_file(call_script, doc_id)
-        
-        if audio_url:
-            processed_count += 1
-            
-            # 3. Log to Firestore
-            db.collection('ai_logs').add({
-                "type": "CALL",
-                "company_name": company,
-                "target": data.get('phone_number', 'Unknown'),
-                "content": call_script,
-                "audio_url":  audio_url, # <--- The key field for the frontend
-                "status": "Voicemail Left",
-                "timestamp": firestore.SERVER_TIMESTAMP,
-                "case_id": doc_id
-            })
-            
-            # 4. Update Case History
-            db.collection('cases').document(doc_id).update({
-                "history_logs": firestore.ArrayUnion([{
-                    "date": datetime.now().isoformat(),
-                    "action": "🤖 AI Call",
-                    "note": "Voicemail Generated",
-                    "status": "Completed"
-                }]),
-                "last_contacted_at": firestore.SERVER_TIMESTAMP
-            })
-            print(f"      ✅ Call logged & Audio saved.")
-            print(audio_url)
+        if queue.enqueue(doc.id, CALL_CHANNEL, data):
+            added += 1
+
+    print(f"📋 Found {found} calls, queued {added} new.")
+    return added
+
+def record_call(job):
+    """Firestore bookkeeping for a generated voicemail. Idempotent, so it is safe to redo after a crash."""
+    doc_id = job["case_id"]
+    data = job["payload"]
+    company = data.get('name_customer') or 'Client'
+
+    # 3. Log to Firestore (keyed by the job so a retry overwrites instead of duplicating)
+    db.collection('ai_logs').document(job["idempotency_key"]).set({
+        "type": "CALL",
+        "company_name": company,
+        "target": data.get('phone_number', 'Unknown'),
+        "content": job["content"],
+        "audio_url": job["result"]["audio_url"], # <--- The key field for the frontend
+        "status": "Voicemail Left",
+        "timestamp": firestore.SERVER_TIMESTAMP,
+        "case_id": doc_id
+    })
+    
+    # 4. Update Case History
+    db.collection('cases').document(doc_id).update({
+        "history_logs": firestore.ArrayUnion([{
+            "date": job["sent_at"],
+            "action": "🤖 AI Call",
+            "note": "Voicemail Generated",
+            "status": "Completed"
+        }]),
+        "last_contacted_at": firestore.SERVER_TIMESTAMP
+    })
+
+def drain_call_queue(queue, worker_id=None):
+    """
+    Leases CALL jobs until none are ready. Safe to run in several processes at once.
+    Retries due within RETRY_WAIT_SECONDS are waited for; later backoffs are left to the next run.
+    """
+    worker_id = worker_id or default_worker_id()
+    processed_count = 0
+    cases_by_key = {}
+    batcher = call_batcher(cases_by_key)
+
+    while True:
+        jobs = queue.lease(CALL_CHANNEL, worker_id, limit=LEASE_CHUNK)
+        if not jobs:
+            if queue.wait_for_retries(CALL_CHANNEL):
+                continue
+            break
+        # keyed by job, not case: one lease can hold several days' jobs for the same case
+        jobs_by_key = {job["idempotency_key"]: job for job in jobs}
+
+        # ♻️ Audio already generated before a crash: only finish the bookkeeping
+        for job in jobs:
+            if job["sent_at"]:
+                try:
+                    record_call(job)
+                    queue.complete(job["idempotency_key"], worker_id)
+                except Exception as e:
+                    queue.fail(job["idempotency_key"], worker_id, e)
+
+        # 🔄 Send from the case as it is now: a retry from an earlier run may be paid or out of ORANGE by now
+        unsent = [job for job in jobs if not job["sent_at"]]
+        unsent = queue.supersede_stale(unsent, worker_id, current_cases(job["case_id"] for job in unsent), is_call_case)
+
+        cases_by_key.clear()
+        cases_by_key.update({job["idempotency_key"]: job["payload"] for job in unsent})
+
+        # 1. Generate Scripts (batched; each case is handled as soon as its batch returns)
+        for key, call_script in batcher.stream((key, call_case_fields(data)) for key, data in cases_by_key.items()):
+            job = jobs_by_key[key]
+            doc_id = job["case_id"]
+            company = job["payload"].get('name_customer') or 'Client'
+
+            print(f"   🎙️  Processing Call for {company}...")
+
+            try:
+                # 🔒 Only act while we still hold the lease (a slow batch may have outlived it)
+                if not queue.renew(key, worker_id):
+                    print(f"      ⏭️  Lease on {key} lost, leaving it to its new owner")
+                    continue
+
+                # 2. Generate Audio
+                print(f"      ...Synthesizing Audio")
+                audio_url = create_audio_file(call_script, doc_id)
+                if not audio_url:
+                    queue.fail(key, worker_id, "Audio generation failed")
+                    continue
+
+                processed_count += 1
+                job["sent_at"] = queue.mark_sent(key, worker_id, call_script, {"audio_url": audio_url})
+                if job["sent_at"] is None:
+                    print(f"      ⚠️ Lease on {key} lost right after generating; not recording it twice")
+                    continue
+                job["content"] = call_script
+                job["result"] = {"audio_url": audio_url}
+                record_call(job)
+                queue.complete(key, worker_id)
+                print(f"      ✅ Call logged & Audio saved.")
+                print(audio_url)
+            except Exception as e:
+                print(f"   ❌ Job {key} failed: {e}")
+                queue.fail(key, worker_id, e)
+
+    print(f"   🧠 AI requests: {batcher.stats['requests']} batched, {batcher.stats['single']} single-case "
+          f"({batcher.stats['batched']} scripts from batches, {batcher.stats['errors']} errors)")
+    return processed_count
+
+def run_call_automation(enqueue=True, drain=True):
+    print(f"📞 Call Agent Starting (Model: {MODEL_NAME})...")
+
+    queue = OutreachQueue()
+    try:
+        if enqueue:
+            enqueue_orange_cases(queue)
+        processed_count = drain_call_queue(queue) if drain else 0
+        print(f"📬 Queue: {queue.counts(CALL_CHANNEL)}")
+    finally:
+        queue.close()
 
     print(f"\n✅ Call Automation Complete. Processed {processed_count} calls.")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate AI voicemails for ORANGE zone cases.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--enqueue-only", action="store_true", help="Only queue today's cases")
+    mode.add_argument("--drain-only", action="store_true", help="Only work the queue (extra worker process)")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    run_call_automation()
\ No newline at end of file
+    args = parse_args()
+    run_call_automation(enqueue=not args.drain_only, drain=not args.enqueue_only)
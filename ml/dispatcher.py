@@ -60,16 +60,17 @@ AGENTS = [
 # ----------------------------------
 # 3. DISPATCHER LOGIC
 # ----------------------------------
-def run_dispatcher():
-    print("🔎 Scanning for unassigned RED cases...")
+BATCH_COMMIT_SIZE = 400
 
+def dispatch_cases(docs):
+    """Assigns an agent to every unassigned case in `docs` (RED case snapshots). Returns the count."""
     cases_ref = db.collection("cases")
-    query = cases_ref.where("zone", "==", "RED").stream()
 
     batch = db.batch()
+    batch_count = 0
     count = 0
 
-    for doc in query:
+    for doc in docs:
         data = doc.to_dict()
 
         # Skip already assigned cases
@@ -93,10 +94,26 @@ def run_dispatcher():
         }
 
         batch.update(doc_ref, update_data)
+        batch_count += 1
         count += 1
 
-    if count > 0:
+        if batch_count >= BATCH_COMMIT_SIZE:
+            batch.commit()
+            batch = db.batch()
+            batch_count = 0
+
+    if batch_count > 0:
         batch.commit()
+
+    return count
+
+def run_dispatcher():
+    print("🔎 Scanning for unassigned RED cases...")
+
+    query = db.collection("cases").where("zone", "==", "RED").stream()
+    count = dispatch_cases(query)
+
+    if count > 0:
         print(f"✅ Assigned {count} cases.")
     else:
         print("💤 No new unassigned cases found.")
@@ -0,0 +1,157 @@
+import json
+import re
+import time
+
+# ==========================================
+# ⚙️ CONFIGURATION
+# ==========================================
+
+DEFAULT_BATCH_SIZE = 8
+MIN_BATCH_SIZE = 2  # a batch size of 1 disables batching altogether
+MAX_BATCH_SIZE = 25
+
+# Grow the batch while a request finishes within this many seconds
+TARGET_LATENCY_SECONDS = 20.0
+# Share of cases in a batch that must come back valid for the batch to count as healthy
+MIN_VALID_RATIO = 0.9
+# After this many batched attempts a case goes to the single-case path
+MAX_BATCH_ATTEMPTS = 2
+
+BATCH_INSTRUCTIONS = """
+You will receive a JSON array of cases. Write one message per case.
+Reply with ONLY a JSON array containing exactly one object per case, in this form:
+[{"case_id": "<case_id from the input>", "text": "<the message>"}]
+Do not add commentary, markdown or code fences.
+"""
+
+# ==========================================
+# 🧩 PROMPT / RESPONSE HELPERS
+# ==========================================
+
+def build_batch_prompt(task, cases):
+    """`cases` is a list of (case_id, fields) pairs; fields must be JSON-serializable."""
+    payload = [{"case_id": case_id, **fields} for case_id, fields in cases]
+    return f"{task.strip()}\n{BATCH_INSTRUCTIONS}\nCases:\n{json.dumps(payload, default=str, indent=1)}"
+
+def parse_batch_response(text, expected_ids):
+    """
+    Extracts {case_id: text} from a model reply. Tolerates code fences and chatter
+    around the array; ignores unknown ids, duplicates and non-string texts.
+    """
+    if not text:
+        return {}
+    text = re.sub(r"```(?:json)?", "", text)
+    start, end = text.find("["), text.rfind("]")
+    if start == -1 or end <= start:
+        return {}
+    try:
+        items = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    expected = set(expected_ids)
+    results = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        case_id = str(item.get("case_id", ""))
+        message = item.get("text")
+        if case_id in expected and case_id not in results and isinstance(message, str) and message.strip():
+            results[case_id] = message.strip()
+    return results
+
+# ==========================================
+# 🚀 ADAPTIVE BATCHER
+# ==========================================
+
+class AdaptiveBatcher:
+    """
+    Packs many cases into one LLM request and adapts the batch size (AIMD):
+    +1 after a fast, clean batch; halved after an error or an unparseable reply;
+    shrunk by a quarter when slow or when too many items come back invalid.
+
+    generate_fn(prompt) -> str        one model call (raises on transport errors)
+    single_fn(case_id) -> str         per-case path used for any case the batch
+                                      could not produce (it does its own template fallback)
+    validate_fn(text) -> str | None   optional clean-up / rejection of a batched message
+    """
+
+    def __init__(self, generate_fn, task, single_fn, validate_fn=None,
+                 batch_size=DEFAULT_BATCH_SIZE, min_size=MIN_BATCH_SIZE, max_size=MAX_BATCH_SIZE,
+                 target_latency=TARGET_LATENCY_SECONDS):
+        self.generate_fn = generate_fn
+        self.task = task
+        self.single_fn = single_fn
+        self.validate_fn = validate_fn
+        self.enabled = batch_size > 1
+        self.min_size = min_size
+        self.max_size = max_size
+        self.batch_size = max(min_size, min(batch_size, max_size)) if self.enabled else 1
+        self.target_latency = target_latency
+        self.stats = {"requests": 0, "errors": 0, "batched": 0, "single": 0}
+
+    def _adapt(self, failed, degraded=False):
+        if failed:
+            self.batch_size = max(self.min_size, self.batch_size // 2)
+        elif degraded:
+            self.batch_size = max(self.min_size, self.batch_size - max(1, self.batch_size // 4))
+        else:
+            self.batch_size = min(self.max_size, self.batch_size + 1)
+
+    def _run_batch(self, batch):
+        ids = [case_id for case_id, _ in batch]
+        self.stats["requests"] += 1
+        started = time.time()
+        try:
+            reply = self.generate_fn(build_batch_prompt(self.task, batch))
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"   ⚠️ Batch AI Error ({len(batch)} cases): {e}")
+            self._adapt(failed=True)
+            return {}
+        latency = time.time() - started
+
+        results = parse_batch_response(reply, ids)
+        if self.validate_fn is not None:
+            results = {case_id: self.validate_fn(text) for case_id, text in results.items()}
+            results = {case_id: text for case_id, text in results.items() if text}
+
+        self._adapt(
+            failed=not results,
+            degraded=latency > self.target_latency or len(results) < MIN_VALID_RATIO * len(batch)
+        )
+        return results
+
+    def stream(self, cases):
+        """
+        Yields (case_id, text) for every case in `cases` ((case_id, fields) pairs),
+        batch by batch, so callers can start sending before the whole list is done.
+        """
+        pending = [(str(case_id), fields) for case_id, fields in cases]
+        attempts = {}
+
+        while pending:
+            batch, pending = pending[:self.batch_size], pending[self.batch_size:]
+            if not self.enabled or len(batch) == 1:
+                case_id = batch[0][0]
+                self.stats["single"] += 1
+                yield case_id, self.single_fn(case_id)
+                continue
+
+            results = self._run_batch(batch)
+            retry = []
+            for case_id, fields in batch:
+                if case_id in results:
+                    self.stats["batched"] += 1
+                    yield case_id, results[case_id]
+                    continue
+                attempts[case_id] = attempts.get(case_id, 0) + 1
+                if attempts[case_id] < MAX_BATCH_ATTEMPTS:
+                    retry.append((case_id, fields))
+                else:
+                    self.stats["single"] += 1
+                    yield case_id, self.single_fn(case_id)
+            # failed items go back to the front, into the (now smaller) next batch
+            pending = retry + pending
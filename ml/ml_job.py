@@ -1,28 +1,51 @@
 import pandas as pd
 import numpy as np
-import lightgbm as lgb
 from datetime import timedelta
 import math
 import os
+import re
+import hashlib
 import sys
 import json
+import glob
 import time
 import random
+import zlib
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
 import firebase_admin
 from firebase_admin import firestore
 from google.cloud import firestore as google_firestore
+from google.cloud.firestore import FieldFilter
 from google.api_core import exceptions
 
+from model_registry import ModelRegistry, REGISTRY_DIR
+from policy_simulator import assign_zones
+
 # --------------------
 # CONFIG
 # --------------------
 os.environ["FIRESTORE_EMULATOR_HOST"] = "127.0.0.1:8085"
 os.environ["GCLOUD_PROJECT"] = "fedex-dca"
 
-MODEL_PATH = "model/payment_delay_lgb_model.txt"
+MODEL_PATH = "model/payment_delay_lgb_model.txt"  # used until a model is registered (model_registry.py)
+SHADOW_REPORT_COLLECTION = "model_shadow_reports"
 BATCH_COMMIT_SIZE = 50 
+FORECAST_COLLECTION = "cash_forecast"
+FORECAST_HORIZON_DAYS = 91   # 13 weeks; later predicted payments land in a "beyond" bucket
+FORECAST_TOP_CUSTOMERS = 50
+ZONE_SCHEDULE_COLLECTION = "zone_schedule"  # one doc per open case: next date-driven zone change
+SHARD_BUCKETS = 4096  # cust_number hash space; shards own contiguous bucket ranges
+DEFAULT_CHUNK_SIZE = 5000  # cases per page in streaming mode (--chunk-size)
+SUMMARY_COLLECTION = "customer_summaries"  # one read-model doc per customer (profile pages)
+SUMMARY_RECENT_INVOICES = 10
+SUMMARY_OPEN_INVOICES = 100  # more than this and the summary flags open_truncated
+SEARCH_INDEX_COLLECTION = "customer_search"  # prefix docs for customer search
+SEARCH_MIN_PREFIX = 2
+SEARCH_MAX_ENTRIES = 300  # per prefix doc; fuller prefixes are split one character deeper
 
 MODEL_FEATURES = [
     "total_open_amount", "due_days", "avg_due_days", "avg_payment_delay",
@@ -30,6 +53,43 @@ MODEL_FEATURES = [
     "transaction_count", "late_payment_ratio"
 ]
 
+FEATURE_DEFAULTS = {
+    "avg_payment_delay": 0.0, "std_payment_delay": 0.0,
+    "min_delay": 0.0, "max_delay": 0.0,
+    "avg_days_to_clear": 30.0, "avg_due_days": 30.0,
+    "avg_invoice_amount": 0.0, "total_lifetime_value": 0.0,
+    "transaction_count": 0, "late_payment_ratio": 0.0
+}
+
+# Scored open-invoice columns saved with --snapshot (input to policy_simulator.py)
+SNAPSHOT_COLUMNS = [
+    "_doc_id", "cust_number", "invoice_currency", "total_open_amount", "due_date",
+    "predicted_delay", "predicted_payment_date", "late_payment_ratio", "std_payment_delay"
+]
+
+# Columns kept from the fetched cases once they are split into closed / open frames
+HISTORY_COLUMNS = [
+    "cust_code", "payment_delay", "invoice_age_at_clearing", "due_days", "total_open_amount"
+]
+OPEN_INVOICE_COLUMNS = [
+    "_doc_id", "cust_number", "cust_code", "invoice_date", "due_date",
+    "total_open_amount", "case_amount", "invoice_currency", "due_days",
+    "invoice_id", "name_customer", "document_type"  # carried through for the customer summaries
+]
+
+# Case fields the job reads (streaming mode fetches only these)
+CASE_FIELDS = [
+    "cust_number", "customer_id", "name_customer", "company_name",
+    "document_create_date", "invoice_date", "due_in_date", "due_date", "clear_date",
+    "invoice_amount", "total_open_amount", "invoice_currency", "isOpen", "is_open",
+    "original_amount", "shard_bucket", "invoice_id", "document_type"
+]
+
+# Per-customer aggregate columns that simply add up across chunks
+AGGREGATE_SUM_COLUMNS = [
+    "history", "late", "delay_n", "delay_sum", "age_sum", "age_n", "due_sum", "due_n", "amount_sum", "amount_n"
+]
+
 # --------------------
 # 1. INITIALIZATION
 # --------------------
@@ -40,9 +100,16 @@ if not firebase_admin._apps:
 
 db = google_firestore.Client(project="fedex-dca")
 
-if not os.path.exists(MODEL_PATH):
-    raise FileNotFoundError(f"Model file not found at {MODEL_PATH}")
-model = lgb.Booster(model_file=MODEL_PATH)
+# Versioned models, created on first use so importing this module (e.g. in a spawned
+# shard worker) loads nothing. registry.refresh() verifies and loads a new active
+# model before hot-swapping to it; shard workers get the parent's PinnedModels instead.
+registry = None
+
+def model_registry():
+    global registry
+    if registry is None:
+        registry = ModelRegistry(REGISTRY_DIR, legacy_path=MODEL_PATH)
+    return registry
 
 # --------------------
 # 2. UTILITIES
@@ -104,6 +171,35 @@ def derive_sla_days(late_ratio):
     except Exception:
         return 15
 
+def zone_transitions(pred_delay, sla_days, sla_date, due_date, today, predicted_payment_date=None):
+    """
+    Future zone changes for one case, as [(date, zone), ...] in date order.
+
+    assign_zone() depends on `today` only through three comparisons, so the zone can
+    only change on the due date, the day after the predicted payment date, or the
+    SLA date. Evaluating assign_zone at each of those dates gives the exact schedule.
+    """
+    if pd.isna(sla_date): sla_date = None
+    if pd.isna(due_date): due_date = None
+    if pd.isna(predicted_payment_date): predicted_payment_date = None
+
+    breakpoints = []
+    if due_date is not None:
+        breakpoints.append(due_date.normalize())
+    if predicted_payment_date is not None:
+        breakpoints.append(predicted_payment_date.normalize() + timedelta(days=1))
+    if sla_date is not None:
+        breakpoints.append(sla_date.normalize())
+
+    current = assign_zone(pred_delay, sla_days, sla_date, due_date, today=today, predicted_payment_date=predicted_payment_date)
+    transitions = []
+    for day in sorted(set(b for b in breakpoints if b > today)):
+        zone = assign_zone(pred_delay, sla_days, sla_date, due_date, today=day, predicted_payment_date=predicted_payment_date)
+        if zone != current:
+            transitions.append((day, zone))
+            current = zone
+    return transitions
+
 def commit_batch_safe(batch):
     max_retries = 5
     for attempt in range(max_retries):
@@ -121,33 +217,128 @@ def commit_batch_safe(batch):
     print("   ❌ Max retries reached for batch. Skipping.")
 
 # --------------------
-# 3. MAIN JOB
+# 3. SHARDING
 # --------------------
-def run_ml_job():
-    print("Starting ML job...")
-    start_ts = time.time()
+def shard_bucket_for(cust_number):
+    """Stable bucket for a customer key (same value in every process and on every node)."""
+    return zlib.crc32(str(cust_number).encode("utf-8")) % SHARD_BUCKETS
 
-    # 3.1 Fetch all cases
-    print("Fetching cases collection from Emulator...")
-    docs = db.collection("cases").stream()
+def case_shard_key(d):
+    # Mirrors the cust_number fallback used when the DataFrame is built
+    if "cust_number" in d:
+        return d["cust_number"]
+    return d.get("customer_id", "")
+
+def shard_bucket_range(shard_index, shard_count):
+    """Half-open [lo, hi) range of buckets owned by one shard."""
+    lo = shard_index * SHARD_BUCKETS // shard_count
+    hi = (shard_index + 1) * SHARD_BUCKETS // shard_count
+    return lo, hi
+
+def assign_shard_buckets():
+    """
+    One-off migration (--assign-shard-buckets): writes `shard_bucket` onto every case
+    that is missing it (or has a stale one). Shard workers fetch with a range query
+    on this field; new cases get it when they are created (functions/index.js,
+    AddCaseModal), so this only needs to run once before the first sharded run, or
+    after cases were loaded some other way.
+    """
+    print("Assigning shard buckets...")
+    docs = db.collection("cases").select(["cust_number", "customer_id", "shard_bucket"]).stream()
+
+    batch = db.batch()
+    batch_count = 0
+    assigned = 0
+    for doc in tqdm(docs, desc="Bucketing"):
+        d = doc.to_dict()
+        bucket = shard_bucket_for(case_shard_key(d))
+        if d.get("shard_bucket") == bucket:
+            continue
+        batch.update(db.collection("cases").document(doc.id), {"shard_bucket": bucket})
+        batch_count += 1
+        assigned += 1
+        if batch_count >= BATCH_COMMIT_SIZE:
+            commit_batch_safe(batch)
+            batch = db.batch()
+            batch_count = 0
+
+    if batch_count > 0:
+        commit_batch_safe(batch)
+    print(f"✅ Assigned shard buckets for {assigned} cases.")
+    return assigned
+
+def empty_job_stats():
+    return {
+        "cases_fetched": 0,
+        "backfilled": 0,
+        "company_profiles": 0,
+        "open_invoices": 0,
+        "updated": 0,
+        "scheduled": 0,
+        "summaries": 0,
+        "zones": {},
+        "forecast": [],
+        "shadow": [],
+        "search": [],
+        "failed": False,  # scoring failed: the book-wide outputs would miss invoices
+    }
+
+def merge_job_stats(results):
+    """Folds per-shard stats into run-level stats."""
+    merged = empty_job_stats()
+    for stats in results:
+        for key, value in stats.items():
+            if key == "zones":
+                for zone, count in value.items():
+                    merged["zones"][zone] = merged["zones"].get(zone, 0) + count
+            elif key in ("forecast", "shadow", "search"):
+                merged[key].extend(value)
+            elif key == "failed":
+                merged["failed"] = merged["failed"] or value
+            elif key in merged:
+                merged[key] += value
+    return merged
+
+# --------------------
+# 4. JOB STAGES
+# --------------------
+def case_backfill(d):
+    """Fills in `original_amount` on a case dict; returns the fields that changed."""
+    backfill = {}
+    if "original_amount" not in d:
+        current_total = d.get("total_open_amount", d.get("invoice_amount", 0))
+        d["original_amount"] = current_total
+        backfill["original_amount"] = current_total
+    return backfill
+
+def fetch_cases(bucket_range=None, desc="Fetching & Backfilling"):
+    """
+    Streams the `cases` collection (or one shard's bucket range of it) and
+    backfills `original_amount` on the way through.
+    Returns (rows, backfilled_count).
+    """
+    query = db.collection("cases")
+    if bucket_range is not None:
+        lo, hi = bucket_range
+        query = query.where(filter=FieldFilter("shard_bucket", ">=", lo))\
+                     .where(filter=FieldFilter("shard_bucket", "<", hi))
+    docs = query.stream()
 
     rows = []
-    
+
     # Init batch for backfilling original_amount
     batch = db.batch()
     batch_count = 0
     backfill_counter = 0
 
-    for doc in tqdm(docs, desc="Fetching & Backfilling"):
+    for doc in tqdm(docs, desc=desc):
         d = doc.to_dict()
         d["_doc_id"] = doc.id
-        
-        if "original_amount" not in d:
-            current_total = d.get("total_open_amount", d.get("invoice_amount", 0))
-            d["original_amount"] = current_total
-            
+
+        backfill = case_backfill(d)
+        if backfill:
             doc_ref = db.collection("cases").document(doc.id)
-            batch.update(doc_ref, {"original_amount": current_total})
+            batch.update(doc_ref, backfill)
             batch_count += 1
             backfill_counter += 1
 
@@ -157,73 +348,112 @@ def run_ml_job():
             commit_batch_safe(batch)
             batch = db.batch()
             batch_count = 0
-    
+
     if batch_count > 0:
         commit_batch_safe(batch)
         print(f"✅ Backfilled 'original_amount' for {backfill_counter} cases.")
 
-    if not rows:
-        print("No cases found. Exiting.")
-        return
+    return rows, backfill_counter
 
-    df = pd.DataFrame(rows)
-    print(f"Total cases fetched: {len(df)}")
+def _case_field(df, column):
+    """A case field as a Series; all missing if no case in `df` has it."""
+    return df[column] if column in df.columns else pd.Series(np.nan, index=df.index, dtype=object)
 
-    # 3.2 Parse Dates
-    if "document_create_date" in df.columns:
-        df["invoice_date"] = safe_to_datetime(df["document_create_date"], fmt="%Y%m%d")
-    else:
-        df["invoice_date"] = safe_to_datetime(df.get("invoice_date"))
+def prepare_cases(df):
+    """
+    Parses dates, normalizes amounts and derives per-invoice metrics and flags.
+    Where cases carry one of several fields (document_create_date or invoice_date,
+    isOpen or is_open, ...), each case uses the first one it has, so a case comes
+    out the same whichever other cases it is prepared with (a streaming page or
+    the whole book).
+    """
+    # Parse Dates
+    created = _case_field(df, "document_create_date")
+    df["invoice_date"] = safe_to_datetime(created, fmt="%Y%m%d")\
+        .where(created.notna(), safe_to_datetime(_case_field(df, "invoice_date")))
 
-    if "due_in_date" in df.columns:
-        due_col = df["due_in_date"].astype("Int64").astype(str)
-        df["due_date"] = safe_to_datetime(due_col, fmt="%Y%m%d")
-    else:
-        df["due_date"] = safe_to_datetime(df.get("due_date"))
+    due_in = pd.to_numeric(_case_field(df, "due_in_date"), errors="coerce")
+    df["due_date"] = safe_to_datetime(due_in.astype("Int64").astype(str), fmt="%Y%m%d")\
+        .where(due_in.notna(), safe_to_datetime(_case_field(df, "due_date")))
 
     df["clear_date"] = safe_to_datetime(df.get("clear_date"))
 
-    # 3.3 Normalize amounts
-    if "invoice_amount" in df.columns:
-        df["total_open_amount"] = df["invoice_amount"].astype(float)
-    else:
-        df["total_open_amount"] = pd.to_numeric(df.get("total_open_amount", 0), errors="coerce").fillna(0.0)
+    # Normalize amounts
+    stored = pd.to_numeric(_case_field(df, "total_open_amount"), errors="coerce")
+    invoiced = pd.to_numeric(_case_field(df, "invoice_amount"), errors="coerce")
+    df["total_open_amount"] = invoiced.fillna(stored).fillna(0.0).to_numpy(dtype=float)
+    # The amount as the case shows it, in the invoice currency (what the profile pages display)
+    df["case_amount"] = stored.fillna(df["total_open_amount"]).to_numpy(dtype=float)
 
-    df["invoice_currency"] = df.get("invoice_currency", "USD").fillna("USD")
+    df["invoice_currency"] = _case_field(df, "invoice_currency").fillna("USD")
     df["total_open_amount"] = np.where(df["invoice_currency"] == "CAD", df["total_open_amount"] * 0.75, df["total_open_amount"])
 
-    # 3.4 Metrics
+    # Metrics
     df["payment_delay"] = (df["clear_date"] - df["due_date"]).dt.days
     df["due_days"] = (df["due_date"] - df["invoice_date"]).dt.days
     df["invoice_age_at_clearing"] = (df["clear_date"] - df["invoice_date"]).dt.days
 
-    if "cust_number" not in df.columns:
-        df["cust_number"] = df.get("customer_id", "").astype(str)
-    df["cust_number"] = df["cust_number"].astype(str)
+    df["cust_number"] = _case_field(df, "cust_number").fillna(_case_field(df, "customer_id")).astype(str)
+    df["name_customer"] = _case_field(df, "name_customer").fillna(_case_field(df, "company_name"))
 
-    if "name_customer" not in df.columns:
-        df["name_customer"] = df.get("company_name", "")
+    # Flags ("1.0": a numeric isOpen column turns float when some cases lack it)
+    is_open = _case_field(df, "isOpen")
+    legacy_open = _case_field(df, "is_open")
+    df["is_open_flag"] = np.where(
+        is_open.notna(), is_open.astype(str).isin(["1", "1.0", "true", "True"]),
+        np.where(legacy_open.notna(), legacy_open == 1, df["clear_date"].isna())
+    ).astype(bool)
 
-    # 3.5 Flags
-    if "isOpen" in df.columns:
-        df["is_open_flag"] = df["isOpen"].astype(str).isin(["1", "true", "True"])
-    elif "is_open" in df.columns:
-        df["is_open_flag"] = df["is_open"] == 1
-    else:
-        df["is_open_flag"] = df["clear_date"].isna()
+    return df
 
-    history_df = df[~df["is_open_flag"]].copy()
-    open_df = df[df["is_open_flag"]].copy()
+def encode_customer_keys(df):
+    """
+    Dictionary-encodes the customer key and name columns in place.
+    `cust_code` is the row position of the customer in the company feature table,
+    so every later join is an integer take instead of a string-keyed merge.
+    """
+    df["cust_number"] = df["cust_number"].astype("category")
+    df["name_customer"] = df["name_customer"].astype("category")
+    df["cust_code"] = df["cust_number"].cat.codes.astype(np.int32)
+    return df
 
-    # 3.6 Build Company Features
-    print("Building Company Profile Features...")
+def most_frequent_names(cust_codes, name_codes, n_customers, names):
+    """
+    Vectorized per-customer mode of the customer name. Ties go to the smallest
+    name (categories are sorted, so the smallest code), matching Series.mode().
+    Customers with no name at all get NaN.
+    """
+    named = name_codes >= 0
+    counts = pd.DataFrame({
+        "cust_code": cust_codes[named],
+        "name_code": name_codes[named]
+    }).value_counts(sort=False).reset_index(name="n")
+    top = counts.sort_values(["cust_code", "n", "name_code"], ascending=[True, False, True])\
+                .drop_duplicates("cust_code")
 
-    all_customers = df.groupby("cust_number")["name_customer"].agg(
-        lambda x: x.mode().iat[0] if not x.mode().empty else x.iloc[0]
-    ).reset_index().rename(columns={"name_customer": "company_name"})
+    company_name = np.full(n_customers, np.nan, dtype=object)
+    company_name[top["cust_code"].to_numpy()] = np.asarray(names, dtype=object)[top["name_code"].to_numpy()]
+    return company_name
+
+def build_company_features(df, history_df):
+    """
+    Per-customer payment profile built from closed invoices.
+    Rows are indexed by cust_code (see encode_customer_keys).
+    """
+    customers = df["cust_number"].cat.categories
+    company_features = pd.DataFrame({
+        "cust_code": np.arange(len(customers), dtype=np.int32),
+        "cust_number": customers.astype(str),
+        "company_name": most_frequent_names(
+            df["cust_code"].to_numpy(),
+            df["name_customer"].cat.codes.to_numpy(),
+            len(customers),
+            df["name_customer"].cat.categories
+        )
+    })
 
     if not history_df.empty:
-        grp = history_df.groupby("cust_number")
+        grp = history_df.groupby("cust_code")
         agg = grp.agg({
             "payment_delay": ["mean", "std", "min", "max"],
             "invoice_age_at_clearing": ["mean"],
@@ -235,48 +465,38 @@ def run_ml_job():
             "avg_days_to_clear", "avg_due_days",
             "avg_invoice_amount", "total_lifetime_value", "transaction_count"
         ]
-        historical_stats = agg.reset_index()
-
-        late_counts = history_df[history_df["payment_delay"] > 0].groupby("cust_number").size()
-        total_counts = history_df.groupby("cust_number").size()
-        late_ratio = (late_counts / total_counts).fillna(0).rename("late_payment_ratio").reset_index()
-        
-        historical_stats = historical_stats.merge(late_ratio, on="cust_number", how="left")
-    else:
-        historical_stats = pd.DataFrame(columns=["cust_number"])
+        # share of closed invoices paid after the due date
+        agg["late_payment_ratio"] = (history_df["payment_delay"] > 0).groupby(history_df["cust_code"]).mean()
+        company_features = company_features.join(agg)
 
-    company_features = all_customers.merge(historical_stats, on="cust_number", how="left")
+    company_features.fillna(FEATURE_DEFAULTS, inplace=True)
+    return company_features
 
-    defaults = {
-        "avg_payment_delay": 0.0, "std_payment_delay": 0.0,
-        "min_delay": 0.0, "max_delay": 0.0,
-        "avg_days_to_clear": 30.0, "avg_due_days": 30.0,
-        "avg_invoice_amount": 0.0, "total_lifetime_value": 0.0,
-        "transaction_count": 0, "late_payment_ratio": 0.0
+def company_profile_payload(row):
+    """The company_features fields for one row of the company feature table."""
+    return {
+        "cust_number": str(row["cust_number"]),
+        "company_name": row.get("company_name", "") if not pd.isna(row.get("company_name", "")) else "Unknown",
+        "avg_payment_delay": float(row["avg_payment_delay"]),
+        "std_payment_delay": float(row["std_payment_delay"]),
+        "min_delay": float(row["min_delay"]),
+        "max_delay": float(row["max_delay"]),
+        "avg_days_to_clear": float(row["avg_days_to_clear"]),
+        "avg_due_days": float(row["avg_due_days"]),
+        "avg_invoice_amount": float(row["avg_invoice_amount"]),
+        "total_lifetime_value": float(row["total_lifetime_value"]),
+        "transaction_count": int(row["transaction_count"]),
+        "late_payment_ratio": float(row["late_payment_ratio"]),
     }
-    company_features.fillna(defaults, inplace=True)
 
+def persist_company_features(company_features, desc="Saving Profiles"):
     print(f"Persisting {len(company_features)} company feature docs...")
     batch = db.batch()
     commit_count = 0
-    
-    for _, row in tqdm(company_features.iterrows(), total=len(company_features), desc="Saving Profiles"):
+
+    for _, row in tqdm(company_features.iterrows(), total=len(company_features), desc=desc):
         doc_ref = db.collection("company_features").document(str(row["cust_number"]))
-        payload = {
-            "cust_number": str(row["cust_number"]),
-            "company_name": row.get("company_name", "") if not pd.isna(row.get("company_name", "")) else "Unknown",
-            "avg_payment_delay": float(row["avg_payment_delay"]),
-            "std_payment_delay": float(row["std_payment_delay"]),
-            "min_delay": float(row["min_delay"]),
-            "max_delay": float(row["max_delay"]),
-            "avg_days_to_clear": float(row["avg_days_to_clear"]),
-            "avg_due_days": float(row["avg_due_days"]),
-            "avg_invoice_amount": float(row["avg_invoice_amount"]),
-            "total_lifetime_value": float(row["total_lifetime_value"]),
-            "transaction_count": int(row["transaction_count"]),
-            "late_payment_ratio": float(row["late_payment_ratio"]),
-            "last_updated_at": firestore.SERVER_TIMESTAMP
-        }
+        payload = {**company_profile_payload(row), "last_updated_at": firestore.SERVER_TIMESTAMP}
         batch.set(doc_ref, payload, merge=True)
         commit_count += 1
         if commit_count >= BATCH_COMMIT_SIZE:
@@ -286,15 +506,22 @@ def run_ml_job():
     if commit_count > 0:
         commit_batch_safe(batch)
 
-    # 4. Enrich open invoices
-    if open_df.empty:
-        print("No open invoices to score.")
-        return
-
+def score_open_invoices(open_df, company_features, num_threads=0):
+    """
+    Joins company features onto open invoices and predicts the payment delay.
+    Returns the scored frame, or None if prediction failed.
+    """
     print(f"Preparing {len(open_df)} open invoices for scoring...")
-    open_df = open_df.merge(company_features, on="cust_number", how="left", suffixes=("", "_cf"))
+    # Integer-keyed join: company_features row i belongs to cust_code i.
+    # Fresh profile values win over copies left on the case doc by earlier runs
+    # (e.g. late_payment_ratio), which the old string merge kept instead.
+    profile = company_features.drop(columns=["cust_code", "cust_number"])\
+                              .take(open_df["cust_code"].to_numpy())
+    for col in profile.columns:
+        open_df[col] = profile[col].to_numpy()
+    del profile
 
-    for k, v in defaults.items():
+    for k, v in FEATURE_DEFAULTS.items():
         if k not in open_df.columns: open_df[k] = v
         else: open_df[k] = open_df[k].fillna(v)
 
@@ -307,29 +534,60 @@ def run_ml_job():
         if feat not in open_df.columns: open_df[feat] = 0
         open_df[feat] = pd.to_numeric(open_df[feat], errors="coerce").fillna(0)
 
-    # 6. Predict
     X = open_df[MODEL_FEATURES]
-    print("Running predictions...")
     try:
-        preds = model.predict(X)
+        (model_version, model), shadow = model_registry().models()
+        print(f"Running predictions (model {model_version}{', shadow ' + shadow[0] if shadow else ''})...")
+        # num_threads > 0 caps LightGBM's pool so shard workers don't oversubscribe the node
+        predict_kwargs = {"num_threads": num_threads} if num_threads > 0 else {}
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            # the candidate scores the same feature matrix alongside the active model
+            shadow_future = pool.submit(shadow[1].predict, X, **predict_kwargs) if shadow else None
+            preds = model.predict(X, **predict_kwargs)
+            shadow_preds = None
+            if shadow_future is not None:
+                try:
+                    shadow_preds = shadow_future.result()
+                except Exception as e:
+                    print(f"⚠️ Shadow prediction failed ({shadow[0]}): {e}")
         open_df["predicted_delay"] = preds.astype(float)
+        if shadow_preds is not None:
+            open_df["shadow_predicted_delay"] = shadow_preds.astype(float)
         open_df["predicted_payment_date"] = open_df.apply(
             lambda r: (r["due_date"] + timedelta(days=float(r["predicted_delay"]))) if pd.notna(r["due_date"]) else pd.NaT,
             axis=1
         )
     except Exception as e:
         print("Model prediction failed:", e)
-        return
+        return None
 
-    # 7. Update Cases
-    today = pd.Timestamp.today().normalize()
+    open_df.attrs["model_version"] = model_version
+    if shadow_preds is not None:
+        open_df.attrs["shadow_version"] = shadow[0]
+    return open_df
+
+def save_scored_snapshot(open_df, path):
+    """Pickles the columns policy_simulator.py needs; nothing is written to Firestore."""
+    columns = [c for c in SNAPSHOT_COLUMNS if c in open_df.columns]
+    open_df[columns].reset_index(drop=True).to_pickle(path)
+    print(f"💾 Saved scored snapshot of {len(open_df)} open invoices to {path}")
+
+def write_predictions(open_df, today, desc="Processing Predictions"):
+    """
+    Zones each scored invoice, writes the result back to its case and refreshes the
+    case's entry in the zone schedule. The zones are also stored on open_df["zone"].
+    Returns (updated, scheduled, zone_counts).
+    """
     batch = db.batch()
     commit_count = 0
     total_updates = 0
+    scheduled = 0
+    zone_counts = {}
+    zones = []
 
     print("Updating Firestore documents...")
-    
-    for idx, row in tqdm(open_df.iterrows(), total=len(open_df), desc="Processing Predictions"):
+
+    for idx, row in tqdm(open_df.iterrows(), total=len(open_df), desc=desc):
         cust = row["cust_number"]
         late_ratio = float(row.get("late_payment_ratio", 0) or 0)
         sla_days = derive_sla_days(late_ratio)
@@ -344,14 +602,14 @@ def run_ml_job():
         except Exception:
             sla_date = None
             escalated = False
-            
+
         # 🟢 UPDATED FUNCTION CALL: Now passing due_date
         zone = assign_zone(
-            pred_delay, 
-            sla_days, 
-            sla_date, 
+            pred_delay,
+            sla_days,
+            sla_date,
             row["due_date"], # <--- NEW PARAMETER
-            today=today, 
+            today=today,
             predicted_payment_date=row["predicted_payment_date"]
         )
 
@@ -369,13 +627,37 @@ def run_ml_job():
             "action": action,
             "escalated": bool(escalated),
             "late_payment_ratio": float(late_ratio),
+            "model_version": open_df.attrs.get("model_version"),
             "last_predicted_at": firestore.SERVER_TIMESTAMP
         }
 
         doc_ref = db.collection("cases").document(row["_doc_id"])
         batch.update(doc_ref, update_payload)
+
+        # Index the next date-driven zone change so zone_scheduler.py can apply it
+        # without waiting for the next full rescoring run.
+        transitions = zone_transitions(
+            pred_delay, sla_days, sla_date, row["due_date"],
+            today=today, predicted_payment_date=row["predicted_payment_date"]
+        )
+        schedule_ref = db.collection(ZONE_SCHEDULE_COLLECTION).document(row["_doc_id"])
+        if transitions:
+            batch.set(schedule_ref, {
+                "case_id": row["_doc_id"],
+                "cust_number": str(cust),
+                "due_on": transitions[0][0].strftime("%Y-%m-%d"),
+                "target_zone": transitions[0][1],
+                "upcoming": [{"due_on": d.strftime("%Y-%m-%d"), "zone": z} for d, z in transitions[1:]],
+                "updated_at": firestore.SERVER_TIMESTAMP
+            })
+            scheduled += 1
+        else:
+            batch.delete(schedule_ref)
+
         commit_count += 1
         total_updates += 1
+        zone_counts[zone] = zone_counts.get(zone, 0) + 1
+        zones.append(zone)
 
         if commit_count >= BATCH_COMMIT_SIZE:
             commit_batch_safe(batch)
@@ -385,11 +667,1069 @@ def run_ml_job():
     if commit_count > 0:
         commit_batch_safe(batch)
 
+    open_df["zone"] = zones
+    return total_updates, scheduled, zone_counts
+
+# --------------------
+# 5. CASH-FLOW FORECAST
+# --------------------
+def forecast_day_offsets(when, today):
+    """Whole days from today, clipped to [0, FORECAST_HORIZON_DAYS]; overdue lands on day 0."""
+    days = (when.dt.normalize() - today).dt.days
+    return days.clip(lower=0, upper=FORECAST_HORIZON_DAYS)
+
+def forecast_partials(open_df, today, top_customers=FORECAST_TOP_CUSTOMERS):
+    """
+    Bucketed expected inflows for the scored open invoices of this run (or shard).
+
+    Each invoice's amount lands on its predicted payment day; the "early" / "late"
+    scenarios shift that day by -/+ the customer's std_payment_delay and give the
+    uncertainty band. Partials from several shards are simply summed (customers are
+    shard-local, so the global top customers are among the shards' top customers).
+    Chunks of one shard are not customer-local: they pass top_customers=None and
+    are trimmed by merge_forecast_partials once the shard is done.
+    """
+    ppd = pd.to_datetime(open_df["predicted_payment_date"])
+    scheduled = ppd.notna().to_numpy()
+    std_days = pd.to_numeric(open_df.get("std_payment_delay", 0), errors="coerce").fillna(0).clip(lower=0)
+
+    frame = pd.DataFrame({
+        "cust_number": open_df["cust_number"].astype(str).to_numpy(),
+        "company_name": open_df.get("company_name", pd.Series("Unknown", index=open_df.index)).fillna("Unknown").astype(str).to_numpy(),
+        "currency": open_df["invoice_currency"].fillna("USD").astype(str).to_numpy(),
+        "zone": open_df["zone"].to_numpy(),
+        "amount": pd.to_numeric(open_df["total_open_amount"], errors="coerce").fillna(0.0).to_numpy(),
+    })[scheduled]
+    ppd = ppd[scheduled]
+    std_shift = pd.to_timedelta(std_days[scheduled], unit="D")
+
+    scenarios = {"expected": ppd, "early": ppd - std_shift, "late": ppd + std_shift}
+    buckets = []
+    for name, when in scenarios.items():
+        day = forecast_day_offsets(when, today).to_numpy()
+        buckets.append(frame.groupby([day, frame["currency"], frame["zone"]])["amount"].sum().rename(name))
+    daily = pd.concat(buckets, axis=1).fillna(0.0)
+    daily.index.names = ["day", "currency", "zone"]
+
+    week = forecast_day_offsets(ppd, today).to_numpy() // 7
+    if top_customers is None:
+        in_top = np.ones(len(frame), dtype=bool)
+    else:
+        top = frame.groupby("cust_number")["amount"].sum().nlargest(top_customers).index
+        in_top = frame["cust_number"].isin(top).to_numpy()
+    customers = frame[in_top].groupby(
+        [frame["cust_number"][in_top], frame["company_name"][in_top], week[in_top]]
+    )["amount"].sum()
+    customers.index.names = ["cust_number", "company_name", "week"]
+
+    return {
+        "daily": daily.reset_index(),
+        "customers": customers.rename("expected").reset_index(),
+        "overdue": float(frame["amount"][(ppd.dt.normalize() < today).to_numpy()].sum()),
+        "unscheduled": float(pd.to_numeric(open_df["total_open_amount"], errors="coerce").fillna(0.0)[~scheduled].sum()),
+        "invoices": int(scheduled.sum()),
+    }
+
+def merge_forecast_partials(partials, top_customers=None):
+    """Folds forecast partials into one; top_customers trims the per-customer weeks to the largest customers."""
+    customers = pd.concat([p["customers"] for p in partials], ignore_index=True)\
+                  .groupby(["cust_number", "company_name", "week"], as_index=False)["expected"].sum()
+    if top_customers is not None:
+        top = customers.groupby("cust_number")["expected"].sum().nlargest(top_customers).index
+        customers = customers[customers["cust_number"].isin(top)].reset_index(drop=True)
+    return {
+        "daily": pd.concat([p["daily"] for p in partials], ignore_index=True)
+                   .groupby(["day", "currency", "zone"], as_index=False)[["expected", "early", "late"]].sum(),
+        "customers": customers,
+        "overdue": sum(p["overdue"] for p in partials),
+        "unscheduled": sum(p["unscheduled"] for p in partials),
+        "invoices": sum(p["invoices"] for p in partials),
+    }
+
+def _rounded(values):
+    return [round(float(v), 2) for v in values]
+
+def persist_forecast(partials, today):
+    """Merges forecast partials and writes the compact cash_forecast docs (summary / daily / weekly / customers)."""
+    horizon = FORECAST_HORIZON_DAYS
+    n_weeks = -(-horizon // 7)
+    daily = pd.concat([p["daily"] for p in partials], ignore_index=True)\
+              .groupby(["day", "currency", "zone"], as_index=False)[["expected", "early", "late"]].sum()
+    customers = pd.concat([p["customers"] for p in partials], ignore_index=True)
+
+    def per_day(frame, column):
+        # index `horizon` holds everything predicted beyond the horizon
+        return np.bincount(frame["day"].to_numpy(dtype=np.int64), weights=frame[column].to_numpy(), minlength=horizon + 1)
+
+    def per_week(frame, column):
+        within = frame["day"].to_numpy() < horizon
+        return np.bincount(frame["day"].to_numpy(dtype=np.int64)[within] // 7,
+                           weights=frame[column].to_numpy()[within], minlength=n_weeks)
+
+    expected, early, late = (per_day(daily, c) for c in ("expected", "early", "late"))
+    total = float(expected.sum())
+    # "this week" matches the dashboard widget: predicted on or before today + 7 (overdue included)
+    next_7 = float(expected[:8].sum())
+
+    as_of = today.strftime("%Y-%m-%d")
+    common = {"as_of": as_of, "horizon_days": horizon, "generated_at": firestore.SERVER_TIMESTAMP}
+
+    summary = {
+        **common,
+        "currency_basis": "USD",  # amounts are normalized like total_open_amount (CAD converted)
+        "invoice_count": sum(p["invoices"] for p in partials),
+        "total_pipeline": round(total, 2),
+        "next_7_days": round(next_7, 2),
+        "next_7_days_low": round(float(late[:8].sum()), 2),
+        "next_7_days_high": round(float(early[:8].sum()), 2),
+        "pipeline_later": round(total - next_7, 2),
+        "overdue": round(sum(p["overdue"] for p in partials), 2),
+        "beyond_horizon": round(float(expected[horizon]), 2),
+        "unscheduled": round(sum(p["unscheduled"] for p in partials), 2),
+        "by_currency": {k: round(float(v), 2) for k, v in daily.groupby("currency")["expected"].sum().items()},
+        "by_zone": {k: round(float(v), 2) for k, v in daily.groupby("zone")["expected"].sum().items()},
+    }
+
+    # cumulative curves carry the band: "high" = everyone pays early, "low" = everyone pays late
+    daily_doc = {
+        **common,
+        "start_date": as_of,
+        "expected": _rounded(expected[:horizon]),
+        "cumulative": _rounded(np.cumsum(expected[:horizon])),
+        "cumulative_low": _rounded(np.cumsum(late[:horizon])),
+        "cumulative_high": _rounded(np.cumsum(early[:horizon])),
+    }
+
+    weekly_doc = {
+        **common,
+        "start_date": as_of,
+        "expected": _rounded(per_week(daily, "expected")),
+        "low": _rounded(per_week(daily, "late")),
+        "high": _rounded(per_week(daily, "early")),
+        "by_currency": {k: _rounded(per_week(g, "expected")) for k, g in daily.groupby("currency")},
+        "by_zone": {k: _rounded(per_week(g, "expected")) for k, g in daily.groupby("zone")},
+    }
+
+    top_customers = []
+    if not customers.empty:
+        totals = customers.groupby(["cust_number", "company_name"])["expected"].sum().nlargest(FORECAST_TOP_CUSTOMERS)
+        for (cust_number, company_name), cust_total in totals.items():
+            rows = customers[customers["cust_number"] == cust_number]
+            weeks = np.bincount(np.minimum(rows["week"].to_numpy(dtype=np.int64), n_weeks),
+                                weights=rows["expected"].to_numpy(), minlength=n_weeks + 1)
+            top_customers.append({
+                "cust_number": cust_number,
+                "company_name": company_name,
+                "total": round(float(cust_total), 2),
+                "weekly": _rounded(weeks[:n_weeks]),
+                "beyond_horizon": round(float(weeks[n_weeks]), 2),
+            })
+    customers_doc = {**common, "top": top_customers}
+
+    batch = db.batch()
+    forecast_ref = db.collection(FORECAST_COLLECTION)
+    batch.set(forecast_ref.document("summary"), summary)
+    batch.set(forecast_ref.document("daily"), daily_doc)
+    batch.set(forecast_ref.document("weekly"), weekly_doc)
+    batch.set(forecast_ref.document("customers"), customers_doc)
+    commit_batch_safe(batch)
+    print(f"📈 Forecast: ${summary['next_7_days']:,.0f} expected in 7 days, ${total:,.0f} pipeline "
+          f"({summary['invoice_count']} invoices)")
+    return summary
+
+# --------------------
+# 6. SHADOW SCORING
+# --------------------
+def shadow_partials(open_df, today):
+    """
+    Zone agreement between the active model (open_df["zone"]) and the shadow model's
+    predictions on the same invoices. Counts are additive across shards.
+    """
+    shadow_df = open_df[["due_date", "late_payment_ratio", "total_open_amount"]].copy()
+    shadow_df["predicted_delay"] = open_df["shadow_predicted_delay"]
+    shadow_df["predicted_payment_date"] = open_df["due_date"] + pd.to_timedelta(shadow_df["predicted_delay"], unit="D")
+    pairs = pd.DataFrame({
+        "active": open_df["zone"].to_numpy(),
+        "shadow": assign_zones(shadow_df, today),
+        "amount": shadow_df["total_open_amount"].to_numpy(),
+    })
+    grouped = pairs.groupby(["active", "shadow"])["amount"].agg(["size", "sum"])
+    return {
+        "active_version": open_df.attrs.get("model_version"),
+        "shadow_version": open_df.attrs.get("shadow_version"),
+        "pairs": {f"{a}>{b}": int(n) for (a, b), n in grouped["size"].items()},
+        "pair_amounts": {f"{a}>{b}": float(v) for (a, b), v in grouped["sum"].items()},
+        "abs_delay_diff": float((open_df["shadow_predicted_delay"] - open_df["predicted_delay"]).abs().sum()),
+        "invoices": len(open_df),
+    }
+
+def merge_shadow_partials(partials):
+    """Sums shadow partials (from shards or chunks) into one."""
+    pairs, pair_amounts = {}, {}
+    for p in partials:
+        for key, n in p["pairs"].items():
+            pairs[key] = pairs.get(key, 0) + n
+        for key, v in p["pair_amounts"].items():
+            pair_amounts[key] = pair_amounts.get(key, 0.0) + v
+    return {
+        "active_version": partials[0]["active_version"],
+        "shadow_version": partials[0]["shadow_version"],
+        "pairs": pairs,
+        "pair_amounts": pair_amounts,
+        "abs_delay_diff": sum(p["abs_delay_diff"] for p in partials),
+        "invoices": sum(p["invoices"] for p in partials),
+    }
+
+def persist_shadow_report(partials, today):
+    """Writes one model_shadow_reports doc with per-zone disagreement for this run."""
+    merged = merge_shadow_partials(partials)
+    pairs, pair_amounts = merged["pairs"], merged["pair_amounts"]
+    invoices = merged["invoices"]
+    active_version, shadow_version = merged["active_version"], merged["shadow_version"]
+
+    zones = {}
+    for key, n in pairs.items():
+        active_zone, shadow_zone = key.split(">")
+        z = zones.setdefault(active_zone, {"cases": 0, "disagree": 0, "disagree_amount": 0.0, "to": {}})
+        z["cases"] += n
+        if shadow_zone != active_zone:
+            z["disagree"] += n
+            z["disagree_amount"] = round(z["disagree_amount"] + pair_amounts[key], 2)
+            z["to"][shadow_zone] = z["to"].get(shadow_zone, 0) + n
+    for z in zones.values():
+        z["rate"] = round(z["disagree"] / z["cases"], 4) if z["cases"] else 0.0
+
+    disagree = sum(z["disagree"] for z in zones.values())
+    as_of = today.strftime("%Y-%m-%d")
+    report = {
+        "as_of": as_of,
+        "active_version": active_version,
+        "shadow_version": shadow_version,
+        "invoices": invoices,
+        "disagree": disagree,
+        "disagree_rate": round(disagree / invoices, 4) if invoices else 0.0,
+        "mean_abs_delay_diff": round(merged["abs_delay_diff"] / invoices, 3) if invoices else 0.0,
+        "zones": zones,
+        "generated_at": firestore.SERVER_TIMESTAMP,
+    }
+    batch = db.batch()
+    batch.set(db.collection(SHADOW_REPORT_COLLECTION).document(f"{as_of}_{active_version}_vs_{shadow_version}"), report)
+    commit_batch_safe(batch)
+    print(f"👥 Shadow {shadow_version} vs {active_version}: {disagree}/{invoices} invoices change zone "
+          f"({report['disagree_rate']:.1%}), mean |Δdelay| {report['mean_abs_delay_diff']} days")
+    return report
+
+# --------------------
+# 7. CUSTOMER READ MODEL
+# --------------------
+def _day(value):
+    return value.strftime("%Y-%m-%d") if pd.notna(value) else None
+
+def top_per_customer(frame, by, n):
+    """The first `n` rows of each customer, latest `by` first (ties broken by case id)."""
+    frame = frame.sort_values(["cust_number", by, "case_id"], ascending=[True, False, True], na_position="last")
+    return frame.groupby("cust_number", sort=False).head(n).reset_index(drop=True)
+
+def _text_column(df, column, default=""):
+    if column not in df.columns:
+        return np.full(len(df), default, dtype=object)
+    return df[column].astype(object).where(df[column].notna(), default).astype(str).to_numpy()
+
+def summary_history_partials(df):
+    """
+    Per-customer pieces of the summaries that need every case (open and closed):
+    the most recent invoices and invoice / open totals per customer name.
+    Amounts are in the invoice currency, as the cases show them. Mergeable across chunks.
+    """
+    original = pd.to_numeric(df["original_amount"], errors="coerce") if "original_amount" in df.columns \
+        else pd.Series(np.nan, index=df.index)
+    original = original.fillna(df["case_amount"])
+    frame = pd.DataFrame({
+        "cust_number": df["cust_number"].astype(str).to_numpy(),
+        "case_id": df["_doc_id"].to_numpy(),
+        "invoice_id": _text_column(df, "invoice_id"),
+        "name": _text_column(df, "name_customer", "Unknown"),
+        "created": df["invoice_date"].to_numpy(),
+        "due": df["due_date"].to_numpy(),
+        "currency": df["invoice_currency"].astype(str).to_numpy(),
+        "amount": df["case_amount"].to_numpy(dtype=float),
+        "original_amount": original.to_numpy(dtype=float),
+        "open": df["is_open_flag"].to_numpy(dtype=bool),
+    })
+    entities = frame.assign(open_amount=np.where(frame["open"], frame["amount"], 0.0))\
+                    .groupby(["cust_number", "name"])\
+                    .agg(invoices=("open", "size"), open_count=("open", "sum"), open_amount=("open_amount", "sum"))\
+                    .reset_index()
+    return {"recent": top_per_customer(frame, "created", SUMMARY_RECENT_INVOICES), "entities": entities}
+
+def merge_summary_history(partials):
+    return {
+        "recent": top_per_customer(pd.concat([p["recent"] for p in partials], ignore_index=True),
+                                   "created", SUMMARY_RECENT_INVOICES),
+        "entities": pd.concat([p["entities"] for p in partials], ignore_index=True)
+                      .groupby(["cust_number", "name"], as_index=False)[["invoices", "open_count", "open_amount"]].sum(),
+    }
+
+def summary_open_partials(open_df, today, recent_ids):
+    """
+    Per-customer pieces that need the scored open invoices: zone counts / amounts,
+    overdue amount, the open invoice list, and the zones of the invoices in
+    `recent_ids` (case ids of the recent-invoice lists). Zone / overdue totals are
+    on the USD basis of total_open_amount, listed invoices in their own currency.
+    Mergeable across chunks.
+    """
+    frame = pd.DataFrame({
+        "cust_number": open_df["cust_number"].astype(str).to_numpy(),
+        "case_id": open_df["_doc_id"].to_numpy(),
+        "invoice_id": _text_column(open_df, "invoice_id"),
+        "name": _text_column(open_df, "name_customer", "Unknown"),
+        "document_type": _text_column(open_df, "document_type", "Invoice"),
+        "due": open_df["due_date"].to_numpy(),
+        "amount": open_df["total_open_amount"].to_numpy(dtype=float),
+        "currency": open_df["invoice_currency"].astype(str).to_numpy(),
+        "case_amount": open_df["case_amount"].to_numpy(dtype=float),
+        "zone": open_df["zone"].to_numpy(),
+        "predicted_delay": open_df["predicted_delay"].to_numpy(dtype=float),
+        "predicted_payment_date": pd.to_datetime(open_df["predicted_payment_date"]).to_numpy(),
+    })
+    zones = frame.assign(overdue=np.where(frame["due"] < today, frame["amount"], 0.0))\
+                 .groupby(["cust_number", "zone"])\
+                 .agg(cases=("amount", "size"), amount=("amount", "sum"), overdue=("overdue", "sum"))\
+                 .reset_index()
+    return {
+        "zones": zones,
+        "open": top_per_customer(frame, "due", SUMMARY_OPEN_INVOICES),
+        "recent_scores": frame.loc[frame["case_id"].isin(recent_ids), ["case_id", "zone", "predicted_delay"]],
+    }
+
+def merge_summary_open(partials):
+    return {
+        "zones": pd.concat([p["zones"] for p in partials], ignore_index=True)
+                   .groupby(["cust_number", "zone"], as_index=False)[["cases", "amount", "overdue"]].sum(),
+        "open": top_per_customer(pd.concat([p["open"] for p in partials], ignore_index=True),
+                                 "due", SUMMARY_OPEN_INVOICES),
+        "recent_scores": pd.concat([p["recent_scores"] for p in partials], ignore_index=True),
+    }
+
+def persist_customer_summaries(company_features, history, scored, today, desc="Saving Summaries"):
+    """
+    Writes one customer_summaries doc per customer: the company profile fields plus
+    open totals, zone counts, per-name totals, the latest invoices and the open
+    invoices (newest due date first). The profile pages read this single doc.
+    Returns the number of docs written.
+    """
+    recent = history["recent"]
+    if scored is not None:
+        recent = recent.merge(scored["recent_scores"], on="case_id", how="left")
+    else:
+        recent = recent.assign(zone=None, predicted_delay=np.nan)
+
+    def by_customer(frame):
+        if frame is None or frame.empty:
+            return {}
+        return {cust: group for cust, group in frame.groupby("cust_number", sort=False)}
+
+    recent_by = by_customer(recent)
+    entities_by = by_customer(history["entities"])
+    zones_by = by_customer(scored["zones"]) if scored is not None else {}
+    open_by = by_customer(scored["open"]) if scored is not None else {}
+
+    print(f"Persisting {len(company_features)} customer summaries...")
+    as_of = today.strftime("%Y-%m-%d")
+    batch = db.batch()
+    commit_count = 0
+    for _, row in tqdm(company_features.iterrows(), total=len(company_features), desc=desc):
+        cust = str(row["cust_number"])
+        zones = zones_by.get(cust)
+        entities = entities_by.get(cust)
+        open_rows = open_by.get(cust)
+        open_count = int(zones["cases"].sum()) if zones is not None else 0
+
+        payload = {
+            **company_profile_payload(row),
+            "as_of": as_of,
+            "currency_basis": "USD",  # customer totals; branch and invoice amounts are in the invoice currency
+            "invoice_count": int(entities["invoices"].sum()) if entities is not None else 0,
+            "open_count": open_count,
+            "open_amount": round(float(zones["amount"].sum()), 2) if zones is not None else 0.0,
+            "overdue_amount": round(float(zones["overdue"].sum()), 2) if zones is not None else 0.0,
+            "zone_counts": {z.zone: int(z.cases) for z in zones.itertuples()} if zones is not None else {},
+            "zone_amounts": {z.zone: round(float(z.amount), 2) for z in zones.itertuples()} if zones is not None else {},
+            "entities": [{
+                "name": e.name,
+                "invoices": int(e.invoices),
+                "open_count": int(e.open_count),
+                "open_amount": round(float(e.open_amount), 2),
+            } for e in entities.itertuples()] if entities is not None else [],
+            "recent_invoices": [{
+                "id": r.case_id,
+                "invoice_id": r.invoice_id,
+                "name": r.name,
+                "created": _day(r.created),
+                "due": _day(r.due),
+                "currency": r.currency,
+                "amount": round(float(r.amount), 2),
+                "original_amount": round(float(r.original_amount), 2),
+                "open": bool(r.open),
+                "zone": r.zone if isinstance(r.zone, str) else None,
+                "predicted_delay": round(float(r.predicted_delay), 1) if pd.notna(r.predicted_delay) else None,
+            } for r in recent_by[cust].itertuples()] if cust in recent_by else [],
+            "open_invoices": [{
+                "id": r.case_id,
+                "invoice_id": r.invoice_id,
+                "name": r.name,
+                "document_type": r.document_type,
+                "due": _day(r.due),
+                "currency": r.currency,
+                "amount": round(float(r.case_amount), 2),
+                "zone": r.zone,
+                "predicted_delay": round(float(r.predicted_delay), 1),
+                "predicted_payment_date": _day(r.predicted_payment_date),
+            } for r in open_rows.itertuples()] if open_rows is not None else [],
+            "open_truncated": open_count > SUMMARY_OPEN_INVOICES,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }
+        batch.set(db.collection(SUMMARY_COLLECTION).document(cust), payload)
+        commit_count += 1
+        if commit_count >= BATCH_COMMIT_SIZE:
+            commit_batch_safe(batch)
+            batch = db.batch()
+            commit_count = 0
+    if commit_count > 0:
+        commit_batch_safe(batch)
+    return len(company_features)
+
+def update_customer_read_model(stats, company_features, history, scored, today, bucket_range=None, tag=""):
+    """Writes this run's (or shard's) customer summaries and keeps its search rows; the index is global."""
+    stats["summaries"] = persist_customer_summaries(company_features, history, scored, today, desc=f"{tag}Saving Summaries")
+    stats["search"] = [customer_search_rows(company_features, scored)]
+    if bucket_range is None:
+        persist_search_index(stats["search"][0], today)
+
+def customer_search_rows(company_features, scored):
+    """What the search index shows per customer (shards send these to the parent)."""
+    open_amount = scored["zones"].groupby("cust_number")["amount"].sum() if scored is not None else pd.Series(dtype=float)
+    return pd.DataFrame({
+        "cust_number": company_features["cust_number"].astype(str).to_numpy(),
+        "company_name": company_features["company_name"].astype(object).where(company_features["company_name"].notna(), "Unknown").to_numpy(),
+        "late_payment_ratio": company_features["late_payment_ratio"].to_numpy(dtype=float),
+        "avg_payment_delay": company_features["avg_payment_delay"].to_numpy(dtype=float),
+        "open_amount": open_amount.reindex(company_features["cust_number"].astype(str)).fillna(0.0).to_numpy(),
+    })
+
+def search_tokens(*texts):
+    """Lower-cased words (letters / digits) of the given texts; the frontend splits queries the same way."""
+    tokens = []
+    for text in texts:
+        if text is None or pd.isna(text):
+            continue
+        tokens.extend(re.findall(r"[^\W_]+", str(text).lower()))
+    return list(dict.fromkeys(tokens))
+
+def build_search_index(rows):
+    """
+    Prefix index over company-name words and the customer number, as {doc_id: payload}.
+
+    Doc `ab` lists every customer with a token starting with "ab" (largest open
+    balance first). A prefix with more than SEARCH_MAX_ENTRIES customers is marked
+    `split` and its tokens are indexed again one character deeper ("abc", "abd", ...);
+    the split doc keeps the exact matches and the largest accounts, so a search reads
+    at most one doc per extra character typed. `_top` holds the largest accounts
+    overall (the directory before anything is typed).
+    """
+    rows = rows.sort_values(["open_amount", "cust_number"], ascending=[False, True]).reset_index(drop=True)
+    entries, postings = [], []
+    for i, row in enumerate(rows.itertuples(index=False)):
+        tokens = search_tokens(row.company_name, row.cust_number)
+        entries.append({
+            "id": str(row.cust_number),
+            "name": row.company_name,
+            "t": tokens,
+            "late": round(float(row.late_payment_ratio), 4),
+            "delay": round(float(row.avg_payment_delay), 2),
+            "open": round(float(row.open_amount), 2),
+        })
+        postings.extend((token, i) for token in tokens)
+
+    docs = {}
+    pending = [(SEARCH_MIN_PREFIX, postings)]
+    while pending:
+        length, items = pending.pop()
+        groups = {}
+        for token, i in items:
+            groups.setdefault(token[:length], []).append((token, i))
+        for prefix, group in groups.items():
+            members = sorted({i for _, i in group})
+            deeper = [(token, i) for token, i in group if len(token) > length]
+            split = len(members) > SEARCH_MAX_ENTRIES and bool(deeper)
+            if split:
+                pending.append((length + 1, deeper))
+                exact = {i for token, i in group if token == prefix}
+                members = sorted(exact) + [i for i in members if i not in exact]
+            docs[prefix] = {
+                "prefix": prefix,
+                "split": split,
+                "count": len(members),
+                "entries": [entries[i] for i in members[:SEARCH_MAX_ENTRIES]],
+            }
+    docs["_top"] = {"prefix": "", "split": True, "count": len(entries), "entries": entries[:SEARCH_MAX_ENTRIES]}
+    return docs
+
+def persist_search_index(rows, today):
+    """
+    Rewrites the customer_search docs whose content changed (md5 checksum, like the
+    CSV import) and deletes prefixes that no longer exist. `_meta` describes the index.
+    """
+    docs = build_search_index(rows)
+    collection_ref = db.collection(SEARCH_INDEX_COLLECTION)
+    existing = {doc.id: (doc.to_dict() or {}).get("checksum") for doc in collection_ref.select(["checksum"]).stream()}
+
+    batch = db.batch()
+    commit_count = 0
+    written = 0
+    writes = [(doc_id, payload) for doc_id, payload in docs.items()]
+    writes += [(doc_id, None) for doc_id in existing if doc_id not in docs and doc_id != "_meta"]
+    for doc_id, payload in tqdm(writes, desc="Search Index"):
+        if payload is None:
+            batch.delete(collection_ref.document(doc_id))
+        else:
+            checksum = hashlib.md5(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+            if existing.get(doc_id) == checksum:
+                continue
+            batch.set(collection_ref.document(doc_id), {**payload, "checksum": checksum})
+        written += 1
+        commit_count += 1
+        if commit_count >= BATCH_COMMIT_SIZE:
+            commit_batch_safe(batch)
+            batch = db.batch()
+            commit_count = 0
+
+    batch.set(collection_ref.document("_meta"), {
+        "as_of": today.strftime("%Y-%m-%d"),
+        "min_prefix": SEARCH_MIN_PREFIX,
+        "max_entries": SEARCH_MAX_ENTRIES,
+        "customers": len(rows),
+        "docs": len(docs),
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    })
+    commit_batch_safe(batch)
+    print(f"🔎 Search index: {len(docs)} prefix docs for {len(rows)} customers ({written} written or removed)")
+    return len(docs)
+
+# --------------------
+# 8. STREAMING MODE
+# --------------------
+def stream_case_chunks(bucket_range=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields the `cases` collection (or one shard's bucket range) as pages of at most
+    `chunk_size` document snapshots. Each page starts after the last doc of the
+    previous one, so only one page is held at a time.
+    """
+    query = db.collection("cases").select(CASE_FIELDS)
+    if bucket_range is not None:
+        lo, hi = bucket_range
+        query = query.where(filter=FieldFilter("shard_bucket", ">=", lo))\
+                     .where(filter=FieldFilter("shard_bucket", "<", hi))\
+                     .order_by("shard_bucket")
+    query = query.order_by("__name__").limit(chunk_size)
+
+    last_doc = None
+    while True:
+        page = (query.start_after(last_doc) if last_doc is not None else query).get()
+        if page:
+            yield page
+        if len(page) < chunk_size:
+            return
+        last_doc = page[-1]
+
+def customer_aggregates(df):
+    """
+    Mergeable per-customer history for one prepared chunk: counts, sums, min / max
+    and the (mean, M2) pair of the payment delay. Customers with only open invoices
+    get a row too, so the customer list matches build_company_features().
+    """
+    history = df.loc[~df["is_open_flag"]]
+    grp = history.groupby("cust_number")
+    delay = grp["payment_delay"]
+    agg = pd.DataFrame({
+        "history": grp.size(),
+        "late": (history["payment_delay"] > 0).groupby(history["cust_number"]).sum(),
+        "delay_n": delay.count(),
+        "delay_sum": delay.sum(),
+        "delay_mean": delay.mean(),
+        "delay_m2": delay.var(ddof=0) * delay.count(),
+        "delay_min": delay.min(),
+        "delay_max": delay.max(),
+        "age_sum": grp["invoice_age_at_clearing"].sum(),
+        "age_n": grp["invoice_age_at_clearing"].count(),
+        "due_sum": grp["due_days"].sum(),
+        "due_n": grp["due_days"].count(),
+        "amount_sum": grp["total_open_amount"].sum(),
+        "amount_n": grp["total_open_amount"].count(),
+    })
+    return agg.reindex(agg.index.union(pd.Index(df["cust_number"].unique())))
+
+def merge_customer_aggregates(a, b):
+    """Combines two customer_aggregates() frames (pairwise mean / M2 update for the delay)."""
+    if a is None:
+        return b
+    index = a.index.union(b.index)
+    a, b = a.reindex(index), b.reindex(index)
+
+    merged = a[AGGREGATE_SUM_COLUMNS].fillna(0) + b[AGGREGATE_SUM_COLUMNS].fillna(0)
+    na, nb = a["delay_n"].fillna(0), b["delay_n"].fillna(0)
+    n = na + nb
+    mean_a = a["delay_mean"].fillna(0)
+    delta = b["delay_mean"].fillna(0) - mean_a
+    share_b = nb / n.where(n > 0)  # NaN for customers with no delay values yet
+    merged["delay_mean"] = mean_a + delta * share_b
+    merged["delay_m2"] = a["delay_m2"].fillna(0) + b["delay_m2"].fillna(0) + delta ** 2 * na * share_b
+    merged["delay_min"] = np.fmin(a["delay_min"], b["delay_min"])
+    merged["delay_max"] = np.fmax(a["delay_max"], b["delay_max"])
+    return merged
+
+def merge_name_counts(a, b):
+    return b if a is None else a.add(b, fill_value=0)
+
+def company_features_from_aggregates(agg, name_counts):
+    """Same table as build_company_features(), rebuilt from the folded chunk aggregates."""
+    agg = agg.sort_index()
+    agg.index.name = None
+    history = agg["history"].fillna(0)
+    has_history = history > 0
+    delay_n = agg["delay_n"].fillna(0)
+
+    company_name = pd.Series(np.nan, index=agg.index, dtype=object)
+    if name_counts is not None and not name_counts.empty:
+        # mode per customer; ties go to the smallest name, like most_frequent_names()
+        top = name_counts.rename("n").reset_index()\
+                         .sort_values(["cust_number", "n", "name_customer"], ascending=[True, False, True])\
+                         .drop_duplicates("cust_number").set_index("cust_number")["name_customer"]
+        company_name = top.reindex(agg.index)
+
+    company_features = pd.DataFrame({
+        "cust_code": np.arange(len(agg), dtype=np.int32),
+        "cust_number": agg.index.astype(str),
+        "company_name": company_name.to_numpy(),
+        # sum / n like the in-memory mean; the merged delay_mean is only for the M2 update
+        "avg_payment_delay": (agg["delay_sum"] / delay_n.where(delay_n > 0)).to_numpy(),
+        "std_payment_delay": np.sqrt((agg["delay_m2"].clip(lower=0) / (delay_n - 1).where(delay_n > 1)).to_numpy(dtype=float)),
+        "min_delay": agg["delay_min"].to_numpy(),
+        "max_delay": agg["delay_max"].to_numpy(),
+        "avg_days_to_clear": (agg["age_sum"] / agg["age_n"].where(agg["age_n"] > 0)).to_numpy(),
+        "avg_due_days": (agg["due_sum"] / agg["due_n"].where(agg["due_n"] > 0)).to_numpy(),
+        "avg_invoice_amount": (agg["amount_sum"] / agg["amount_n"].where(agg["amount_n"] > 0)).to_numpy(),
+        "total_lifetime_value": agg["amount_sum"].where(has_history).to_numpy(),
+        "transaction_count": agg["amount_n"].where(has_history).to_numpy(),
+        "late_payment_ratio": (agg["late"] / history.where(has_history)).to_numpy(),
+    })
+    company_features.fillna(FEATURE_DEFAULTS, inplace=True)
+    return company_features
+
+def chunk_snapshot_path(snapshot_path, chunk_index):
+    base, ext = os.path.splitext(snapshot_path)
+    return f"{base}.part{chunk_index:05d}{ext}"
+
+def run_streaming_ml_job(bucket_range=None, chunk_size=DEFAULT_CHUNK_SIZE, num_threads=0, label=None,
+                         snapshot_path=None, today=None):
+    """
+    Bounded-memory run_ml_job: the same stages, reading `cases` in pages of `chunk_size`.
+    Pass 1 folds every page into per-customer aggregates (backfilling like fetch_cases);
+    pass 2 re-reads the pages and scores, zones and writes back their open invoices.
+    Memory grows with the number of customers, not with the number of cases.
+    Snapshots are written one file per page (see chunk_snapshot_path).
+    """
+    tag = f"[{label}] " if label else ""
+    print(f"{tag}Starting ML job (streaming, {chunk_size} cases per chunk)...")
+    start_ts = time.time()
+    stats = empty_job_stats()
+    today = today if today is not None else pd.Timestamp.today().normalize()
+
+    # Pass 1: customer history
+    aggregates, name_counts, summary_history = None, None, None
+    batch = db.batch()
+    batch_count = 0
+    for page in tqdm(stream_case_chunks(bucket_range, chunk_size), desc=f"{tag}Pass 1/2: Aggregating", unit="chunk"):
+        rows = []
+        for doc in page:
+            d = doc.to_dict()
+            d["_doc_id"] = doc.id
+            backfill = case_backfill(d)
+            if backfill:
+                batch.update(db.collection("cases").document(doc.id), backfill)
+                batch_count += 1
+                stats["backfilled"] += 1
+                if batch_count >= BATCH_COMMIT_SIZE:
+                    commit_batch_safe(batch)
+                    batch = db.batch()
+                    batch_count = 0
+            rows.append(d)
+
+        # prepare_cases() works per case, so pages with different fields agree with the in-memory job
+        chunk = prepare_cases(pd.DataFrame(rows))
+        del rows
+        stats["cases_fetched"] += len(chunk)
+        aggregates = merge_customer_aggregates(aggregates, customer_aggregates(chunk))
+        name_counts = merge_name_counts(name_counts, chunk[["cust_number", "name_customer"]].value_counts())
+        summary_history = merge_summary_history([p for p in (summary_history, summary_history_partials(chunk)) if p])
+        del chunk
+
+    if batch_count > 0:
+        commit_batch_safe(batch)
+    if stats["backfilled"]:
+        print(f"{tag}✅ Backfilled 'original_amount' for {stats['backfilled']} cases.")
+
+    if not stats["cases_fetched"]:
+        print(f"{tag}No cases found. Exiting.")
+        return stats
+    print(f"{tag}Total cases fetched: {stats['cases_fetched']}")
+
+    print(f"{tag}Building Company Profile Features...")
+    company_features = company_features_from_aggregates(aggregates, name_counts)
+    del aggregates, name_counts
+    persist_company_features(company_features, desc=f"{tag}Saving Profiles")
+    stats["company_profiles"] = len(company_features)
+
+    # Pass 2: score and write back open invoices, one page at a time
+    customer_index = pd.Index(company_features["cust_number"])
+    recent_ids = set(summary_history["recent"]["case_id"])
+    forecast, shadow, scored = None, None, None
+    new_customers = 0
+    for chunk_index, page in enumerate(stream_case_chunks(bucket_range, chunk_size)):
+        chunk = prepare_cases(pd.DataFrame([{**doc.to_dict(), "_doc_id": doc.id} for doc in page]))
+        open_df = chunk.loc[chunk["is_open_flag"], [c for c in OPEN_INVOICE_COLUMNS if c in chunk.columns]]
+        del chunk
+
+        codes = customer_index.get_indexer(open_df["cust_number"])
+        # customers created after pass 1 have no profile yet; the next run picks them up
+        new_customers += int((codes < 0).sum())
+        open_df = open_df.loc[codes >= 0].assign(cust_code=codes[codes >= 0].astype(np.int32))
+        if open_df.empty:
+            continue
+
+        stats["open_invoices"] += len(open_df)
+        open_df = score_open_invoices(open_df, company_features, num_threads=num_threads)
+        if open_df is None:
+            stats["failed"] = True
+            return stats
+
+        if snapshot_path:
+            save_scored_snapshot(open_df, chunk_snapshot_path(snapshot_path, chunk_index))
+
+        updated, scheduled, zone_counts = write_predictions(open_df, today, desc=f"{tag}Pass 2/2: Chunk {chunk_index + 1}")
+        stats["updated"] += updated
+        stats["scheduled"] += scheduled
+        for zone, count in zone_counts.items():
+            stats["zones"][zone] = stats["zones"].get(zone, 0) + count
+
+        # partials are folded as we go, so they stay the size of one chunk's
+        forecast = merge_forecast_partials([p for p in (forecast, forecast_partials(open_df, today, top_customers=None)) if p])
+        if "shadow_predicted_delay" in open_df.columns:
+            shadow = merge_shadow_partials([p for p in (shadow, shadow_partials(open_df, today)) if p])
+        scored = merge_summary_open([p for p in (scored, summary_open_partials(open_df, today, recent_ids)) if p])
+        del open_df
+
+    if new_customers:
+        print(f"{tag}⚠️ Skipped {new_customers} open invoices of customers created during the run.")
+    if stats["open_invoices"] == 0:
+        print(f"{tag}No open invoices to score.")
+        update_customer_read_model(stats, company_features, summary_history, None, today, bucket_range, tag)
+        return stats
+
+    stats["forecast"] = [merge_forecast_partials([forecast], top_customers=FORECAST_TOP_CUSTOMERS)]
+    if bucket_range is None:
+        persist_forecast(stats["forecast"], today)
+    if shadow is not None:
+        stats["shadow"] = [shadow]
+        if bucket_range is None:
+            persist_shadow_report(stats["shadow"], today)
+
+    update_customer_read_model(stats, company_features, summary_history, scored, today, bucket_range, tag)
+
     elapsed = time.time() - start_ts
-    print(f"Updated {total_updates} open invoices. Elapsed: {elapsed:.1f}s")
+    print(f"{tag}Updated {stats['updated']} open invoices ({stats['scheduled']} with a pending zone change). Elapsed: {elapsed:.1f}s")
+    return stats
 
 # --------------------
-# 4. RUN
+# 9. MAIN JOB
 # --------------------
+def run_ml_job(bucket_range=None, num_threads=0, label=None, snapshot_path=None, today=None, chunk_size=None):
+    """
+    Fetch -> aggregate -> score -> write back.
+    With `bucket_range` set, only the cases in that shard-bucket range are processed;
+    since buckets are derived from cust_number, customer aggregates stay complete.
+    With `snapshot_path` set, the scored open invoices are also pickled there for
+    policy_simulator.py. A shard returns its forecast partials in stats["forecast"]
+    and leaves persisting them to run_sharded_ml_job.
+    With `chunk_size` set, runs run_streaming_ml_job instead (bounded memory).
+    Returns a stats dict (see empty_job_stats).
+    """
+    if chunk_size:
+        return run_streaming_ml_job(bucket_range, chunk_size, num_threads=num_threads, label=label,
+                                    snapshot_path=snapshot_path, today=today)
+
+    tag = f"[{label}] " if label else ""
+    print(f"{tag}Starting ML job...")
+    start_ts = time.time()
+    stats = empty_job_stats()
+
+    # 3.1 Fetch all cases
+    print(f"{tag}Fetching cases collection from Emulator...")
+    rows, stats["backfilled"] = fetch_cases(bucket_range, desc=f"{tag}Fetching & Backfilling")
+
+    if not rows:
+        print(f"{tag}No cases found. Exiting.")
+        return stats
+
+    df = pd.DataFrame(rows)
+    del rows
+    stats["cases_fetched"] = len(df)
+    print(f"{tag}Total cases fetched: {len(df)}")
+
+    # 3.2 - 3.5 Dates, amounts, metrics, flags
+    df = prepare_cases(df)
+
+    encode_customer_keys(df)
+
+    history_df = df.loc[~df["is_open_flag"], HISTORY_COLUMNS]
+    open_df = df.loc[df["is_open_flag"], [c for c in OPEN_INVOICE_COLUMNS if c in df.columns]]
+    summary_history = summary_history_partials(df)
+
+    # 3.6 Build Company Features
+    print(f"{tag}Building Company Profile Features...")
+    company_features = build_company_features(df, history_df)
+    del df, history_df
+    persist_company_features(company_features, desc=f"{tag}Saving Profiles")
+    stats["company_profiles"] = len(company_features)
+
+    today = today if today is not None else pd.Timestamp.today().normalize()
+
+    # 4. Enrich open invoices & predict
+    if open_df.empty:
+        print(f"{tag}No open invoices to score.")
+        update_customer_read_model(stats, company_features, summary_history, None, today, bucket_range, tag)
+        return stats
+
+    stats["open_invoices"] = len(open_df)
+    open_df = score_open_invoices(open_df, company_features, num_threads=num_threads)
+    if open_df is None:
+        stats["failed"] = True
+        return stats
+
+    if snapshot_path:
+        save_scored_snapshot(open_df, snapshot_path)
+
+    # 7. Update Cases
+    stats["updated"], stats["scheduled"], stats["zones"] = write_predictions(open_df, today, desc=f"{tag}Processing Predictions")
+
+    # 8. Cash-flow forecast
+    stats["forecast"] = [forecast_partials(open_df, today)]
+    if bucket_range is None:
+        persist_forecast(stats["forecast"], today)
+
+    # 9. Shadow model comparison (no extra reads: same frame, one report doc)
+    if "shadow_predicted_delay" in open_df.columns:
+        stats["shadow"] = [shadow_partials(open_df, today)]
+        if bucket_range is None:
+            persist_shadow_report(stats["shadow"], today)
+
+    # 10. Customer summaries & search index (read model for the profile / search pages)
+    scored = summary_open_partials(open_df, today, set(summary_history["recent"]["case_id"]))
+    update_customer_read_model(stats, company_features, summary_history, scored, today, bucket_range, tag)
+
+    elapsed = time.time() - start_ts
+    print(f"{tag}Updated {stats['updated']} open invoices ({stats['scheduled']} with a pending zone change). Elapsed: {elapsed:.1f}s")
+    return stats
+
+def shard_snapshot_path(snapshot_path, shard_index):
+    base, ext = os.path.splitext(snapshot_path)
+    return f"{base}.shard{shard_index}{ext}"
+
+def _run_shard(task):
+    shard_index, shard_count, num_threads, snapshot_path, today, chunk_size, models = task
+    global registry
+    # score with the models the parent verified, not whatever the manifest says by now
+    # (a worker keeps its loaded boosters while the tasks carry the same pin)
+    if registry != models:
+        registry = models
+    return run_ml_job(
+        bucket_range=shard_bucket_range(shard_index, shard_count),
+        num_threads=num_threads,
+        label=f"shard {shard_index + 1}/{shard_count}",
+        snapshot_path=shard_snapshot_path(snapshot_path, shard_index) if snapshot_path else None,
+        today=today,
+        chunk_size=chunk_size
+    )
+
+def run_sharded_ml_job(shard_count, shard_ids=None, processes=None, snapshot_path=None,
+                       chunk_size=None, today=None, partials_path=None):
+    """
+    Runs the job as `shard_count` customer-hash shards in worker processes.
+
+    `shard_ids` selects the shards this node owns, so several nodes can split one
+    book (e.g. node A: 0,1 and node B: 2,3 of 4). Shards only read cases that carry
+    `shard_bucket` (set on creation; see assign_shard_buckets for older cases).
+
+    The book-wide outputs (see persist_book_outputs) are only written by a node
+    that ran every shard. A node with a subset saves its partials to
+    `partials_path` instead; merge_node_partials() writes them once every node
+    is done. If scoring failed in any shard, nothing book-wide is written.
+    """
+    shard_ids = list(range(shard_count)) if shard_ids is None else list(shard_ids)
+    for shard_index in shard_ids:
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f"Shard id {shard_index} out of range for {shard_count} shards")
+    if len(set(shard_ids)) != len(shard_ids):
+        raise ValueError(f"Duplicate shard ids in {shard_ids}")
+
+    cpus = os.cpu_count() or 1
+    processes = processes or min(len(shard_ids), cpus)
+    num_threads = max(1, cpus // processes)
+
+    print(f"🧩 Sharded ML job: {len(shard_ids)}/{shard_count} shards on {processes} processes ({num_threads} LightGBM threads each)")
+    start_ts = time.time()
+
+    # one `today` for every shard so zones and forecast buckets line up
+    today = today if today is not None else pd.Timestamp.today().normalize()
+    # the parent's verified models; a worker that can't load them fails its shard instead of dying on import
+    models = model_registry().pin()
+    tasks = [(shard_index, shard_count, num_threads, snapshot_path, today, chunk_size, models) for shard_index in shard_ids]
+    # spawn (not fork): every worker needs its own gRPC channel and Booster
+    ctx = mp.get_context("spawn")
+    results = []
+    with ctx.Pool(processes=processes) as pool:
+        for shard_stats in pool.imap_unordered(_run_shard, tasks, chunksize=1):
+            results.append(shard_stats)
+            print(f"   ✅ Shard finished ({len(results)}/{len(tasks)}): {shard_stats['updated']} invoices updated")
+
+    stats = merge_job_stats(results)
+    if len(shard_ids) < shard_count and partials_path:
+        # saved even after a failure, so the merge knows this node's shards are incomplete
+        save_node_partials(stats, partials_path, today, shard_count, shard_ids)
+    elif stats["failed"]:
+        # like the single-process job: a shard that failed scoring has no forecast or search rows
+        print("❌ Scoring failed in a shard: skipping the cash forecast, shadow report and search index")
+    elif len(shard_ids) == shard_count:
+        persist_book_outputs(stats, today)
+    else:
+        # this node only saw part of the book; writing it would overwrite the other nodes' part
+        print(f"⚠️ Ran shards {shard_ids} of {shard_count}: skipping the cash forecast, shadow report and search index "
+              f"(use --partials on every node, then --merge-partials)")
+    elapsed = time.time() - start_ts
+    print(f"Updated {stats['updated']} open invoices across {len(tasks)} shards. Zones: {stats['zones']}. Elapsed: {elapsed:.1f}s")
+    return stats
+
+def persist_book_outputs(stats, today):
+    """Writes the outputs that need the whole book: cash forecast, shadow report and search index."""
+    if stats["forecast"]:
+        persist_forecast(stats["forecast"], today)
+    if stats["shadow"]:
+        persist_shadow_report(stats["shadow"], today)
+    if stats["search"]:
+        # the index is rebuilt from every customer (stale prefix docs are deleted)
+        persist_search_index(pd.concat(stats["search"], ignore_index=True), today)
+
+def save_node_partials(stats, path, today, shard_count, shard_ids):
+    """Pickles this node's book-wide partials for merge_node_partials (one file per node)."""
+    pd.to_pickle({
+        "today": today,
+        "shard_count": shard_count,
+        "shard_ids": sorted(shard_ids),
+        "forecast": stats["forecast"],
+        "shadow": stats["shadow"],
+        "search": stats["search"],
+        "failed": stats["failed"],
+    }, path)
+    failed = " (scoring failed: the merge will refuse them)" if stats["failed"] else ""
+    print(f"💾 Saved partials for shards {sorted(shard_ids)} of {shard_count} to {path}{failed}")
+
+def merge_node_partials(paths):
+    """
+    Loads the partial files written by every node (glob patterns allowed), checks
+    that together they cover each shard of one run exactly once and that no node
+    failed scoring, and writes the book-wide outputs.
+    """
+    files = sorted({f for pattern in paths for f in glob.glob(pattern)})
+    if not files:
+        raise FileNotFoundError(f"No partial files match {paths}")
+    nodes = [pd.read_pickle(f) for f in files]
+
+    today, shard_count = nodes[0]["today"], nodes[0]["shard_count"]
+    for f, node in zip(files, nodes):
+        if node["today"] != today or node["shard_count"] != shard_count:
+            raise ValueError(f"{f} is from another run ({node['today']:%Y-%m-%d}, {node['shard_count']} shards); "
+                             f"expected {today:%Y-%m-%d}, {shard_count} shards")
+    failed = [f for f, node in zip(files, nodes) if node["failed"]]
+    if failed:
+        raise RuntimeError(f"Scoring failed on the node(s) that wrote {failed}; rerun them before merging")
+    covered = sorted(s for node in nodes for s in node["shard_ids"])
+    if covered != list(range(shard_count)):
+        raise ValueError(f"Partials cover shards {covered}, expected each of 0..{shard_count - 1} exactly once")
+
+    stats = merge_job_stats(nodes)
+    versions = {(p["active_version"], p["shadow_version"]) for p in stats["shadow"]}
+    shadow_nodes = sum(1 for node in nodes if node["shadow"])
+    if versions and (len(versions) > 1 or shadow_nodes < len(nodes)):
+        # some node shadow-scored with other versions (or not at all): the report would mix them
+        print(f"⚠️ Shadow partials differ across nodes ({shadow_nodes}/{len(nodes)} nodes, versions {sorted(versions, key=str)}); "
+              f"skipping the shadow report")
+        stats["shadow"] = []
+    print(f"🧩 Merging partials of {len(nodes)} nodes ({shard_count} shards, {today:%Y-%m-%d})")
+    persist_book_outputs(stats, today)
+    return stats
+
+# --------------------
+# 10. RUN
+# --------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score open invoices and assign collection zones.")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Split the book into N customer-hash shards (default: 1, single process)")
+    parser.add_argument("--shard-ids", type=str, default=None,
+                        help="Comma-separated shard ids this node runs (default: all)")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Worker processes for sharded runs (default: min(shards, cpu count))")
+    parser.add_argument("--assign-shard-buckets", action="store_true",
+                        help="One-off migration: write shard_bucket onto cases created without it, then exit")
+    parser.add_argument("--watch", type=int, default=None, metavar="SECONDS",
+                        help="Keep running every SECONDS, hot-swapping models when the registry changes")
+    parser.add_argument("--snapshot", type=str, default=None,
+                        help="Also pickle the scored open invoices here (one file per shard / chunk) for policy_simulator.py")
+    parser.add_argument("--chunk-size", type=int, default=None, metavar="N",
+                        help=f"Stream cases in chunks of N with bounded memory (e.g. {DEFAULT_CHUNK_SIZE}; default: load everything)")
+    parser.add_argument("--partials", type=str, default=None,
+                        help="With --shard-ids: save this node's book-wide partials here for --merge-partials")
+    parser.add_argument("--merge-partials", type=str, nargs="+", default=None, metavar="FILE",
+                        help="Write the book-wide outputs from every node's --partials file (globs allowed)")
+    return parser.parse_args(argv)
+
+def run_once(args):
+    if args.merge_partials:
+        return merge_node_partials(args.merge_partials)
+    if args.shards > 1 or args.shard_ids:
+        shard_ids = [int(s) for s in args.shard_ids.split(",")] if args.shard_ids else None
+        return run_sharded_ml_job(
+            args.shards,
+            shard_ids=shard_ids,
+            processes=args.processes,
+            snapshot_path=args.snapshot,
+            chunk_size=args.chunk_size,
+            partials_path=args.partials
+        )
+    return run_ml_job(snapshot_path=args.snapshot, chunk_size=args.chunk_size)
+
 if __name__ == "__main__":
-    run_ml_job()
\ No newline at end of file
+    args = parse_args()
+    if args.assign_shard_buckets:
+        assign_shard_buckets()
+    elif args.watch is None:
+        run_once(args)
+    else:
+        while True:
+            try:
+                model_registry().refresh()
+            except Exception as e:
+                print(f"⚠️ Model registry refresh failed, keeping current models: {e}")
+            run_once(args)
+            print(f"💤 Next run in {args.watch}s...")
+            time.sleep(args.watch)
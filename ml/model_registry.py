@@ -0,0 +1,279 @@
+import lightgbm as lgb
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import threading
+from datetime import datetime
+
+# --------------------
+# CONFIG
+# --------------------
+REGISTRY_DIR = "model/registry"
+MANIFEST_NAME = "manifest.json"
+# Used when no registry manifest exists yet (the pre-registry single model file)
+LEGACY_MODEL_PATH = "model/payment_delay_lgb_model.txt"
+LEGACY_VERSION = "legacy"
+
+# --------------------
+# 1. FILE HELPERS
+# --------------------
+def file_sha256(path):
+    """Checksums a model file through a read-only memory map (no full copy in memory)."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256(b"").hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+def load_booster(root, entry, version, legacy_path=LEGACY_MODEL_PATH):
+    """Checksums and loads one registered model file (entry None = the legacy model file)."""
+    if entry is None:
+        return lgb.Booster(model_file=legacy_path)
+    path = os.path.join(root, entry["file"])
+    checksum = file_sha256(path)
+    if checksum != entry["sha256"]:
+        raise ValueError(f"Checksum mismatch for model {version}: {checksum} != {entry['sha256']}")
+    return lgb.Booster(model_file=path)
+
+def read_manifest(root=REGISTRY_DIR):
+    path = os.path.join(root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def write_manifest(manifest, root=REGISTRY_DIR):
+    """Atomic replace, so a running job never reads a half-written manifest."""
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+# --------------------
+# 2. REGISTRY ADMIN
+# --------------------
+def register_model(model_path, version=None, activate=False, shadow=False, root=REGISTRY_DIR):
+    """Copies a model file into the registry under `version` and records its checksum."""
+    manifest = read_manifest(root) or {"active": None, "shadow": None, "versions": {}}
+    version = version or datetime.now().strftime("v%Y%m%d%H%M%S")
+    if version in manifest["versions"]:
+        raise ValueError(f"Model version {version} is already registered")
+
+    filename = f"payment_delay_lgb_{version}.txt"
+    os.makedirs(root, exist_ok=True)
+    shutil.copyfile(model_path, os.path.join(root, filename))
+    manifest["versions"][version] = {
+        "file": filename,
+        "sha256": file_sha256(os.path.join(root, filename)),
+        "registered_at": datetime.now().isoformat(),
+        "source": os.path.abspath(model_path),
+    }
+    if activate or manifest["active"] is None:
+        manifest["active"] = version
+    if shadow:
+        manifest["shadow"] = version
+    write_manifest(manifest, root)
+    return version
+
+def set_role(role, version, root=REGISTRY_DIR):
+    """Points `active` or `shadow` at a registered version (version=None clears shadow)."""
+    manifest = read_manifest(root)
+    if manifest is None:
+        raise FileNotFoundError(f"No model registry at {root}")
+    if version is not None and version not in manifest["versions"]:
+        raise KeyError(f"Unknown model version {version}")
+    if role == "active" and version is None:
+        raise ValueError("The active model can't be cleared")
+    manifest[role] = version
+    write_manifest(manifest, root)
+
+# --------------------
+# 3. RUNTIME REGISTRY
+# --------------------
+class ModelRegistry:
+    """
+    Versioned boosters for a long-running process.
+
+    refresh() re-reads the manifest when it changes and swaps the active / shadow
+    roles in one reference assignment. The new active booster is loaded (after
+    checking the manifest checksum) before the swap, so a model that fails to load
+    never becomes active and the previous roles stay in place. Shadow boosters load
+    lazily on first use. Boosters are cached per version, and a call that already
+    holds a booster keeps using it.
+    """
+
+    def __init__(self, root=REGISTRY_DIR, legacy_path=LEGACY_MODEL_PATH):
+        self.root = root
+        self.legacy_path = legacy_path
+        self._lock = threading.Lock()
+        self._boosters = {}
+        self._manifest_mtime = None
+        self._roles = None  # (manifest or None for legacy, active_version, shadow_version)
+        if not self.refresh():
+            raise FileNotFoundError(f"No model registry at {root} and no model file at {legacy_path}")
+
+    def _manifest_path(self):
+        return os.path.join(self.root, MANIFEST_NAME)
+
+    def refresh(self):
+        """
+        Picks up manifest changes. Returns True if an active model is set.
+        Raises (keeping the current roles) if the new active model fails to load.
+        """
+        manifest_path = self._manifest_path()
+        if not os.path.exists(manifest_path):
+            if self._roles is None and os.path.exists(self.legacy_path):
+                booster = self._load(None, LEGACY_VERSION)
+                with self._lock:
+                    self._boosters[LEGACY_VERSION] = booster
+                self._roles = (None, LEGACY_VERSION, None)
+            return self._roles is not None
+
+        mtime = os.stat(manifest_path).st_mtime_ns
+        if mtime == self._manifest_mtime:
+            return True
+
+        manifest = read_manifest(self.root)
+        active_version = manifest["active"]
+        shadow_version = manifest.get("shadow")
+        if active_version not in manifest["versions"]:
+            raise KeyError(f"Active model {active_version} is not registered")
+        if shadow_version == active_version:
+            shadow_version = None
+
+        # load the new active model before switching to it; if this raises, nothing changes
+        # (the mtime isn't recorded either, so the next refresh tries again)
+        with self._lock:
+            active_booster = self._boosters.get(active_version)
+        if active_booster is None:
+            active_booster = self._load(manifest, active_version)
+
+        previous = self._roles
+        with self._lock:
+            # drop cached boosters that no longer have a role
+            keep = {active_version, shadow_version}
+            self._boosters = {v: b for v, b in self._boosters.items() if v in keep}
+            self._boosters[active_version] = active_booster
+        self._roles = (manifest, active_version, shadow_version)
+        self._manifest_mtime = mtime
+
+        if previous is None or previous[1] != active_version:
+            print(f"🔁 Active model: {active_version}")
+        if (previous[2] if previous else None) != shadow_version:
+            print(f"👥 Shadow model: {shadow_version or 'none'}")
+        return True
+
+    def _load(self, manifest, version):
+        """Checksums and loads one model file (manifest None = the legacy model)."""
+        entry = manifest["versions"][version] if manifest is not None else None
+        return load_booster(self.root, entry, version, self.legacy_path)
+
+    def _booster(self, manifest, version):
+        with self._lock:
+            if version not in self._boosters:
+                self._boosters[version] = self._load(manifest, version)
+            return self._boosters[version]
+
+    def models(self):
+        """((active_version, booster), (shadow_version, booster) or None) for one scoring call."""
+        manifest, active_version, shadow_version = self._roles
+        active = (active_version, self._booster(manifest, active_version))
+        shadow = None
+        if shadow_version:
+            try:
+                shadow = (shadow_version, self._booster(manifest, shadow_version))
+            except Exception as e:
+                # a broken candidate must never block production scoring
+                print(f"⚠️ Shadow model {shadow_version} unavailable: {e}")
+        return active, shadow
+
+    def pin(self):
+        """The current roles as PinnedModels, for worker processes that must score with them."""
+        manifest, active_version, shadow_version = self._roles
+        entries = manifest["versions"] if manifest is not None else {}
+        return PinnedModels(self.root, self.legacy_path,
+                            (active_version, entries.get(active_version)),
+                            (shadow_version, entries[shadow_version]) if shadow_version else None)
+
+class PinnedModels:
+    """
+    The active / shadow models of a ModelRegistry at pin() time. Picklable: it only
+    carries versions, files and checksums, and a worker loads the boosters (checksum
+    verified) on its first models() call, never at import. Manifest changes made
+    after the pin are ignored. Same models() interface as ModelRegistry.
+    """
+
+    def __init__(self, root, legacy_path, active, shadow):
+        self.root = root
+        self.legacy_path = legacy_path
+        self.active = active  # (version, manifest entry or None for the legacy model)
+        self.shadow = shadow  # (version, manifest entry) or None
+        self._boosters = {}
+
+    def __getstate__(self):
+        return {**self.__dict__, "_boosters": {}}
+
+    def __eq__(self, other):
+        return isinstance(other, PinnedModels) and \
+            (self.root, self.legacy_path, self.active, self.shadow) == \
+            (other.root, other.legacy_path, other.active, other.shadow)
+
+    def _booster(self, version, entry):
+        if version not in self._boosters:
+            self._boosters[version] = load_booster(self.root, entry, version, self.legacy_path)
+        return self._boosters[version]
+
+    def models(self):
+        """((active_version, booster), (shadow_version, booster) or None), like ModelRegistry.models()."""
+        active = (self.active[0], self._booster(*self.active))
+        shadow = None
+        if self.shadow:
+            try:
+                shadow = (self.shadow[0], self._booster(*self.shadow))
+            except Exception as e:
+                print(f"⚠️ Shadow model {self.shadow[0]} unavailable: {e}")
+        return active, shadow
+
+# --------------------
+# 4. CLI
+# --------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Manage versioned payment-delay models.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    reg = sub.add_parser("register", help="Add a model file to the registry")
+    reg.add_argument("model_path")
+    reg.add_argument("--version", default=None)
+    reg.add_argument("--activate", action="store_true")
+    reg.add_argument("--shadow", action="store_true")
+
+    act = sub.add_parser("activate", help="Make a registered version the active model")
+    act.add_argument("version")
+
+    sh = sub.add_parser("shadow", help="Shadow-score with a registered version ('none' to stop)")
+    sh.add_argument("version")
+
+    sub.add_parser("list", help="Show registered versions")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "register":
+        version = register_model(args.model_path, args.version, activate=args.activate, shadow=args.shadow)
+        print(f"✅ Registered {version}")
+    elif args.command == "activate":
+        set_role("active", args.version)
+        print(f"✅ Active model: {args.version}")
+    elif args.command == "shadow":
+        set_role("shadow", None if args.version == "none" else args.version)
+        print(f"✅ Shadow model: {args.version}")
+
+    manifest = read_manifest() or {"active": None, "shadow": None, "versions": {}}
+    for version, entry in sorted(manifest["versions"].items()):
+        role = " (active)" if version == manifest["active"] else " (shadow)" if version == manifest.get("shadow") else ""
+        print(f"   {version}{role}  {entry['sha256'][:12]}  {entry['registered_at']}")
@@ -0,0 +1,308 @@
+import json
+import os
+import random
+import socket
+import sqlite3
+import time
+from datetime import datetime
+
+# ==========================================
+# ⚙️ CONFIGURATION
+# ==========================================
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_QUEUE_PATH = os.getenv("OUTREACH_QUEUE_PATH", os.path.join(script_dir, "outreach_queue.db"))
+
+LEASE_SECONDS = 600        # must cover generating + sending one leased chunk
+MAX_ATTEMPTS = 5           # leases per job before it is dead-lettered
+RETRY_BASE_SECONDS = 30    # backoff: 30s, 60s, 120s, ... (+ jitter)
+RETRY_MAX_SECONDS = 3600
+RETRY_WAIT_SECONDS = 120   # a drain waits for retries due this soon; later ones are left to the next run
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outreach_jobs (
+    idempotency_key  TEXT PRIMARY KEY,   -- case_id:channel:date
+    case_id          TEXT NOT NULL,
+    channel          TEXT NOT NULL,      -- MAIL / CALL
+    run_date         TEXT NOT NULL,
+    payload          TEXT NOT NULL,      -- case snapshot (JSON)
+    status           TEXT NOT NULL,      -- PENDING / LEASED / DONE / DEAD / SUPERSEDED
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    available_at     REAL NOT NULL,
+    lease_owner      TEXT,
+    lease_expires_at REAL,
+    sent_at          TEXT,               -- set once the message has left; never resend after this
+    content          TEXT,               -- what was sent
+    result           TEXT,               -- channel-specific output (JSON), e.g. audio_url
+    last_error       TEXT,
+    created_at       REAL NOT NULL,
+    updated_at       REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outreach_ready ON outreach_jobs (channel, status, available_at);
+"""
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def idempotency_key(case_id, channel, run_date):
+    return f"{case_id}:{channel}:{run_date}"
+
+# ==========================================
+# 📬 QUEUE
+# ==========================================
+
+class OutreachQueue:
+    """
+    Durable local work queue for the mail / call agents.
+
+    - One job per (case, channel, day): enqueueing the same case twice in a day is a no-op,
+      so reruns never double-send. Enqueueing a new day supersedes the case's older jobs
+      that were never sent, so a stale retry can't go out next to today's message.
+    - Workers lease jobs; a crashed worker's lease expires and the job is picked up again.
+      Every state change after the lease checks lease_owner, so a worker that lost its
+      lease can no longer send, complete or fail the job.
+    - A job marked sent is never sent again, only its bookkeeping is redone.
+    - Before sending, the agents re-read the leased cases (supersede_stale): a job whose
+      case was paid or left the channel's zone since it was queued is dropped, and the
+      rest are sent from the current case data, not the queued snapshot.
+    - Failures back off exponentially; after MAX_ATTEMPTS leases the job is DEAD.
+
+    Several processes may share one queue file; leasing runs in an IMMEDIATE
+    transaction so two workers never get the same job.
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA busy_timeout=30000")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, case_id, channel, payload, run_date=None):
+        """
+        Adds a job unless one already exists for this case/channel/day. Returns True if added.
+        Older unsent jobs of the same case and channel are superseded by the new one.
+        """
+        run_date = run_date or datetime.now().date().isoformat()
+        key = idempotency_key(case_id, channel, run_date)
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = self.conn.execute(
+                """INSERT OR IGNORE INTO outreach_jobs
+                   (idempotency_key, case_id, channel, run_date, payload, status, available_at, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, 'PENDING', ?, ?, ?)""",
+                (key, case_id, channel, run_date, json.dumps(payload, default=str), now, now, now)
+            )
+            added = cur.rowcount == 1
+            if added:
+                # a sent job keeps its bookkeeping; anything never sent is replaced by today's job
+                self.conn.execute(
+                    """UPDATE outreach_jobs
+                       SET status = 'SUPERSEDED', lease_owner = NULL, lease_expires_at = NULL,
+                           last_error = ?, updated_at = ?
+                       WHERE case_id = ? AND channel = ? AND run_date < ?
+                         AND status IN ('PENDING', 'LEASED') AND sent_at IS NULL""",
+                    (f"Superseded by {key}", now, case_id, channel, run_date)
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def lease(self, channel, worker_id=None, limit=20, lease_seconds=LEASE_SECONDS):
+        """Claims up to `limit` ready jobs (pending and due, or with an expired lease)."""
+        worker_id = worker_id or default_worker_id()
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self.conn.execute(
+                """SELECT * FROM outreach_jobs
+                   WHERE channel = ?
+                     AND ((status = 'PENDING' AND available_at <= ?)
+                          OR (status = 'LEASED' AND lease_expires_at <= ?))
+                   ORDER BY available_at
+                   LIMIT ?""",
+                (channel, now, now, limit)
+            ).fetchall()
+            keys = [row["idempotency_key"] for row in rows]
+            self.conn.executemany(
+                """UPDATE outreach_jobs
+                   SET status = 'LEASED', lease_owner = ?, lease_expires_at = ?,
+                       attempts = attempts + 1, updated_at = ?
+                   WHERE idempotency_key = ?""",
+                [(worker_id, now + lease_seconds, now, key) for key in keys]
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["payload"] = json.loads(job["payload"])
+            job["result"] = json.loads(job["result"]) if job["result"] else None
+            job["attempts"] += 1
+            job["status"] = "LEASED"
+            job["lease_owner"] = worker_id
+            jobs.append(job)
+        return jobs
+
+    def renew(self, key, worker_id, lease_seconds=LEASE_SECONDS):
+        """
+        Extends a live, unsent lease just before sending. Returns False if the lease
+        expired or moved to another worker; the caller must not send then.
+        """
+        now = time.time()
+        cur = self.conn.execute(
+            """UPDATE outreach_jobs SET lease_expires_at = ?, updated_at = ?
+               WHERE idempotency_key = ? AND status = 'LEASED' AND lease_owner = ?
+                 AND lease_expires_at > ? AND sent_at IS NULL""",
+            (now + lease_seconds, now, key, worker_id, now)
+        )
+        return cur.rowcount == 1
+
+    def mark_sent(self, key, worker_id, content, result=None):
+        """
+        Records that the message went out; from here on the job is never resent.
+        Returns sent_at, or None if `worker_id` no longer holds the lease.
+        """
+        sent_at = datetime.now().isoformat()
+        cur = self.conn.execute(
+            """UPDATE outreach_jobs SET sent_at = ?, content = ?, result = ?, updated_at = ?
+               WHERE idempotency_key = ? AND status = 'LEASED' AND lease_owner = ?""",
+            (sent_at, content, json.dumps(result) if result is not None else None, time.time(), key, worker_id)
+        )
+        return sent_at if cur.rowcount == 1 else None
+
+    def complete(self, key, worker_id):
+        """Marks a leased job DONE. Returns False if `worker_id` no longer holds the lease."""
+        cur = self.conn.execute(
+            """UPDATE outreach_jobs SET status = 'DONE', lease_owner = NULL, lease_expires_at = NULL,
+                      last_error = NULL, updated_at = ?
+               WHERE idempotency_key = ? AND status = 'LEASED' AND lease_owner = ?""",
+            (time.time(), key, worker_id)
+        )
+        return cur.rowcount == 1
+
+    def fail(self, key, worker_id, error):
+        """
+        Schedules a retry with exponential backoff, or dead-letters the job.
+        Returns False (and changes nothing) if `worker_id` no longer holds the lease.
+        """
+        row = self.conn.execute(
+            """SELECT attempts FROM outreach_jobs
+               WHERE idempotency_key = ? AND status = 'LEASED' AND lease_owner = ?""",
+            (key, worker_id)
+        ).fetchone()
+        if row is None:
+            return False
+        now = time.time()
+        if row["attempts"] >= self.max_attempts:
+            self.conn.execute(
+                """UPDATE outreach_jobs SET status = 'DEAD', lease_owner = NULL, lease_expires_at = NULL,
+                          last_error = ?, updated_at = ?
+                   WHERE idempotency_key = ? AND lease_owner = ?""",
+                (str(error), now, key, worker_id)
+            )
+            print(f"   ☠️  Dead-lettered {key} after {row['attempts']} attempts: {error}")
+            return True
+        delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (row["attempts"] - 1))
+        delay += random.uniform(0, delay / 4)
+        self.conn.execute(
+            """UPDATE outreach_jobs SET status = 'PENDING', available_at = ?, lease_owner = NULL,
+                      lease_expires_at = NULL, last_error = ?, updated_at = ?
+               WHERE idempotency_key = ? AND lease_owner = ?""",
+            (now + delay, str(error), now, key, worker_id)
+        )
+        return True
+
+    def supersede(self, key, worker_id, reason):
+        """Drops a leased, unsent job for good. Returns False if `worker_id` no longer holds the lease."""
+        cur = self.conn.execute(
+            """UPDATE outreach_jobs SET status = 'SUPERSEDED', lease_owner = NULL, lease_expires_at = NULL,
+                      last_error = ?, updated_at = ?
+               WHERE idempotency_key = ? AND status = 'LEASED' AND lease_owner = ? AND sent_at IS NULL""",
+            (reason, time.time(), key, worker_id)
+        )
+        return cur.rowcount == 1
+
+    def supersede_stale(self, jobs, worker_id, current_cases, is_due):
+        """
+        Checks leased, unsent jobs against their cases as they are now. `current_cases`
+        maps case_id -> current case data (None if deleted); jobs whose case fails
+        `is_due` are superseded, the others get the current data as their payload.
+        Returns the jobs still to send.
+        """
+        due = []
+        for job in jobs:
+            data = current_cases.get(job["case_id"])
+            if is_due(data):
+                job["payload"] = data
+                due.append(job)
+            elif self.supersede(job["idempotency_key"], worker_id, "Case closed or moved out of the zone before sending"):
+                print(f"   🗑️  Dropped {job['idempotency_key']}: case closed or moved out of the zone")
+        return due
+
+    def next_ready_at(self, channel):
+        """Earliest time a waiting job of `channel` becomes leasable (pending retry or live lease), or None."""
+        row = self.conn.execute(
+            """SELECT MIN(CASE status WHEN 'PENDING' THEN available_at ELSE lease_expires_at END) AS ready_at
+               FROM outreach_jobs WHERE channel = ? AND status IN ('PENDING', 'LEASED')""",
+            (channel,)
+        ).fetchone()
+        return row["ready_at"]
+
+    def wait_for_retries(self, channel, max_wait=RETRY_WAIT_SECONDS):
+        """
+        Sleeps until the next waiting job is due if that is within `max_wait` seconds and
+        returns True; otherwise returns False and the remaining retries wait for the next run.
+        """
+        ready_at = self.next_ready_at(channel)
+        if ready_at is None:
+            return False
+        delay = ready_at - time.time()
+        if delay > max_wait:
+            waiting = self.counts(channel)
+            print(f"   ⏳ {waiting.get('PENDING', 0)} {channel} job(s) back off past this run; "
+                  f"the next run picks them up (earliest {datetime.fromtimestamp(ready_at):%Y-%m-%d %H:%M}).")
+            return False
+        if delay > 0:
+            print(f"   ⏳ Waiting {delay:.0f}s for {channel} retries...")
+            time.sleep(delay)
+        return True
+
+    def counts(self, channel=None):
+        query = "SELECT status, COUNT(*) AS n FROM outreach_jobs"
+        params = ()
+        if channel:
+            query += " WHERE channel = ?"
+            params = (channel,)
+        return {row["status"]: row["n"] for row in self.conn.execute(query + " GROUP BY status", params)}
+
+    def dead_letters(self, channel=None):
+        query = "SELECT idempotency_key, case_id, channel, attempts, last_error FROM outreach_jobs WHERE status = 'DEAD'"
+        params = ()
+        if channel:
+            query += " AND channel = ?"
+            params = (channel,)
+        return [dict(row) for row in self.conn.execute(query, params)]
+
+# ==========================================
+# 🔎 INSPECT
+# ==========================================
+
+if __name__ == "__main__":
+    queue = OutreachQueue()
+    print(f"📬 Outreach queue at {queue.path}")
+    for channel in ("MAIL", "CALL"):
+        print(f"   {channel}: {queue.counts(channel)}")
+    for job in queue.dead_letters():
+        print(f"   ☠️  {job['idempotency_key']} ({job['attempts']} attempts): {job['last_error']}")
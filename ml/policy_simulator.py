@@ -0,0 +1,195 @@
+import pandas as pd
+import numpy as np
+import argparse
+import glob
+import json
+import time
+
+# --------------------
+# CONFIG
+# --------------------
+# Zone codes used inside the simulator (order = severity)
+ZONES = ["GREEN", "YELLOW", "ORANGE", "RED"]
+GREEN, YELLOW, ORANGE, RED = range(len(ZONES))
+
+# Number of agents the dispatcher spreads RED cases over (see AGENTS in dispatcher.py)
+DEFAULT_AGENT_COUNT = 6
+
+# Upper bound on policies x invoices evaluated per step (keeps temporaries ~100 MB)
+MAX_CELLS_PER_STEP = 4_000_000
+
+# The production rules: derive_sla_days() + assign_zone() in ml_job.py
+DEFAULT_POLICY = {
+    "name": "current",
+    # late_payment_ratio >= thresholds[i] -> sla_days[i]; below all -> sla_days[-1]
+    "sla_thresholds": [0.8, 0.5, 0.2],
+    "sla_days": [3, 5, 10, 15],
+    # still GREEN until this many days past the due date
+    "green_grace_days": 0,
+    # YELLOW needs predicted_delay <= yellow_delay_factor * sla_days ...
+    "yellow_delay_factor": 1.0,
+    # ... and, if set, today <= predicted_payment_date
+    "honor_predicted_date": True,
+}
+
+# --------------------
+# 1. POLICIES
+# --------------------
+def normalize_policy(policy):
+    merged = {**DEFAULT_POLICY, **policy}
+    thresholds = list(merged["sla_thresholds"])
+    days = list(merged["sla_days"])
+    if len(days) != len(thresholds) + 1:
+        raise ValueError(f"Policy {merged['name']!r}: sla_days needs one more entry than sla_thresholds")
+    if thresholds != sorted(thresholds, reverse=True):
+        raise ValueError(f"Policy {merged['name']!r}: sla_thresholds must be in descending order")
+    merged["sla_thresholds"] = thresholds
+    merged["sla_days"] = days
+    return merged
+
+def policy_arrays(policies):
+    """Stacks policies into padded arrays so all of them are evaluated in one pass."""
+    width = max(len(p["sla_thresholds"]) for p in policies)
+    thresholds = np.full((len(policies), width), -np.inf)
+    days = np.empty((len(policies), width + 1))
+    for i, p in enumerate(policies):
+        k = len(p["sla_thresholds"])
+        thresholds[i, :k] = p["sla_thresholds"]
+        days[i, :k + 1] = p["sla_days"]
+        # padded thresholds (-inf) are never above a ratio, so the padding days are never picked
+        days[i, k + 1:] = p["sla_days"][-1]
+    return {
+        "thresholds": thresholds,
+        "days": days,
+        "grace": np.array([p["green_grace_days"] for p in policies], dtype=float)[:, None],
+        "yellow_factor": np.array([p["yellow_delay_factor"] for p in policies], dtype=float)[:, None],
+        "honor_predicted": np.array([bool(p["honor_predicted_date"]) for p in policies])[:, None],
+    }
+
+# --------------------
+# 2. VECTORIZED ZONING
+# --------------------
+def invoice_arrays(scored_df, today):
+    """Day offsets relative to `today`, as floats (NaN where the date is missing)."""
+    one_day = pd.Timedelta(days=1)
+    due = pd.to_datetime(scored_df["due_date"])
+    ppd = pd.to_datetime(scored_df["predicted_payment_date"])
+    return {
+        "days_past_due": ((today - due) / one_day).to_numpy(dtype=float),
+        "days_to_predicted": ((ppd - today) / one_day).to_numpy(dtype=float),
+        "pred_delay": pd.to_numeric(scored_df["predicted_delay"], errors="coerce").to_numpy(dtype=float),
+        "late_ratio": pd.to_numeric(scored_df["late_payment_ratio"], errors="coerce").fillna(0).to_numpy(dtype=float),
+        "amount": pd.to_numeric(scored_df["total_open_amount"], errors="coerce").fillna(0).to_numpy(dtype=float),
+    }
+
+def zone_masks(pol, inv):
+    """
+    Boolean masks per zone for every (policy, invoice) pair, each shaped
+    (n_policies, n_invoices). Same precedence as assign_zone(): RED, then GREEN,
+    then YELLOW, else ORANGE.
+    """
+    late = inv["late_ratio"][None, :]
+    # index into the SLA table = number of thresholds the ratio falls below
+    tier = np.zeros((pol["thresholds"].shape[0], late.shape[1]), dtype=np.intp)
+    for j in range(pol["thresholds"].shape[1]):
+        tier += late < pol["thresholds"][:, j:j + 1]
+    sla_days = np.take_along_axis(pol["days"], tier, axis=1)
+
+    past_due = inv["days_past_due"][None, :]
+
+    # NaN comparisons are False, which matches assign_zone's handling of missing dates
+    red = past_due >= sla_days
+    green = (past_due < pol["grace"]) & ~red
+    # per-invoice parts of the YELLOW rule don't depend on the policy
+    has_prediction = ~np.isnan(inv["pred_delay"]) & ~np.isnan(inv["days_to_predicted"])
+    before_predicted = inv["days_to_predicted"] >= 0
+    yellow = (inv["pred_delay"][None, :] <= pol["yellow_factor"] * sla_days) \
+        & (~pol["honor_predicted"] | before_predicted[None, :]) \
+        & has_prediction[None, :] & ~red & ~green
+    orange = ~(red | green | yellow)
+    return {GREEN: green, YELLOW: yellow, ORANGE: orange, RED: red}
+
+# --------------------
+# 3. SIMULATION
+# --------------------
+def simulate_policies(scored_df, policies, today=None, agent_count=DEFAULT_AGENT_COUNT):
+    """
+    Evaluates every policy against the scored open invoices and returns one row per
+    policy: zone counts and amounts, RED cases per agent and amount at risk
+    (ORANGE + RED). Pure numpy over the frame; nothing touches Firestore.
+    """
+    today = pd.Timestamp(today).normalize() if today is not None else pd.Timestamp.today().normalize()
+    policies = [normalize_policy(p) for p in policies]
+    pol = policy_arrays(policies)
+    inv = invoice_arrays(scored_df, today)
+
+    n_policies, n_invoices = len(policies), len(scored_df)
+    counts = np.zeros((n_policies, len(ZONES)), dtype=np.int64)
+    amounts = np.zeros((n_policies, len(ZONES)))
+
+    step = max(1024, MAX_CELLS_PER_STEP // max(n_policies, 1))
+    for start in range(0, n_invoices, step):
+        chunk = {k: v[start:start + step] for k, v in inv.items()}
+        for z, in_zone in zone_masks(pol, chunk).items():
+            counts[:, z] += np.count_nonzero(in_zone, axis=1)
+            # float64 matvec (BLAS), so the reported amounts keep their cents
+            amounts[:, z] += in_zone.astype(np.float64) @ chunk["amount"]
+
+    report = pd.DataFrame({"policy": [p["name"] for p in policies]})
+    for z, zone in enumerate(ZONES):
+        report[f"{zone.lower()}_cases"] = counts[:, z]
+    for z, zone in enumerate(ZONES):
+        report[f"{zone.lower()}_amount"] = amounts[:, z]
+    report["escalations_per_agent"] = counts[:, RED] / max(agent_count, 1)
+    report["amount_at_risk"] = amounts[:, ORANGE] + amounts[:, RED]
+    report["at_risk_share"] = report["amount_at_risk"] / np.maximum(amounts.sum(axis=1), 1e-9)
+    return report
+
+def assign_zones(scored_df, today=None, policy=DEFAULT_POLICY):
+    """Vectorized assign_zone() for one policy: an array of zone names, one per row."""
+    today = pd.Timestamp(today).normalize() if today is not None else pd.Timestamp.today().normalize()
+    masks = zone_masks(policy_arrays([normalize_policy(policy)]), invoice_arrays(scored_df, today))
+    zones = np.full(len(scored_df), "ORANGE", dtype=object)
+    for z, in_zone in masks.items():
+        zones[in_zone[0]] = ZONES[z]
+    return zones
+
+def load_snapshots(paths):
+    """Reads one or more snapshots written by `ml_job.py --snapshot` (glob patterns allowed)."""
+    files = sorted({f for pattern in paths for f in glob.glob(pattern)})
+    if not files:
+        raise FileNotFoundError(f"No snapshot files match {paths}")
+    return pd.concat([pd.read_pickle(f) for f in files], ignore_index=True)
+
+# --------------------
+# 4. RUN
+# --------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="What-if simulation of SLA tables and zone policies over scored invoices.")
+    parser.add_argument("snapshots", nargs="+",
+                        help="Scored snapshot file(s) from `ml_job.py --snapshot` (globs allowed, e.g. 'scored.shard*.pkl')")
+    parser.add_argument("--policies", type=str, default=None,
+                        help="JSON file with a list of policies (missing keys default to the production policy)")
+    parser.add_argument("--today", type=str, default=None, help="Evaluate as of this date (default: today)")
+    parser.add_argument("--agents", type=int, default=DEFAULT_AGENT_COUNT, help="Agents sharing the RED queue")
+    parser.add_argument("--out", type=str, default=None, help="Also write the report to this CSV file")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    policies = [DEFAULT_POLICY]
+    if args.policies:
+        with open(args.policies) as f:
+            policies = json.load(f)
+
+    scored_df = load_snapshots(args.snapshots)
+    print(f"Simulating {len(policies)} policies over {len(scored_df)} open invoices...")
+    start_ts = time.time()
+    report = simulate_policies(scored_df, policies, today=args.today, agent_count=args.agents)
+    print(f"Elapsed: {time.time() - start_ts:.2f}s")
+
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(report.to_string(index=False))
+    if args.out:
+        report.to_csv(args.out, index=False)
+        print(f"💾 Report written to {args.out}")
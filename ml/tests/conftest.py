@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The ml/ scripts import each other as top-level modules
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ML_DIR not in sys.path:
+    sys.path.insert(0, ML_DIR)
+
+from fake_firestore import FakeFirestore  # noqa: E402
+from helpers import FakeRegistry  # noqa: E402
+
+
+@pytest.fixture
+def ml_job(monkeypatch):
+    """ml_job with an in-memory Firestore and fixed models (module paths are relative to ml/)."""
+    monkeypatch.chdir(ML_DIR)
+    import ml_job
+    monkeypatch.setattr(ml_job, "db", FakeFirestore())
+    monkeypatch.setattr(ml_job, "registry", FakeRegistry())
+    return ml_job
@@ -0,0 +1,221 @@
+"""
+In-memory stand-in for the slice of the Firestore client the ML job uses:
+collection / document refs, where / order_by / select / limit / start_after
+queries, get_all, and write batches with last_update_time preconditions. Writes
+are type-checked like the real client (numpy ints / bools, NaT etc. are rejected)
+so tests catch payloads the emulator would refuse.
+"""
+import copy
+import datetime
+import operator
+from types import SimpleNamespace
+
+import pandas as pd
+from firebase_admin import firestore
+from google.api_core import exceptions
+
+OPERATORS = {
+    "==": operator.eq, "!=": operator.ne,
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+    "in": lambda value, options: value in options,
+}
+RANGE_OPERATORS = {"<", "<=", ">", ">=", "!="}
+
+
+def check_value(value, path="value"):
+    """Raises TypeError for anything the Firestore client can't encode."""
+    if value is None or value is firestore.SERVER_TIMESTAMP or isinstance(value, firestore.ArrayUnion):
+        return
+    if value is pd.NaT:
+        raise TypeError(f"{path}: NaT can't be stored")
+    # np.float64 / np.str_ subclass float / str and are accepted; np.int64 / np.bool_ are not
+    if isinstance(value, (bool, int, float, str, bytes, datetime.datetime)):
+        return
+    if isinstance(value, (list, tuple)):
+        for i, item in enumerate(value):
+            check_value(item, f"{path}[{i}]")
+        return
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise TypeError(f"{path}: map key {key!r} is not a string")
+            check_value(item, f"{path}.{key}")
+        return
+    raise TypeError(f"{path}: {type(value).__name__} can't be stored")
+
+
+def resolve(value, server_time, current=None):
+    """Copies a payload the way it is stored: SERVER_TIMESTAMP -> commit time, ArrayUnion applied."""
+    if value is firestore.SERVER_TIMESTAMP:
+        return server_time
+    if isinstance(value, firestore.ArrayUnion):
+        merged = list(current) if isinstance(current, list) else []
+        return merged + [v for v in copy.deepcopy(list(value.values)) if v not in merged]
+    if isinstance(value, dict):
+        return {k: resolve(v, server_time) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [resolve(v, server_time) for v in value]
+    return copy.deepcopy(value)
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data, reference=None, update_time=None):
+        self.id = doc_id
+        self._data = data
+        self.reference = reference
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field):
+        return self._data.get(field) if self._data else None
+
+
+class FakeDocument:
+    def __init__(self, db, collection, doc_id):
+        self.db = db
+        self.collection = collection
+        self.id = str(doc_id)
+
+    def get(self):
+        return self.db._snapshot(self.collection, self.id, self.db.store.get(self.collection, {}).get(self.id))
+
+
+class FakeQuery:
+    def __init__(self, db, collection, filters=(), order=(), fields=None, limit=None, after=None):
+        self.db = db
+        self.collection = collection
+        self.filters = tuple(filters)
+        self.order = tuple(order)
+        self.fields = fields
+        self._limit = limit
+        self.after = after
+
+    def _copy(self, **changes):
+        state = dict(filters=self.filters, order=self.order, fields=self.fields, limit=self._limit, after=self.after)
+        state.update(changes)
+        return FakeQuery(self.db, self.collection, **state)
+
+    def document(self, doc_id):
+        return FakeDocument(self.db, self.collection, doc_id)
+
+    def where(self, filter):
+        return self._copy(filters=self.filters + ((filter.field_path, filter.op_string, filter.value),))
+
+    def order_by(self, field, direction=None):
+        return self._copy(order=self.order + (field,))
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def limit(self, n):
+        return self._copy(limit=n)
+
+    def start_after(self, snapshot):
+        return self._copy(after=snapshot)
+
+    def _order_fields(self):
+        # like Firestore: without order_by, inequality fields sort first; the doc id breaks ties
+        order = list(self.order) or [f for f, op, _ in self.filters if op in RANGE_OPERATORS]
+        return order if "__name__" in order else order + ["__name__"]
+
+    def get(self):
+        order = self._order_fields()
+
+        def sort_key(doc_id, data):
+            return tuple(doc_id if f == "__name__" else data[f] for f in order)
+
+        docs = []
+        for doc_id, data in self.db.store.get(self.collection, {}).items():
+            if any(f not in data or not OPERATORS[op](data[f], value) for f, op, value in self.filters):
+                continue
+            if any(f != "__name__" and f not in data for f in order):
+                continue
+            docs.append((sort_key(doc_id, data), doc_id, data))
+        docs.sort(key=lambda d: d[0])
+
+        if self.after is not None:
+            cursor = sort_key(self.after.id, self.after._data)
+            docs = [d for d in docs if d[0] > cursor]
+        if self._limit is not None:
+            docs = docs[:self._limit]
+
+        snapshots = []
+        for _, doc_id, data in docs:
+            if self.fields is not None:
+                data = {f: data[f] for f in self.fields if f in data}
+            snapshots.append(self.db._snapshot(self.collection, doc_id, copy.deepcopy(data)))
+        return snapshots
+
+    def stream(self):
+        return iter(self.get())
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.ops = []
+
+    def set(self, ref, data, merge=False):
+        check_value(data, f"{ref.collection}/{ref.id}")
+        self.ops.append(("set_merge" if merge else "set", ref, dict(data), None))
+
+    def update(self, ref, data, option=None):
+        check_value(data, f"{ref.collection}/{ref.id}")
+        self.ops.append(("update", ref, dict(data), option))
+
+    def delete(self, ref, option=None):
+        self.ops.append(("delete", ref, None, option))
+
+    def commit(self):
+        # all or nothing, like the real batch: one failed precondition fails every write
+        for op, ref, data, option in self.ops:
+            if option is not None and self.db.update_times.get((ref.collection, ref.id)) != option.last_update_time:
+                raise exceptions.FailedPrecondition(f"{ref.collection}/{ref.id} changed since it was read")
+
+        update_time = self.db.commits + 1
+        for op, ref, data, option in self.ops:
+            docs = self.db.store.setdefault(ref.collection, {})
+            if op == "delete":
+                docs.pop(ref.id, None)
+                self.db.update_times.pop((ref.collection, ref.id), None)
+                continue
+            if op == "update" and ref.id not in docs:
+                raise KeyError(f"No document to update: {ref.collection}/{ref.id}")
+            doc = {} if op == "set" else docs.get(ref.id, {})
+            for key, value in data.items():
+                doc[key] = resolve(value, self.db.server_time, doc.get(key))
+            docs[ref.id] = doc
+            self.db.update_times[(ref.collection, ref.id)] = update_time
+        self.db.commits += 1
+        self.ops = []
+
+
+class FakeFirestore:
+    def __init__(self, collections=None, server_time=datetime.datetime(2025, 6, 1, 6, 0)):
+        self.store = copy.deepcopy(collections) if collections else {}
+        self.server_time = server_time  # every SERVER_TIMESTAMP resolves to this, so runs compare equal
+        self.commits = 0
+        # (collection, doc id) -> number of the commit that last wrote the doc (None if seeded directly)
+        self.update_times = {}
+
+    def _snapshot(self, collection, doc_id, data):
+        return FakeSnapshot(doc_id, data, FakeDocument(self, collection, doc_id),
+                            self.update_times.get((collection, doc_id)))
+
+    def collection(self, name):
+        return FakeQuery(self, name)
+
+    def get_all(self, refs):
+        return [ref.get() for ref in refs]
+
+    def write_option(self, last_update_time):
+        return SimpleNamespace(last_update_time=last_update_time)
+
+    def batch(self):
+        return FakeBatch(self)
@@ -0,0 +1,101 @@
+"""Shared test data and doubles for the ML job tests."""
+import math
+import zlib
+
+import numpy as np
+import pandas as pd
+
+TODAY = pd.Timestamp("2025-06-01")
+COMPANY_NAMES = ["Acme Freight", "Acme Foods", "Beta Logistics", "Gamma & Sons", "Delta Air Cargo", None]
+
+
+class LinearModel:
+    """Deterministic booster stand-in: whole-day delays from two model features."""
+
+    def __init__(self, weight):
+        self.weight = weight
+
+    def predict(self, X, **kwargs):
+        return np.round(X["late_payment_ratio"].to_numpy() * self.weight + X["due_days"].to_numpy() * 0.1)
+
+
+class FakeRegistry:
+    """ModelRegistry stand-in with an active and (optionally) a shadow model."""
+
+    def __init__(self, shadow=True):
+        self.shadow = shadow
+
+    def models(self):
+        return ("v1", LinearModel(20)), (("v2", LinearModel(30)) if self.shadow else None)
+
+    def pin(self):
+        # shard tasks carry this; the in-process pool hands it back unpickled
+        return self
+
+
+def make_cases(n_cases=600, n_customers=40, seed=0, today=TODAY):
+    """
+    Case docs shaped like the imported dataset ({doc_id: fields}), about 20% open,
+    with the `shard_bucket` the import writes when it creates them.
+    """
+    rng = np.random.default_rng(seed)
+    cases = {}
+    for i in range(n_cases):
+        cust = int(rng.integers(0, n_customers))
+        due = today + pd.Timedelta(days=int(rng.integers(-150, 60)))
+        created = due - pd.Timedelta(days=int(rng.integers(10, 60)))
+        is_open = due > today - pd.Timedelta(days=40) and rng.random() < 0.6
+        cases[f"case{i:05d}"] = {
+            "cust_number": f"C{cust:04d}",
+            "name_customer": COMPANY_NAMES[cust % len(COMPANY_NAMES)],
+            "invoice_id": f"INV{i:06d}",
+            "document_type": "RV",
+            "document_create_date": int(created.strftime("%Y%m%d")),
+            "due_in_date": float(due.strftime("%Y%m%d")),
+            "clear_date": None if is_open else (due + pd.Timedelta(days=int(rng.integers(-10, 40)))).strftime("%Y-%m-%d"),
+            # whole amounts keep sums exact however the rows are grouped
+            "invoice_amount": float(rng.integers(100, 5000)),
+            "invoice_currency": "CAD" if cust % 7 == 0 else "USD",
+            "isOpen": "1" if is_open else "0",
+            "shard_bucket": zlib.crc32(f"C{cust:04d}".encode("utf-8")) % 4096,
+        }
+    return cases
+
+
+def mix_schemas(cases):
+    """
+    Rewrites some cases with the alternative fields older imports used, in runs of
+    100 doc ids so streaming pages differ in which fields they have at all.
+    """
+    for position, doc_id in enumerate(sorted(cases)):
+        case = cases[doc_id]
+        kind = position // 100 % 4
+        if kind == 0:
+            del case["isOpen"]  # open-ness from clear_date
+        elif kind == 1:
+            created = str(case.pop("document_create_date"))
+            due = str(int(case.pop("due_in_date")))
+            case["invoice_date"] = f"{created[:4]}-{created[4:6]}-{created[6:]}"
+            case["due_date"] = f"{due[:4]}-{due[4:6]}-{due[6:]}"
+        elif kind == 2:
+            case["total_open_amount"] = case.pop("invoice_amount")
+    return cases
+
+
+def values_match(a, b, path=""):
+    """Deep comparison of stored docs; floats match to 1e-9 (grouping changes summation order)."""
+    if isinstance(a, float) and isinstance(b, float):
+        return (math.isnan(a) and math.isnan(b)) or math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(values_match(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(values_match(x, y) for x, y in zip(a, b))
+    return type(a) is type(b) and a == b
+
+
+def assert_same_collections(expected, actual, collections):
+    for name in collections:
+        assert expected.get(name), f"{name} was not written"
+        assert sorted(expected[name]) == sorted(actual.get(name, {})), f"{name}: different doc ids"
+        different = [doc_id for doc_id in expected[name] if not values_match(expected[name][doc_id], actual[name][doc_id])]
+        assert not different, f"{name}: {len(different)} docs differ, e.g. {different[0]}"
@@ -0,0 +1,40 @@
+"""Customer summaries must show the amounts the profile pages show when they read the cases directly."""
+import copy
+
+import pytest
+
+from helpers import TODAY, make_cases
+
+
+def case_amount(case):
+    return case.get("total_open_amount", case["invoice_amount"])
+
+
+@pytest.fixture
+def cases():
+    cases = make_cases(n_cases=300, n_customers=14, seed=3)
+    # a partly paid open invoice: the case's balance is below the invoiced amount
+    paid = next(doc_id for doc_id, case in cases.items() if case["isOpen"] == "1" and case["invoice_currency"] == "CAD")
+    cases[paid]["total_open_amount"] = cases[paid]["invoice_amount"] - 50.0
+    return cases
+
+
+@pytest.mark.parametrize("chunk_size", [None, 40])
+def test_summary_amounts_are_in_the_invoice_currency(ml_job, cases, chunk_size):
+    ml_job.db.store["cases"] = copy.deepcopy(cases)
+    ml_job.run_ml_job(today=TODAY, chunk_size=chunk_size)
+
+    summaries = ml_job.db.store["customer_summaries"]
+    assert any(inv["currency"] == "CAD" for s in summaries.values() for inv in s["recent_invoices"])
+    for cust, summary in summaries.items():
+        for inv in summary["recent_invoices"]:
+            case = cases[inv["id"]]
+            assert inv["currency"] == case["invoice_currency"]
+            assert inv["amount"] == case_amount(case)
+            assert inv["original_amount"] == case_amount(case)
+        for inv in summary["open_invoices"]:
+            assert inv["amount"] == case_amount(cases[inv["id"]])
+        for entity in summary["entities"]:
+            open_cases = [c for c in cases.values() if c["cust_number"] == cust
+                          and (c["name_customer"] or "Unknown") == entity["name"] and c["isOpen"] == "1"]
+            assert entity["open_amount"] == pytest.approx(sum(case_amount(c) for c in open_cases))
@@ -0,0 +1,169 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import llm_batcher
+from llm_batcher import AdaptiveBatcher, build_batch_prompt, parse_batch_response
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class FakeModel:
+    """
+    generate_fn double: answers a batch prompt with one message per case.
+    `drop` ids are left out of every reply; `fail` / `delays` script the next calls
+    (an exception to raise, seconds the call takes on the fake clock).
+    """
+
+    def __init__(self, clock, drop=(), fail=(), delays=()):
+        self.clock = clock
+        self.drop = set(drop)
+        self.fail = list(fail)
+        self.delays = list(delays)
+        self.batches = []
+
+    def __call__(self, prompt):
+        cases = json.loads(prompt.split("Cases:\n", 1)[1])
+        ids = [c["case_id"] for c in cases]
+        self.batches.append(ids)
+        self.clock.now += self.delays.pop(0) if self.delays else 1.0
+        if self.fail and self.fail.pop(0):
+            raise ConnectionError("model unavailable")
+        reply = [{"case_id": i, "text": f"Reminder for {i}"} for i in ids if i not in self.drop]
+        return f"```json\n{json.dumps(reply)}\n```"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_batcher, "time", SimpleNamespace(time=clock.time))
+    return clock
+
+
+def cases(n):
+    return [(f"c{i}", {"amount": i}) for i in range(n)]
+
+
+def single(case_id):
+    return f"Template for {case_id}"
+
+
+# ---- parsing
+
+def test_parse_tolerates_fences_and_chatter():
+    reply = 'Sure! Here you go:\n```json\n[{"case_id": "a", "text": " Hi A "}]\n```\nAnything else?'
+    assert parse_batch_response(reply, ["a"]) == {"a": "Hi A"}
+
+
+def test_parse_ignores_unknown_duplicate_and_invalid_items():
+    reply = json.dumps([
+        {"case_id": "a", "text": "first"},
+        {"case_id": "a", "text": "second"},
+        {"case_id": "zzz", "text": "not asked for"},
+        {"case_id": "b", "text": ["not", "a", "string"]},
+        {"case_id": "c", "text": "   "},
+        "stray",
+        {"case_id": 7, "text": "numeric id"},
+    ])
+    assert parse_batch_response(reply, ["a", "b", "c", "7"]) == {"a": "first", "7": "numeric id"}
+
+
+@pytest.mark.parametrize("reply", [None, "", "no array here", "[not json]", '{"case_id": "a"}'])
+def test_parse_unusable_reply(reply):
+    assert parse_batch_response(reply, ["a"]) == {}
+
+
+def test_prompt_lists_cases_as_json():
+    prompt = build_batch_prompt("Write reminders.", [("a", {"amount": 5})])
+    assert prompt.startswith("Write reminders.")
+    assert json.loads(prompt.split("Cases:\n", 1)[1]) == [{"case_id": "a", "amount": 5}]
+
+
+# ---- streaming and fallback
+
+def test_all_cases_from_one_batch(clock):
+    model = FakeModel(clock)
+    batcher = AdaptiveBatcher(model, "task", single, batch_size=8)
+    results = dict(batcher.stream(cases(5)))
+    assert results == {f"c{i}": f"Reminder for c{i}" for i in range(5)}
+    assert model.batches == [["c0", "c1", "c2", "c3", "c4"]]
+    assert batcher.stats == {"requests": 1, "errors": 0, "batched": 5, "single": 0}
+
+
+def test_missing_item_is_retried_then_falls_back_to_single(clock):
+    model = FakeModel(clock, drop={"c1"})
+    batcher = AdaptiveBatcher(model, "task", single, batch_size=4)
+    results = dict(batcher.stream(cases(8)))
+
+    assert results["c1"] == "Template for c1"
+    assert all(results[f"c{i}"] == f"Reminder for c{i}" for i in range(8) if i != 1)
+    # c1 went back into the next batch once before the single-case path
+    assert sum("c1" in batch for batch in model.batches) == llm_batcher.MAX_BATCH_ATTEMPTS
+    assert batcher.stats["single"] == 1 and batcher.stats["batched"] == 7
+
+
+def test_validate_fn_rejections_fall_back(clock):
+    model = FakeModel(clock)
+    batcher = AdaptiveBatcher(model, "task", single, batch_size=4,
+                              validate_fn=lambda text: None if text.endswith("c2") else text.upper())
+    results = dict(batcher.stream(cases(3)))
+    assert results == {"c0": "REMINDER FOR C0", "c1": "REMINDER FOR C1", "c2": "Template for c2"}
+
+
+def test_batch_size_one_never_batches(clock):
+    model = FakeModel(clock)
+    batcher = AdaptiveBatcher(model, "task", single, batch_size=1)
+    assert dict(batcher.stream(cases(3))) == {f"c{i}": f"Template for c{i}" for i in range(3)}
+    assert model.batches == []
+
+
+# ---- adaptive batch size
+
+def test_batch_size_grows_after_fast_clean_batches(clock):
+    batcher = AdaptiveBatcher(FakeModel(clock), "task", single, batch_size=4)
+    list(batcher.stream(cases(4 + 5 + 6)))
+    assert batcher.batch_size == 7
+
+
+def test_transport_error_halves_batch_size(clock):
+    model = FakeModel(clock, fail=[True])
+    batcher = AdaptiveBatcher(model, "task", single, batch_size=8)
+    results = dict(batcher.stream(cases(8)))
+
+    assert batcher.stats["errors"] == 1
+    assert [len(b) for b in model.batches[:2]] == [8, 4]
+    assert results == {f"c{i}": f"Reminder for c{i}" for i in range(8)}  # every case retried and served
+
+
+def test_slow_reply_shrinks_batch_by_a_quarter(clock):
+    model = FakeModel(clock, delays=[llm_batcher.TARGET_LATENCY_SECONDS + 5])
+    batcher = AdaptiveBatcher(model, "task", single, batch_size=8)
+    list(batcher.stream(cases(8)))
+    assert batcher.batch_size == 6
+
+
+def test_mostly_invalid_reply_shrinks_batch(clock):
+    model = FakeModel(clock, drop={"c0", "c1"})
+    batcher = AdaptiveBatcher(model, "task", single, batch_size=8)
+    list(batcher.stream(cases(14)))
+    # 6/8 valid is under MIN_VALID_RATIO: the next batch (retries first) holds 6
+    assert model.batches[:2] == [[f"c{i}" for i in range(8)], ["c0", "c1", "c8", "c9", "c10", "c11"]]
+    assert batcher.stats["single"] == 2
+
+
+def test_batch_size_stays_within_bounds(clock):
+    model = FakeModel(clock, fail=[True] * 10)
+    batcher = AdaptiveBatcher(model, "task", single, batch_size=8, min_size=2, max_size=10)
+    list(batcher.stream(cases(8)))
+    assert batcher.batch_size == 2
+
+    batcher = AdaptiveBatcher(FakeModel(clock), "task", single, batch_size=9, min_size=2, max_size=10)
+    list(batcher.stream(cases(60)))
+    assert batcher.batch_size == 10
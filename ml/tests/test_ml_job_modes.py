@@ -0,0 +1,217 @@
+"""The sharded and streaming modes must write exactly what the single-process job writes."""
+import copy
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from helpers import TODAY, FakeRegistry, assert_same_collections, make_cases, mix_schemas
+
+OUTPUT_COLLECTIONS = [
+    "cases", "company_features", "zone_schedule", "cash_forecast",
+    "model_shadow_reports", "customer_summaries", "customer_search",
+]
+
+
+class InlinePool:
+    """multiprocessing Pool stand-in: runs the shard tasks in this process (and on this fake db)."""
+
+    def __init__(self, processes=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def imap_unordered(self, fn, tasks, chunksize=1):
+        # reversed, so shard results don't arrive in shard order
+        return map(fn, list(tasks)[::-1])
+
+
+@pytest.fixture
+def inline_pool(ml_job, monkeypatch):
+    monkeypatch.setattr(ml_job, "mp", SimpleNamespace(get_context=lambda method: SimpleNamespace(Pool=InlinePool)))
+
+
+def seed(ml_job, cases):
+    """Resets the fake db to just these cases (copied: the job backfills them in place)."""
+    ml_job.db.store.clear()
+    ml_job.db.store["cases"] = copy.deepcopy(cases)
+
+
+def run_single(ml_job, cases, **kwargs):
+    seed(ml_job, cases)
+    stats = ml_job.run_ml_job(today=TODAY, **kwargs)
+    return stats, {name: docs for name, docs in ml_job.db.store.items()}
+
+
+@pytest.mark.parametrize("shard_count", [2, 5])
+def test_sharded_matches_single_process(ml_job, inline_pool, monkeypatch, shard_count):
+    # small prefix docs, so the index has split prefixes that shards contribute to
+    monkeypatch.setattr(ml_job, "SEARCH_MAX_ENTRIES", 8)
+    cases = make_cases()
+    single_stats, expected = run_single(ml_job, cases)
+
+    seed(ml_job, cases)
+    stats = ml_job.run_sharded_ml_job(shard_count, processes=1, today=TODAY)
+
+    assert stats["backfilled"] == single_stats["backfilled"] == len(cases)
+    assert stats["open_invoices"] == single_stats["open_invoices"] > 0
+    assert stats["zones"] == single_stats["zones"]
+    assert stats["summaries"] == single_stats["summaries"]
+    assert_same_collections(expected, ml_job.db.store, OUTPUT_COLLECTIONS)
+    assert any(doc.get("split") for doc in expected["customer_search"].values())
+
+
+def test_runs_leave_shard_buckets_to_case_creation(ml_job):
+    cases = make_cases(n_cases=200, n_customers=10)
+    for case in cases.values():
+        del case["shard_bucket"]  # cases created before buckets were set on creation
+
+    stats, _ = run_single(ml_job, cases)
+    assert stats["backfilled"] == len(cases)
+    assert not any("shard_bucket" in case for case in ml_job.db.store["cases"].values())
+    # the second run has nothing left to backfill
+    assert ml_job.run_ml_job(today=TODAY)["backfilled"] == 0
+
+
+def test_assign_shard_buckets_migrates_cases_created_without_one(ml_job):
+    cases = make_cases(n_cases=200, n_customers=10)
+    seed(ml_job, cases)
+    stored = ml_job.db.store["cases"]
+    for doc_id in list(stored)[::2]:
+        del stored[doc_id]["shard_bucket"]
+
+    ml_job.assign_shard_buckets()
+    assert {doc_id: case["shard_bucket"] for doc_id, case in stored.items()} == \
+        {doc_id: case["shard_bucket"] for doc_id, case in cases.items()}
+
+
+@pytest.mark.parametrize("mixed", [False, True], ids=["one-schema", "mixed-schemas"])
+@pytest.mark.parametrize("chunk_size", [37, 250])
+def test_streaming_matches_in_memory(ml_job, monkeypatch, chunk_size, mixed):
+    monkeypatch.setattr(ml_job, "SEARCH_MAX_ENTRIES", 8)
+    # this seed has mean delays on a rounding boundary (x.xx5), which catches inexact merging
+    cases = make_cases(n_cases=800, n_customers=60, seed=5)
+    if mixed:
+        # pages without a field the whole book has must not be prepared differently
+        cases = mix_schemas(cases)
+    # pages follow doc ids; customers must straddle pages or the merge steps go untested
+    pages_by_customer = {}
+    for position, doc_id in enumerate(sorted(cases)):
+        pages_by_customer.setdefault(cases[doc_id]["cust_number"], set()).add(position // chunk_size)
+    assert sum(len(pages) > 1 for pages in pages_by_customer.values()) > len(pages_by_customer) // 2
+
+    expected_stats, expected = run_single(ml_job, cases)
+    stats, actual = run_single(ml_job, cases, chunk_size=chunk_size)
+
+    for key in ("cases_fetched", "backfilled", "company_profiles", "open_invoices", "updated", "scheduled",
+                "summaries", "zones"):
+        assert stats[key] == expected_stats[key], key
+    assert_same_collections(expected, actual, OUTPUT_COLLECTIONS)
+
+
+# written from the whole book, so nodes that each run some of the shards must not write them
+BOOK_COLLECTIONS = ["cash_forecast", "model_shadow_reports", "customer_search"]
+
+
+def test_split_nodes_write_book_outputs_once(ml_job, inline_pool, monkeypatch, tmp_path):
+    monkeypatch.setattr(ml_job, "SEARCH_MAX_ENTRIES", 8)
+    cases = make_cases()
+    _, expected = run_single(ml_job, cases)
+
+    seed(ml_job, cases)
+    ml_job.run_sharded_ml_job(4, shard_ids=[0, 1], processes=1, today=TODAY,
+                              partials_path=str(tmp_path / "node-a.pkl"))
+    ml_job.run_sharded_ml_job(4, shard_ids=[3, 2], processes=1, today=TODAY,
+                              partials_path=str(tmp_path / "node-b.pkl"))
+    for name in BOOK_COLLECTIONS:
+        assert name not in ml_job.db.store, f"a node wrote {name} from part of the book"
+
+    ml_job.merge_node_partials([str(tmp_path / "node-*.pkl")])
+    assert_same_collections(expected, ml_job.db.store, OUTPUT_COLLECTIONS)
+    assert ml_job.db.store["customer_search"]["_meta"]["customers"] == len(expected["customer_summaries"])
+
+
+def test_partial_node_without_partials_path_skips_book_outputs(ml_job, inline_pool):
+    seed(ml_job, make_cases())
+    stats = ml_job.run_sharded_ml_job(4, shard_ids=[1], processes=1, today=TODAY)
+    assert stats["updated"] > 0
+    for name in BOOK_COLLECTIONS:
+        assert name not in ml_job.db.store
+
+
+def test_merge_node_partials_needs_every_shard_once(ml_job, inline_pool, tmp_path):
+    seed(ml_job, make_cases())
+    node_a = str(tmp_path / "node-a.pkl")
+    ml_job.run_sharded_ml_job(4, shard_ids=[0, 1], processes=1, today=TODAY, partials_path=node_a)
+    with pytest.raises(ValueError, match="cover shards"):
+        ml_job.merge_node_partials([node_a])
+
+    # the same shards saved twice (e.g. a rerun under another name) don't add up either
+    node_b = str(tmp_path / "node-b.pkl")
+    ml_job.run_sharded_ml_job(4, shard_ids=[1, 2, 3], processes=1, today=TODAY,
+                              partials_path=node_b)
+    with pytest.raises(ValueError, match="cover shards"):
+        ml_job.merge_node_partials([node_a, node_b])
+
+    other_day = str(tmp_path / "node-c.pkl")
+    ml_job.run_sharded_ml_job(4, shard_ids=[2, 3], processes=1,
+                              today=TODAY + pd.Timedelta(days=1), partials_path=other_day)
+    with pytest.raises(ValueError, match="another run"):
+        ml_job.merge_node_partials([node_a, other_day])
+
+
+def test_merge_skips_shadow_report_when_nodes_disagree(ml_job, inline_pool, monkeypatch, tmp_path):
+    seed(ml_job, make_cases())
+    ml_job.run_sharded_ml_job(4, shard_ids=[0, 1], processes=1, today=TODAY,
+                              partials_path=str(tmp_path / "node-a.pkl"))
+    monkeypatch.setattr(ml_job, "registry", FakeRegistry(shadow=False))  # node B has no shadow model
+    ml_job.run_sharded_ml_job(4, shard_ids=[2, 3], processes=1, today=TODAY,
+                              partials_path=str(tmp_path / "node-b.pkl"))
+
+    ml_job.merge_node_partials([str(tmp_path / "node-*.pkl")])
+    assert "cash_forecast" in ml_job.db.store
+    assert "model_shadow_reports" not in ml_job.db.store
+
+
+class FailingRegistry(FakeRegistry):
+    """Model loading fails on the `fail_on`-th call, i.e. in one shard."""
+
+    def __init__(self, fail_on):
+        super().__init__()
+        self.calls = 0
+        self.fail_on = fail_on
+
+    def models(self):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise RuntimeError("model file unreadable")
+        return super().models()
+
+
+def test_failed_shard_skips_book_outputs(ml_job, inline_pool, monkeypatch):
+    seed(ml_job, make_cases())
+    monkeypatch.setattr(ml_job, "registry", FailingRegistry(fail_on=2))
+    stats = ml_job.run_sharded_ml_job(4, processes=1, today=TODAY)
+
+    assert stats["failed"]
+    assert stats["updated"] > 0  # the other shards still wrote their invoices
+    for name in BOOK_COLLECTIONS:
+        assert name not in ml_job.db.store, f"{name} was written without the failed shard"
+
+
+def test_merge_refuses_a_node_with_a_failed_shard(ml_job, inline_pool, monkeypatch, tmp_path):
+    seed(ml_job, make_cases())
+    ml_job.run_sharded_ml_job(4, shard_ids=[0, 1], processes=1, today=TODAY,
+                              partials_path=str(tmp_path / "node-a.pkl"))
+    monkeypatch.setattr(ml_job, "registry", FailingRegistry(fail_on=1))
+    ml_job.run_sharded_ml_job(4, shard_ids=[2, 3], processes=1, today=TODAY,
+                              partials_path=str(tmp_path / "node-b.pkl"))
+
+    with pytest.raises(RuntimeError, match="node-b.pkl"):
+        ml_job.merge_node_partials([str(tmp_path / "node-*.pkl")])
+    for name in BOOK_COLLECTIONS:
+        assert name not in ml_job.db.store
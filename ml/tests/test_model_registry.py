@@ -0,0 +1,128 @@
+import os
+import pickle
+
+import pytest
+
+from helpers import TODAY, make_cases
+from model_registry import MANIFEST_NAME, ModelRegistry, register_model, set_role
+
+MODEL_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "model", "payment_delay_lgb_model.txt")
+
+
+def bump_manifest(root):
+    """Makes the manifest change visible to refresh() even on coarse-mtime filesystems."""
+    path = os.path.join(root, MANIFEST_NAME)
+    mtime = os.stat(path).st_mtime_ns + 1_000_000_000
+    os.utime(path, ns=(mtime, mtime))
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = str(tmp_path / "registry")
+    register_model(MODEL_FILE, version="v1", activate=True, root=root)
+    return root
+
+
+def active_version(registry):
+    (version, _), _ = registry.models()
+    return version
+
+
+def test_refresh_keeps_active_model_when_new_one_fails_checksum(root):
+    registry = ModelRegistry(root, legacy_path="missing.txt")
+    register_model(MODEL_FILE, version="v2", root=root)
+    v2_path = os.path.join(root, "payment_delay_lgb_v2.txt")
+    with open(v2_path, "a") as f:
+        f.write("\n# tampered\n")
+
+    set_role("active", "v2", root=root)
+    bump_manifest(root)
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        registry.refresh()
+    assert active_version(registry) == "v1"
+
+    # once the file is fixed, the next refresh retries and swaps
+    with open(MODEL_FILE) as src, open(v2_path, "w") as dst:
+        dst.write(src.read())
+    assert registry.refresh()
+    assert active_version(registry) == "v2"
+
+
+def test_refresh_keeps_active_model_when_new_one_does_not_load(root, tmp_path):
+    registry = ModelRegistry(root, legacy_path="missing.txt")
+    broken = tmp_path / "broken.txt"
+    broken.write_text("not a LightGBM model\n")
+    register_model(str(broken), version="v2", root=root)  # checksum matches; the load fails
+
+    set_role("active", "v2", root=root)
+    bump_manifest(root)
+    with pytest.raises(Exception):
+        registry.refresh()
+    assert active_version(registry) == "v1"
+
+
+def test_broken_shadow_does_not_block_scoring(root, tmp_path):
+    broken = tmp_path / "broken.txt"
+    broken.write_text("not a LightGBM model\n")
+    register_model(str(broken), version="v2", shadow=True, root=root)
+
+    registry = ModelRegistry(root, legacy_path="missing.txt")
+    (version, _), shadow = registry.models()
+    assert version == "v1" and shadow is None
+
+
+def tamper(root, version):
+    with open(os.path.join(root, f"payment_delay_lgb_{version}.txt"), "a") as f:
+        f.write("\n# tampered\n")
+
+
+def test_pin_keeps_the_pinned_models_after_the_manifest_changes(root):
+    registry = ModelRegistry(root, legacy_path="missing.txt")
+    pinned = pickle.loads(pickle.dumps(registry.pin()))
+    assert pinned == registry.pin()
+
+    register_model(MODEL_FILE, version="v2", activate=True, root=root)
+    bump_manifest(root)
+    assert active_version(pinned) == "v1"
+    assert pinned != ModelRegistry(root, legacy_path="missing.txt").pin()
+
+
+def test_pin_loads_lazily_and_verifies_the_checksum(root):
+    pinned = pickle.loads(pickle.dumps(ModelRegistry(root, legacy_path="missing.txt").pin()))
+    tamper(root, "v1")
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        pinned.models()
+
+
+def run_worker_shard(ml_job, pinned):
+    """_run_shard as a freshly spawned worker runs it: no registry in the process yet."""
+    ml_job.registry = None
+    return ml_job._run_shard((0, 2, 1, None, TODAY, None, pinned))
+
+
+def test_shard_worker_scores_with_the_parent_pin(ml_job, root, monkeypatch):
+    ml_job.db.store["cases"] = make_cases(n_cases=200, n_customers=10)
+    pinned = ModelRegistry(root, legacy_path="missing.txt").pin()
+
+    # activated after the parent pinned, and broken: the worker must not pick it up
+    register_model(MODEL_FILE, version="v2", activate=True, root=root)
+    tamper(root, "v2")
+
+    def no_registry(*args, **kwargs):
+        raise AssertionError("a shard worker must not build its own ModelRegistry")
+    monkeypatch.setattr(ml_job, "ModelRegistry", no_registry)
+
+    stats = run_worker_shard(ml_job, pickle.loads(pickle.dumps(pinned)))
+    assert not stats["failed"] and stats["updated"] > 0
+    versions = {case.get("model_version") for case in ml_job.db.store["cases"].values() if "zone" in case}
+    assert versions == {"v1"}
+
+
+def test_shard_worker_fails_its_shard_when_the_pin_does_not_load(ml_job, root):
+    ml_job.db.store["cases"] = make_cases(n_cases=200, n_customers=10)
+    pinned = pickle.loads(pickle.dumps(ModelRegistry(root, legacy_path="missing.txt").pin()))
+    tamper(root, "v1")
+
+    stats = run_worker_shard(ml_job, pinned)
+    assert stats["failed"] and stats["updated"] == 0
@@ -0,0 +1,127 @@
+import time
+
+import pytest
+
+import outreach_queue
+from outreach_queue import OutreachQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = OutreachQueue(str(tmp_path / "queue.db"))
+    yield q
+    q.close()
+
+
+def status(queue, key):
+    return queue.conn.execute(
+        "SELECT status FROM outreach_jobs WHERE idempotency_key = ?", (key,)
+    ).fetchone()["status"]
+
+
+def test_new_day_supersedes_unsent_retry(queue):
+    assert queue.enqueue("c1", "MAIL", {"n": 1}, run_date="2026-01-01")
+    [job] = queue.lease("MAIL", "w1")
+    assert queue.fail(job["idempotency_key"], "w1", "smtp down")
+
+    assert queue.enqueue("c1", "MAIL", {"n": 2}, run_date="2026-01-02")
+    assert not queue.enqueue("c1", "MAIL", {"n": 2}, run_date="2026-01-02")
+    assert status(queue, "c1:MAIL:2026-01-01") == "SUPERSEDED"
+
+    # the old retry is never handed out again, even once its backoff is over
+    queue.conn.execute("UPDATE outreach_jobs SET available_at = 0")
+    assert [j["idempotency_key"] for j in queue.lease("MAIL", "w1")] == ["c1:MAIL:2026-01-02"]
+
+
+def test_new_day_keeps_sent_job_for_bookkeeping(queue):
+    queue.enqueue("c1", "MAIL", {}, run_date="2026-01-01")
+    [job] = queue.lease("MAIL", "w1")
+    assert queue.mark_sent(job["idempotency_key"], "w1", "body")
+
+    queue.enqueue("c1", "MAIL", {}, run_date="2026-01-02")
+    assert status(queue, "c1:MAIL:2026-01-01") == "LEASED"
+
+
+def test_other_channel_is_not_superseded(queue):
+    queue.enqueue("c1", "CALL", {}, run_date="2026-01-01")
+    queue.enqueue("c1", "MAIL", {}, run_date="2026-01-02")
+    assert status(queue, "c1:CALL:2026-01-01") == "PENDING"
+
+
+def test_expired_lease_cannot_send_or_complete(queue):
+    queue.enqueue("c1", "MAIL", {}, run_date="2026-01-01")
+    [job] = queue.lease("MAIL", "w1", lease_seconds=-1)
+    key = job["idempotency_key"]
+
+    [taken] = queue.lease("MAIL", "w2")
+    assert taken["idempotency_key"] == key
+
+    assert not queue.renew(key, "w1")
+    assert queue.mark_sent(key, "w1", "body") is None
+    assert not queue.complete(key, "w1")
+    assert not queue.fail(key, "w1", "late")
+
+    assert queue.renew(key, "w2")
+    assert queue.mark_sent(key, "w2", "body")
+    assert queue.complete(key, "w2")
+    assert status(queue, key) == "DONE"
+
+
+def test_renew_refuses_sent_job(queue):
+    queue.enqueue("c1", "MAIL", {}, run_date="2026-01-01")
+    [job] = queue.lease("MAIL", "w1")
+    queue.mark_sent(job["idempotency_key"], "w1", "body")
+    assert not queue.renew(job["idempotency_key"], "w1")
+
+
+def test_wait_for_retries(queue, monkeypatch):
+    slept = []
+    monkeypatch.setattr(outreach_queue.time, "sleep", slept.append)
+    assert not queue.wait_for_retries("MAIL")
+
+    queue.enqueue("c1", "MAIL", {}, run_date="2026-01-01")
+    [job] = queue.lease("MAIL", "w1")
+    queue.fail(job["idempotency_key"], "w1", "first failure")  # ~30s backoff
+    assert queue.wait_for_retries("MAIL", max_wait=60)
+    assert len(slept) == 1 and 0 < slept[0] <= 60
+
+    # a backoff longer than max_wait is left to the next run
+    queue.conn.execute("UPDATE outreach_jobs SET available_at = ?", (time.time() + 3600,))
+    assert not queue.wait_for_retries("MAIL", max_wait=60)
+    assert len(slept) == 1
+
+
+def test_stale_retry_is_superseded_when_the_case_no_longer_qualifies(queue):
+    def is_mail_case(data):
+        return data is not None and data.get("isOpen") == "1" and data.get("zone") == "YELLOW"
+
+    for case_id in ("paid", "moved", "deleted", "due"):
+        queue.enqueue(case_id, "MAIL", {"isOpen": "1", "zone": "YELLOW", "amount": 100}, run_date="2026-01-01")
+    for job in queue.lease("MAIL", "w1"):
+        queue.fail(job["idempotency_key"], "w1", "smtp down")
+
+    # next day, the backoff is over but none of the cases were re-enqueued
+    queue.conn.execute("UPDATE outreach_jobs SET available_at = 0")
+    jobs = queue.lease("MAIL", "w2")
+    assert len(jobs) == 4
+    current = {
+        "paid": {"isOpen": "0", "zone": "YELLOW", "amount": 0},
+        "moved": {"isOpen": "1", "zone": "RED", "amount": 100},
+        "deleted": None,
+        "due": {"isOpen": "1", "zone": "YELLOW", "amount": 60},
+    }
+    [due] = queue.supersede_stale(jobs, "w2", current, is_mail_case)
+
+    assert due["case_id"] == "due" and due["payload"]["amount"] == 60
+    for case_id in ("paid", "moved", "deleted"):
+        assert status(queue, f"{case_id}:MAIL:2026-01-01") == "SUPERSEDED"
+    assert queue.lease("MAIL", "w3", lease_seconds=-1) == []
+
+
+def test_supersede_needs_the_lease(queue):
+    queue.enqueue("c1", "MAIL", {}, run_date="2026-01-01")
+    [job] = queue.lease("MAIL", "w1")
+    assert not queue.supersede(job["idempotency_key"], "w2", "not mine")
+    queue.mark_sent(job["idempotency_key"], "w1", "body")
+    assert not queue.supersede(job["idempotency_key"], "w1", "already sent")
+    assert status(queue, job["idempotency_key"]) == "LEASED"
@@ -0,0 +1,59 @@
+"""The simulator's vectorized zoning must match what the ML job writes for the same policy."""
+import itertools
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers import TODAY
+from policy_simulator import DEFAULT_POLICY, ZONES, assign_zones, simulate_policies
+
+
+def scored_frame():
+    """Every combination around the rule boundaries: SLA thresholds, due / SLA / predicted dates, missing values."""
+    late_ratios = [np.nan, 0.0, 0.19, 0.2, 0.49, 0.5, 0.79, 0.8, 1.0]
+    due_offsets = [None, -16, -15, -11, -10, -6, -5, -3, -1, 0, 1, 7]
+    predicted_offsets = [None, -2, -1, 0, 1, 5]
+    delays = [np.nan, 0.0, 2.5, 3.0, 4.9, 5.0, 10.0, 14.9, 15.0, 30.0]
+    day = lambda offset: pd.NaT if offset is None else TODAY + pd.Timedelta(days=offset)
+    rows = [
+        {"late_payment_ratio": late, "due_date": day(due), "predicted_payment_date": day(predicted),
+         "predicted_delay": delay}
+        for late, due, predicted, delay in itertools.product(late_ratios, due_offsets, predicted_offsets, delays)
+    ]
+    df = pd.DataFrame(rows)
+    df["total_open_amount"] = 1_000_000.01 + np.arange(len(df)) * 0.37
+    return df
+
+
+def job_zones(ml_job, df):
+    """Zones as write_predictions() computes them: derive_sla_days() + assign_zone()."""
+    zones = []
+    for row in df.itertuples():
+        sla_days = ml_job.derive_sla_days(row.late_payment_ratio)
+        sla_date = row.due_date + timedelta(days=sla_days) if pd.notna(row.due_date) else None
+        zones.append(ml_job.assign_zone(row.predicted_delay, sla_days, sla_date, row.due_date,
+                                        today=TODAY, predicted_payment_date=row.predicted_payment_date))
+    return np.array(zones, dtype=object)
+
+
+def test_default_policy_reproduces_the_job_rules(ml_job):
+    df = scored_frame()
+    expected = job_zones(ml_job, df)
+    assert set(expected) == set(ZONES)
+    np.testing.assert_array_equal(assign_zones(df, TODAY, DEFAULT_POLICY), expected)
+
+
+def test_reported_amounts_are_exact_sums(monkeypatch):
+    monkeypatch.setattr("policy_simulator.MAX_CELLS_PER_STEP", 2048)  # several chunks
+    df = scored_frame()
+    strict = {"name": "strict", "sla_days": [2, 3, 5, 7], "honor_predicted_date": False}
+    report = simulate_policies(df, [DEFAULT_POLICY, strict], today=TODAY).set_index("policy")
+
+    for policy in (DEFAULT_POLICY, strict):
+        by_zone = df["total_open_amount"].groupby(assign_zones(df, TODAY, policy)).sum()
+        row = report.loc[policy["name"]]
+        for zone in ZONES:
+            assert row[f"{zone.lower()}_amount"] == pytest.approx(by_zone.get(zone, 0.0), rel=0, abs=1e-6)
+        assert row["amount_at_risk"] == pytest.approx(by_zone.get("ORANGE", 0.0) + by_zone.get("RED", 0.0), rel=0, abs=1e-6)
@@ -0,0 +1,159 @@
+"""The zone schedule must reproduce assign_zone() day by day, and the scheduler must apply it safely."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from fake_firestore import FakeFirestore
+from helpers import TODAY
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """zone_scheduler and the dispatcher it hands RED cases to, on one in-memory Firestore."""
+    import dispatcher
+    import zone_scheduler
+    db = FakeFirestore()
+    monkeypatch.setattr(zone_scheduler, "db", db)
+    monkeypatch.setattr(dispatcher, "db", db)
+    return zone_scheduler
+
+
+def day(offset):
+    return TODAY + pd.Timedelta(days=offset)
+
+
+def iso(offset):
+    return day(offset).strftime("%Y-%m-%d")
+
+
+def zone_on(ml_job, case, today):
+    return ml_job.assign_zone(case["pred_delay"], case["sla_days"], case["sla_date"], case["due_date"],
+                              today=today, predicted_payment_date=case["predicted_payment_date"])
+
+
+def test_transitions_follow_the_case_through_every_zone(ml_job):
+    # due in 4 days, paid 3 days late (before the 10-day SLA runs out)
+    transitions = ml_job.zone_transitions(3.0, 10, day(14), day(4), today=TODAY, predicted_payment_date=day(7))
+    assert transitions == [(day(4), "YELLOW"), (day(8), "ORANGE"), (day(14), "RED")]
+
+
+def test_transitions_match_assign_zone_every_day(ml_job):
+    rng = np.random.default_rng(7)
+    for _ in range(300):
+        sla_days = int(rng.choice([3, 5, 10, 15]))
+        due = day(int(rng.integers(-20, 20))) if rng.random() < 0.95 else pd.NaT
+        pred_delay = float(rng.integers(-5, 25)) if rng.random() < 0.9 else np.nan
+        case = {
+            "pred_delay": pred_delay,
+            "sla_days": sla_days,
+            "sla_date": due + pd.Timedelta(days=sla_days) if pd.notna(due) else None,
+            "due_date": due,
+            "predicted_payment_date": due + pd.Timedelta(days=pred_delay) if pd.notna(due) and pd.notna(pred_delay) else pd.NaT,
+        }
+        transitions = ml_job.zone_transitions(case["pred_delay"], case["sla_days"], case["sla_date"], case["due_date"],
+                                              today=TODAY, predicted_payment_date=case["predicted_payment_date"])
+        assert [d for d, _ in transitions] == sorted(d for d, _ in transitions)
+
+        zone = zone_on(ml_job, case, TODAY)
+        for offset in range(1, 50):
+            zone = dict(transitions).get(day(offset), zone)
+            assert zone == zone_on(ml_job, case, day(offset)), (case, offset)
+
+
+def seed_case(db, case_id="c1", zone="GREEN", isOpen="1", due_on=4, target="YELLOW", upcoming=((8, "ORANGE"), (14, "RED"))):
+    db.store.setdefault("cases", {})[case_id] = {"cust_number": "C0001", "zone": zone, "action": "NO_ACTION",
+                                                 "escalated": False, "isOpen": isOpen}
+    db.store.setdefault("zone_schedule", {})[case_id] = {
+        "case_id": case_id, "cust_number": "C0001", "due_on": iso(due_on), "target_zone": target,
+        "upcoming": [{"due_on": iso(d), "zone": z} for d, z in upcoming],
+    }
+
+
+def test_nothing_due_is_left_alone(scheduler):
+    seed_case(scheduler.db)
+    before = {name: dict(docs) for name, docs in scheduler.db.store.items()}
+    assert scheduler.promote_due_cases(today=iso(3)) == 0
+    assert scheduler.db.store == before
+
+
+def test_catches_up_on_every_change_that_came_due(scheduler):
+    seed_case(scheduler.db)
+    assert scheduler.promote_due_cases(today=iso(10)) == 1
+
+    case = scheduler.db.store["cases"]["c1"]
+    assert (case["zone"], case["action"], case["escalated"]) == ("ORANGE", "CALL", False)
+    entry = scheduler.db.store["zone_schedule"]["c1"]
+    assert (entry["due_on"], entry["target_zone"], entry["upcoming"]) == (iso(14), "RED", [])
+
+
+def test_red_cases_are_handed_to_the_dispatcher(scheduler):
+    seed_case(scheduler.db)
+    seed_case(scheduler.db, "c2", zone="ORANGE", due_on=14, target="RED", upcoming=())
+    assert scheduler.promote_due_cases(today=iso(20)) == 2
+
+    for case_id in ("c1", "c2"):
+        case = scheduler.db.store["cases"][case_id]
+        assert (case["zone"], case["action"], case["escalated"]) == ("RED", "ESCALATE", True)
+        assert case["assigned_to"] and case["queue_status"] == "PENDING"
+    assert scheduler.db.store["zone_schedule"] == {}
+
+
+def test_entry_already_at_its_zone_just_advances(scheduler):
+    seed_case(scheduler.db, zone="YELLOW")
+    assert scheduler.promote_due_cases(today=iso(5)) == 0
+    assert "zone_promoted_at" not in scheduler.db.store["cases"]["c1"]
+    assert scheduler.db.store["zone_schedule"]["c1"]["due_on"] == iso(8)
+
+
+def test_closed_and_deleted_cases_drop_their_entries(scheduler):
+    seed_case(scheduler.db, "paid", isOpen="0")
+    seed_case(scheduler.db, "gone")
+    del scheduler.db.store["cases"]["gone"]
+    assert scheduler.promote_due_cases(today=iso(20)) == 0
+
+    assert scheduler.db.store["zone_schedule"] == {}
+    assert scheduler.db.store["cases"]["paid"]["zone"] == "GREEN"
+    assert "gone" not in scheduler.db.store["cases"]
+
+
+def rescore_after_read(scheduler, monkeypatch, case_id, case_update, schedule=None):
+    """Writes to the case (and its schedule) right after the scheduler has read them, like an ML run would."""
+    db = scheduler.db
+    get_all = db.get_all
+
+    def racing_get_all(refs):
+        snapshots = get_all(refs)
+        batch = db.batch()
+        batch.update(db.collection("cases").document(case_id), case_update)
+        if schedule is not None:
+            batch.set(db.collection("zone_schedule").document(case_id), schedule)
+        batch.commit()
+        monkeypatch.setattr(db, "get_all", get_all)
+        return snapshots
+    monkeypatch.setattr(db, "get_all", racing_get_all)
+
+
+def test_ml_rescoring_during_a_poll_wins(scheduler, monkeypatch):
+    seed_case(scheduler.db)
+    seed_case(scheduler.db, "c2", due_on=1, target="YELLOW", upcoming=())
+    # the ML job rescores c1 (paid on time after all): GREEN until a later due date
+    ml_schedule = {"case_id": "c1", "cust_number": "C0001", "due_on": iso(30), "target_zone": "YELLOW", "upcoming": []}
+    rescore_after_read(scheduler, monkeypatch, "c1", {"zone": "GREEN", "action": "NO_ACTION"}, ml_schedule)
+
+    assert scheduler.promote_due_cases(today=iso(10)) == 1
+    assert scheduler.db.store["cases"]["c1"]["zone"] == "GREEN"
+    assert scheduler.db.store["zone_schedule"]["c1"] == ml_schedule
+    # the other case isn't held up
+    assert scheduler.db.store["cases"]["c2"]["zone"] == "YELLOW"
+    assert scheduler.promote_due_cases(today=iso(10)) == 0
+
+
+def test_case_edited_during_a_poll_is_promoted_on_the_next(scheduler, monkeypatch):
+    seed_case(scheduler.db)
+    rescore_after_read(scheduler, monkeypatch, "c1", {"notes": "called, promised payment"})
+
+    assert scheduler.promote_due_cases(today=iso(10)) == 0
+    assert scheduler.db.store["cases"]["c1"]["zone"] == "GREEN"
+    assert scheduler.promote_due_cases(today=iso(10)) == 1
+    case = scheduler.db.store["cases"]["c1"]
+    assert (case["zone"], case["notes"]) == ("ORANGE", "called, promised payment")
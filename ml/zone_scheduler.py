@@ -0,0 +1,148 @@
+import firebase_admin
+from firebase_admin import firestore
+from google.cloud.firestore import FieldFilter
+from google.api_core import exceptions
+from datetime import datetime
+import time
+import os
+
+# ----------------------------------
+# 1. EMULATOR CONFIGURATION
+# ----------------------------------
+os.environ["FIRESTORE_EMULATOR_HOST"] = "127.0.0.1:8085"
+os.environ["GCLOUD_PROJECT"] = "fedex-dca"
+
+if not firebase_admin._apps:
+    firebase_admin.initialize_app(options={"projectId": "fedex-dca"})
+
+db = firestore.client()
+
+from dispatcher import dispatch_cases
+
+# ----------------------------------
+# 2. CONFIG
+# ----------------------------------
+# Written by ml_job.py: one doc per open case holding its next date-driven
+# zone change (`due_on`, `target_zone`) plus any later ones (`upcoming`).
+ZONE_SCHEDULE_COLLECTION = "zone_schedule"
+POLL_SECONDS = 60
+
+# Keep in sync with the zone -> action mapping in ml_job.py
+ZONE_ACTIONS = {
+    "GREEN": "NO_ACTION",
+    "YELLOW": "MAIL",
+    "ORANGE": "CALL",
+    "RED": "ESCALATE",
+}
+
+# ----------------------------------
+# 3. SCHEDULER LOGIC
+# ----------------------------------
+def is_open_case(data):
+    # Same precedence as the is_open_flag derivation in ml_job.py
+    if "isOpen" in data:
+        return str(data["isOpen"]) in ("1", "true", "True")
+    if "is_open" in data:
+        return data["is_open"] == 1
+    return not data.get("clear_date")
+
+def unchanged_since(snap):
+    """Write precondition: the doc must not have been written since `snap` was read."""
+    return db.write_option(last_update_time=snap.update_time)
+
+def promote_due_cases(today=None):
+    """
+    Applies every scheduled zone change that has come due, then hands newly
+    RED cases to the dispatcher. Only due schedule entries (and their cases)
+    are read, so the cost is O(due cases) rather than O(open book).
+
+    Each case commits on its own, guarded on the case and its schedule entry
+    being unchanged since they were read (the ML job rewrites both together):
+    if the case was rescored in between, its zone and schedule win and the entry
+    is looked at again on the next poll.
+    """
+    today = today or datetime.now().date().isoformat()
+
+    due_entries = list(
+        db.collection(ZONE_SCHEDULE_COLLECTION)
+          .where(filter=FieldFilter("due_on", "<=", today))
+          .stream()
+    )
+    if not due_entries:
+        return 0
+
+    cases_ref = db.collection("cases")
+    case_snapshots = {
+        snap.id: snap for snap in db.get_all([cases_ref.document(e.id) for e in due_entries])
+    }
+
+    promoted = 0
+    changed = 0
+    newly_red = []
+
+    for entry in due_entries:
+        schedule = entry.to_dict()
+        case = case_snapshots.get(entry.id)
+        batch = db.batch()
+        promote_to = None
+
+        # Paid / deleted since the last ML run: drop the entry
+        if case is None or not case.exists or not is_open_case(case.to_dict()):
+            batch.delete(entry.reference, option=unchanged_since(entry))
+        else:
+            # Catch up on every change that came due (e.g. scheduler was down for days)
+            target = schedule["target_zone"]
+            upcoming = list(schedule.get("upcoming", []))
+            while upcoming and upcoming[0]["due_on"] <= today:
+                target = upcoming.pop(0)["zone"]
+
+            if case.to_dict().get("zone") != target:
+                promote_to = target
+                batch.update(cases_ref.document(entry.id), {
+                    "zone": target,
+                    "action": ZONE_ACTIONS.get(target, "CALL"),
+                    "escalated": target == "RED",
+                    "zone_promoted_at": firestore.SERVER_TIMESTAMP
+                }, option=unchanged_since(case))
+
+            if upcoming:
+                batch.update(entry.reference, {
+                    "due_on": upcoming[0]["due_on"],
+                    "target_zone": upcoming[0]["zone"],
+                    "upcoming": upcoming[1:]
+                }, option=unchanged_since(entry))
+            else:
+                batch.delete(entry.reference, option=unchanged_since(entry))
+
+        try:
+            batch.commit()
+        except exceptions.FailedPrecondition:
+            changed += 1
+            continue
+
+        if promote_to is not None:
+            promoted += 1
+            print(f"⏫ Case {entry.id}: {case.to_dict().get('zone')} → {promote_to}")
+            if promote_to == "RED":
+                newly_red.append(case)
+
+    if changed:
+        print(f"↩️ {changed} cases changed while promoting; they are retried on the next poll.")
+
+    if newly_red:
+        assigned = dispatch_cases(newly_red)
+        print(f"🚨 Escalated {len(newly_red)} cases, {assigned} handed to agents.")
+
+    return promoted
+
+# ----------------------------------
+# 4. RUN LOOP
+# ----------------------------------
+if __name__ == "__main__":
+    print(f"⏰ Zone Scheduler Started on {os.environ['FIRESTORE_EMULATOR_HOST']}")
+    print("   (Press Ctrl+C to stop)")
+    while True:
+        promoted = promote_due_cases()
+        if promoted:
+            print(f"✅ Promoted {promoted} cases.")
+        time.sleep(POLL_SECONDS)